@@ -21,6 +21,7 @@ import stroke_maps.load_data
 import utilities_maps.maps as maps
 import utilities_maps.plot_maps as plot_maps
 import utilities_maps.container_inputs as inputs
+from utilities_maps.travel_times import load_travel_times
 
 
 # ###########################
@@ -36,11 +37,9 @@ st.set_page_config(
 container_maps = st.empty()
 
 
-# Import the full travel time matrix:
-df_travel_times = pd.read_csv(
-    './data_maps/lsoa_travel_time_matrix_calibrated.csv', index_col='LSOA')
-# Rename index to 'lsoa':
-df_travel_times.index.name = 'lsoa'
+# The full travel time matrix. Its index is already named 'lsoa' and
+# only the units that are used are read from disk:
+df_travel_times = load_travel_times()
 
 
 # #################################
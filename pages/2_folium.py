@@ -25,10 +25,20 @@ import numpy as np
 # import cPickle
 # For the colour bar:
 import branca
-from geojson_rewind import rewind
 
 # Custom functions:
 from utilities_maps.fixed_params import page_setup
+from utilities_maps.load_data import (
+    import_geojson, import_geojson_problems, copy_geojson_properties)
+from utilities_maps.geometry_store import (
+    import_region_geojson, import_viewport_geojson, pad_bounds)
+from utilities_maps.maps_folium import (
+    estimate_map_bounds, read_st_folium_view, make_hospital_marker_layer,
+    make_area_layer)
+from utilities_maps.topology import (
+    import_region_topojson, copy_topojson_properties)
+from utilities_maps.region_outlines import select_region_outlines
+from utilities_maps.travel_times import load_travel_times
 
 from datetime import datetime
 
@@ -75,41 +85,7 @@ def import_hospital_geojson(hospital_postcode, MT=False):
     return geojson_ew
 
 
-def import_geojson(geojson_file=''):
-    if len(geojson_file) < 1:
-        geojson_file = 'LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced3.geojson'
-    with open('./data_maps/' + geojson_file) as f:
-        geojson_ew = json.load(f)
-    return geojson_ew
-
-
-def draw_map(
-        lat_hospital, long_hospital, geojson_list, region_list,
-        df_placeholder, df_hospitals,
-        # nearest_hospital_geojson_list, nearest_mt_hospital_geojson_list,
-        choro_bins=6
-        ):
-    # Create a map
-    clinic_map = folium.Map(location=[lat_hospital, long_hospital],
-                            zoom_start=9,
-                            tiles='cartodbpositron',
-                            # prefer_canvas=True,
-                            # Override how much people can zoom in or out:
-                            min_zoom=0,
-                            max_zoom=18,
-                            width=1200,
-                            height=600
-                            )
-
-    # # Add markers
-    # for (index, row) in df_clinics.iterrows():
-    #     pop_up_text = f"The postcode for {row.loc['Name']} " + \
-    #                     f"({row.loc['Clinic']}) is {row.loc['postcode']}"
-    #     folium.Marker(location=[row.loc['lat'], row.loc['long']], 
-    #                   popup=pop_up_text, 
-    #                   tooltip=row.loc['Name']).add_to(clinic_map)
-    # folium.features.GeoJsonTooltip(['travel_time_mins'])
-
+def make_step_colourmap():
     outcome_min = 0
     outcome_max = 1
     choro_bins = np.linspace(outcome_min, outcome_max, 7)
@@ -123,179 +99,67 @@ def draw_map(
         caption='Placeholder',
         index=choro_bins
     )
+    return colormap
+
+
+def make_base_map(
+        lat_start, long_start, df_hospitals, colormap, zoom_start=9,
+        region_borders=None
+        ):
+    """
+    The parts of the map that don't change with the outcome.
+
+    st_folium only re-mounts the map in the browser when the map's
+    script changes, so nothing in here should depend on the outcome
+    or on the current view. The LSOA and their colours are added
+    separately by make_choropleth_group(), so their polygons are
+    only sent once.
+
+    Inputs
+    ------
+    lat_start, long_start - float. Where the map first opens.
+    df_hospitals          - pd.DataFrame. For the hospital markers.
+    colormap              - branca colormap. Shown as the legend.
+    zoom_start            - int. Starting zoom level.
+    region_borders        - dict or None. GeoJSON of region outlines
+                            with a 'region' property.
+
+    Returns
+    -------
+    clinic_map - folium.Map.
+    """
+    # Create a map
+    clinic_map = folium.Map(location=[lat_start, long_start],
+                            zoom_start=zoom_start,
+                            tiles='cartodbpositron',
+                            # prefer_canvas=True,
+                            # Override how much people can zoom in or out:
+                            min_zoom=0,
+                            max_zoom=18,
+                            width=1200,
+                            height=600
+                            )
     colormap.add_to(clinic_map)
     # fg.add_child(colormap)  # doesn't work
 
-
-    # fg = folium.FeatureGroup(name="test")
-    
-    # Add choropleth
-    for g, geojson_ew in enumerate(geojson_list):
-        # a = folium.Choropleth(geo_data=geojson_ew,
-        #                 name=region_list[g], # f'choropleth_{g}',
-        #                 bins=choro_bins,
-        #                 data=df_placeholder,
-        #                 columns=['LSOA11NMW', 'Placeholder'],
-        #                 key_on='feature.id',
-        #                 fill_color='OrRd',
-        #                 fill_opacity=0.5,
-        #                 line_opacity=0.5,
-        #                 legend_name='Placeholder',
-        #                 highlight=True,
-        #                 #   tooltip='travel_time_mins',
-        #                 smooth_factor=1.5,
-        #                 show=False if g > 0 else True
-        #                 ).add_to(clinic_map)
-        # st.write(g)
-        # st.write(a)
-        # st.write(' ')
-
-
-
-        # # fg.add_child(
-        folium.GeoJson(
-            data=geojson_ew,
-            tooltip=GeoJsonTooltip(
-                fields=['LSOA11NMW'],
-                aliases=[''],
-                localize=True
-                ),
-            # lambda x:f"{x['properties']['LSOA11NMW']}",
-            # popup=popup,
-            name=region_list[g],
-            style_function= lambda y:{
-                # "fillColor": colormap(y["properties"]["Estimate_UN"]),
-                "fillColor": colormap(df_placeholder[df_placeholder['LSOA11NMW'] == y['properties']['LSOA11NMW']]['Placeholder'].iloc[0]),
-                # "fillColor": colormap(df_placeholder[df_placeholder['LSOA11NMW'] == y['geometries']['properties']['LSOA11NMW']]['Placeholder'].iloc[0]),
-                'stroke':'false',
-                'opacity': 0.5,
-                'color':'black',  # line colour
-                'weight':0.5,
-                # 'dashArray': '5, 5'
+    # Region borders merged from the same LSOA, so they line up:
+    if region_borders is not None:
+        make_area_layer(
+            region_borders,
+            style_function=lambda y: {
+                'fillOpacity': 0,
+                'opacity': 0.8,
+                'color': 'black',
+                'weight': 2.0,
             },
-            highlight_function=lambda x: {'weight': 2.0},
-            smooth_factor=1.5,  # 2.0 is about the upper limit here
-            show=False if g > 0 else True
+            name='Region borders',
+            tooltip_fields=['region'],
             ).add_to(clinic_map)
-        # ))
-
-        # folium.TopoJson(
-        #     data=geojson_ew,
-        #     # tooltip=GeoJsonTooltip(
-        #     #     fields=['LSOA11NMW'],
-        #     #     aliases=[''],
-        #     #     localize=True
-        #     #     ),
-        #     # lambda x:f"{x['properties']['LSOA11NMW']}",
-        #     # popup=popup,
-        #     # name=region_list[g],
-        #     object_path='LSOA_South~West',
-        #     # style_function= lambda y:{
-        #     #     # "fillColor": colormap(y["properties"]["Estimate_UN"]),
-        #     #     # "fillColor": colormap(df_placeholder[df_placeholder['LSOA11NMW'] == y['properties']['LSOA11NMW']]['Placeholder'].iloc[0]),
-        #     #     "fillColor": colormap(df_placeholder[df_placeholder['LSOA11NMW'] == y['geometries']['properties']['LSOA11NMW']]['Placeholder'].iloc[0]),
-        #     #     'stroke':'false',
-        #     #     'opacity': 0.5,
-        #     #     'color':'black',  # line colour
-        #     #     'weight':0.5,
-        #     #     # 'dashArray': '5, 5'
-        #     # },
-        #     # highlight_function=lambda x: {'weight': 2.0},
-        #     # smooth_factor=1.5,  # 2.0 is about the upper limit here
-        #     # show=False if g > 0 else True
-        #     ).add_to(clinic_map)
-
-    # import matplotlib.colors
-    # colours = list(matplotlib.colors.cnames.values())
-    # # st.write(colours)
-    # for g, geojson_ew in enumerate(nearest_hospital_geojson_list):
-    #     colour_here = colours[g]
-
-
-    #     # fg.add_child(
-    #     folium.GeoJson(
-    #         data=geojson_ew,
-    #         # tooltip=GeoJsonTooltip(
-    #         #     fields=['LSOA11NMW'],
-    #         #     aliases=[''],
-    #         #     localize=True
-    #         #     ),
-    #         # lambda x:f"{x['properties']['LSOA11NMW']}",
-    #         # popup=popup,
-    #         name='placeholder_'+str(g), #region_list[g],
-    #         style_function= lambda y:{
-    #             # "fillColor": , #f'{colour_here}',# 'rgba(0, 0, 0, 0)',
-    #             'stroke':'false',
-    #             'opacity': 0.5,
-    #             'color':'black',  # line colour
-    #             'weight': 3,
-    #             'dashArray': '5, 5'
-    #         },
-    #         # highlight_function=lambda x: {'fillOpacity': 0.8},
-    #         smooth_factor=1.5,  # 2.0 is about the upper limit here
-    #         show=True, # if g > 0 else True
-    #         overlay=False
-    #     # ))
-    #         ).add_to(clinic_map)
-
-
-    # Problem - no way to set colour scale max and min,
-    # get a new colour scale for each choropleth.
-
 
     # Add markers
-    for (index, row) in df_hospitals.iterrows():
-        # pop_up_text = f'{row.loc["Stroke Team"]}'
-
-        # if last_object_clicked_tooltip == row.loc['Stroke Team']:
-        #     icon = folium.Icon(
-        #         # color='black',
-        #         # icon_color='white',
-        #         icon='star', #'fa-solid fa-hospital',#'info-sign',
-        #         # angle=0,
-        #         prefix='glyphicon')#, prefix='fa')
-        # else:
-        icon = None
-
-
-        # fg.add_child(
-        folium.Marker(location=[row.loc['lat'], row.loc['long']], 
-                    # popup=pop_up_text, 
-                    tooltip=row.loc['Stroke Team']
-        # ))
-                    ).add_to(clinic_map)
-        # folium.Circle(
-        #     radius=100, # metres
-        #     location=[row.loc['lat'], row.loc['long']],
-        #     popup=pop_up_text,
-        #     color='black',
-        #     tooltip=row.loc['Stroke Team'],
-        #     fill=False,
-        #     weight=1
-        # ).add_to(clinic_map)
-        # fg.add_child(
-        #     folium.Marker(location=[row.loc['lat'], row.loc['long']], 
-        #               popup=pop_up_text, 
-        #               tooltip=row.loc['Name'],
-        #               icon=icon
-        #               )
-        # )
-
-    # # Add choropleth
-    # fg.add_child(
-    #     folium.Choropleth(geo_data=geojson_cornwall,
-    #                     name='choropleth',
-    #                     data=df_travel_times,
-    #                     columns=['LSOA11CD', 'travel_time_mins'],
-    #                     key_on='feature.id',
-    #                     fill_color='OrRd',
-    #                     fill_opacity=0.5,
-    #                     line_opacity=0.5,
-    #                     legend_name='travel_time_mins',
-    #                     highlight=True
-    #                     )
-    #                     )#.add_to(clinic_map)
-
+    # (one layer of points for all hospitals instead of
+    # one folium.Marker each)
+    make_hospital_marker_layer(df_hospitals).add_to(clinic_map)
 
     # # This works for starting the map in this area
     # # with the max zoom possible.
@@ -308,22 +172,110 @@ def draw_map(
     #     ).add_to(clinic_map)
 
     folium.map.LayerControl().add_to(clinic_map)
-    # fg.add_child(folium.map.LayerControl())
+    return clinic_map
+
+
+def make_choropleth_group(geojson_list, df_placeholder, colormap):
+    """
+    The LSOA and their outcome colours in one FeatureGroup that can
+    be swapped.
+
+    Inputs
+    ------
+    geojson_list   - list. LSOA geojson or TopoJSON to colour in.
+                     folium adds styles to the features, so don't
+                     pass shared cached data.
+    df_placeholder - pd.DataFrame. 'LSOA11NMW' and 'Placeholder'
+                     columns with the value to colour each LSOA by.
+    colormap       - branca colormap.
+
+    Returns
+    -------
+    fg - folium.FeatureGroup.
+    """
+    # Look up values by name in a dict rather than filtering
+    # the dataframe once for every feature:
+    values = dict(zip(
+        df_placeholder['LSOA11NMW'],
+        df_placeholder['Placeholder'].astype(float)
+        ))
+
+    def style_function(y):
+        value = values.get(y['properties']['LSOA11NMW'])
+        style = {
+            'fillColor': 'rgba(0, 0, 0, 0)' if value is None
+            else colormap(value),
+            'fillOpacity': 0.5,
+            'opacity': 0.5,
+            'color': 'black',  # line colour
+            'weight': 0.5,
+        }
+        return style
+
+    fg = folium.FeatureGroup(name='Outcome')
+    for geojson_ew in geojson_list:
+        fg.add_child(make_area_layer(
+            geojson_ew,
+            style_function=style_function,
+            tooltip_fields=['LSOA11NMW'],
+            highlight_function=lambda x: {'weight': 2.0},
+            ))
+    return fg
+
+
+def draw_map(
+        lat_hospital, long_hospital, geojson_list,
+        df_placeholder, df_hospitals,
+        choro_bins=6,
+        map_key=None,
+        region_borders=None
+        ):
+    """
+    Draw the map with a choropleth that can change without the rest
+    of the map being sent again.
+
+    The base map is the same on every rerun so st_folium keeps it
+    mounted in the browser. The choropleth goes in through
+    feature_group_to_add, which st_folium swaps in place, and the
+    selected hospital is shown by panning rather than by moving the
+    map's start location.
+
+    Inputs
+    ------
+    map_key        - str or None. st_folium key. If set, the map
+                     returns its bounds, centre and zoom.
+    region_borders - dict or None. GeoJSON of region outlines to draw
+                     in the base map.
+
+    Returns
+    -------
+    output - dict. The values returned by st_folium.
+    """
+    colormap = make_step_colourmap()
+
+    # Start all maps from the same place so that changing hospital
+    # doesn't change the base map:
+    clinic_map = make_base_map(
+        df_hospitals['lat'].mean(), df_hospitals['long'].mean(),
+        df_hospitals,
+        colormap,
+        region_borders=region_borders
+        )
+    fg = make_choropleth_group(geojson_list, df_placeholder, colormap)
 
     # Generate map
-    # clinic_map
+    # The view is only needed when drawing the LSOA in view.
+    returned_objects = [] if map_key is None else ['bounds', 'center', 'zoom']
     output = st_folium(
         clinic_map,
-        # feature_group_to_add=fg,
-        returned_objects=[
-            # 'bounds',
-            # 'center',
-            # "last_object_clicked", #_tooltip",
-            # 'zoom'
-        ],
+        feature_group_to_add=fg,
+        center=(lat_hospital, long_hospital),
+        returned_objects=returned_objects,
+        key=map_key
         )
     st.write(output)
     # st.stop()
+    return output
 
 
 
@@ -363,50 +315,18 @@ def draw_map_circles(lat_hospital, long_hospital, df_placeholder, df_hospitals,
     # fg.add_child(colormap)  # doesn't work
 
     # Add markers
-    for (index, row) in df_hospitals.iterrows():
-        # pop_up_text = f'{row.loc["Stroke Team"]}'
-
-        if last_object_clicked_tooltip == row.loc['Stroke Team']:
-            icon = folium.Icon(
-                # color='black',
-                # icon_color='white',
-                icon='star', #'fa-solid fa-hospital',#'info-sign',
-                # angle=0,
-                prefix='glyphicon')#, prefix='fa')
-        else:
-            icon = None
-
-
-        # fg.add_child(
-        folium.Marker(location=[row.loc['lat'], row.loc['long']], 
-                    # popup=pop_up_text, 
-                    tooltip=row.loc['Stroke Team']
-        # ))
-                    ).add_to(clinic_map)
-
-    marker_list = []
-    for i, row in df_lsoa_regions.iterrows():
-        # # folium.Circle(
-        # # folium.PolyLine(
-        #     # radius=100, # metres
-        #     locations=[[row.loc['LSOA11LAT'], row.loc['LSOA11LONG']]],
-        #     # popup=pop_up_text,
-        #     color='black',
-        #     tooltip=row.loc['LSOA11NM'],
-        #     fill=True,
-        #     weight=1
-        # ).add_to(clinic_map)
-        # pass
-        marker_list.append(
-        folium.Marker(
-            [row.loc['LSOA11LAT'], row.loc['LSOA11LONG']],
-        ))#.add_to(clinic_map)
-
-    marker_list.add_to(clinic_map)
-
-    # folium.plugins.FastMarkerCluster(
-    #     np.transpose([df_lsoa_regions['LSOA11LAT'], df_lsoa_regions['LSOA11LONG']]),
-    # ).add_to(clinic_map)
+    make_hospital_marker_layer(df_hospitals).add_to(clinic_map)
+
+    # LSOA centroids. There are too many to draw one marker each,
+    # so send the coordinates as one array and let the browser
+    # cluster them.
+    folium.plugins.FastMarkerCluster(
+        np.transpose([
+            df_lsoa_regions['LSOA11LAT'].values,
+            df_lsoa_regions['LSOA11LONG'].values
+            ]),
+        name='LSOA centroids'
+    ).add_to(clinic_map)
 
     # folium.plugins.HeatMap(
     #     np.transpose([df_lsoa_regions['LSOA11LAT'], df_lsoa_regions['LSOA11LONG']]),
@@ -456,51 +376,22 @@ outcome_type = outcome_type_dict[outcome_type_str]
 # Hospital info
 df_hospitals = pd.read_csv("./data_maps/stroke_hospitals_22_reduced.csv")
 
-df_outcomes = pd.read_csv("./data_maps/lsoa_base.csv")
-
-df_outcomes = df_outcomes.round(3)
-# df_outcomes['drip_ship_lvo_mt_added_utility'] = round(df_outcomes['drip_ship_lvo_mt_added_utility'], 3)
-# df_outcomes['mothership_lvo_mt_added_utility'] = round(df_outcomes['mothership_lvo_mt_added_utility'], 3)
-df_outcomes['diff_lvo_mt_added_utility'] = (
-    df_outcomes['mothership_lvo_mt_added_utility'] -
-    df_outcomes['drip_ship_lvo_mt_added_utility']
-)
-df_outcomes['diff_lvo_ivt_added_utility'] = (
-    df_outcomes['mothership_lvo_ivt_added_utility'] -
-    df_outcomes['drip_ship_lvo_ivt_added_utility']
-)
-df_outcomes['diff_nlvo_ivt_added_utility'] = (
-    df_outcomes['mothership_nlvo_ivt_added_utility'] -
-    df_outcomes['drip_ship_nlvo_ivt_added_utility']
-)
-
 # geojson_ew = import_geojson('LSOA_outcomes.geojson')
 # geojson_ew = import_geojson('LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced4.geojson')
 
-geojson_ew = import_geojson('LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced4_simplified.geojson')
-
-# Sort out any problem polygons with coordinates in wrong order:
-geojson_ew = rewind(geojson_ew, rfc7946=False)
+# Winding order and feature checks are done once when the file is
+# first loaded, and the result is shared between sessions.
+geojson_file = 'LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced4_simplified.geojson'
+geojson_ew = import_geojson(geojson_file)
 
 # geojson_ew = import_geojson('LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced4(3).geojson')
 # geojson_ew = import_geojson('LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_mapshaper.geojson')
 # geojson_ew = import_geojson('/lhb_scn_geojson/LSOA_South~West.geojson')
 
-
-for feature in geojson_ew['features']:
-    # if 'Wrexham' in feature['properties']['LSOA11NM']:
-    #     st.write(feature)
-
-    if feature['type'] != 'Feature':
-        st.write(feature)
-    try:
-        a = feature['geometry']
-        if a['type'] not in ['Polygon', 'MultiPolygon']:
-            st.write(feature)
-        if len(a['coordinates']) < 1:
-            st.write(feature)
-    except:
-        st.write('PROBLEM: ', feature)
+geojson_problems = import_geojson_problems(geojson_file)
+if len(geojson_problems) > 0:
+    with st.expander(f'{len(geojson_problems)} problem features in the geojson'):
+        st.write(geojson_problems)
 
 
 
@@ -532,10 +423,13 @@ else:
 
 # travel times
 # df_travel_times = pd.read_csv("./data_maps/clinic_travel_times.csv")
-df_travel_matrix = pd.read_csv('./data_maps/lsoa_travel_time_matrix_calibrated.csv')
-LSOA_names = df_travel_matrix['LSOA']
+# Only the LSOA names are needed from the travel time matrix:
+LSOA_names = load_travel_times().index
 # st.write(len(LSOA_names), LSOA_names[:10])
-placeholder = np.random.rand(len(LSOA_names))
+# Same placeholder values on every rerun for the same outcome so
+# that only changing the outcome changes the choropleth:
+rng = np.random.default_rng(list(outcome_type_dict).index(outcome_type_str))
+placeholder = rng.random(len(LSOA_names))
 table_placeholder = np.stack([LSOA_names, placeholder], axis=-1)
 # st.write(table_placeholder)
 df_placeholder = pd.DataFrame(
@@ -553,6 +447,13 @@ df_lsoa_regions = pd.read_csv('./data_maps/LSOA_regions.csv')
 
 # # geojson_ew = import_geojson(group_hospital)
 
+# Either draw whole regions or only the LSOA near the current view.
+use_viewport = st.checkbox('Only draw the LSOA in view', value=False)
+# TopoJSON stores each border between LSOA once instead of twice,
+# so much less data is sent to the browser.
+use_topojson = st.checkbox(
+    'Send whole regions as TopoJSON', value=True, disabled=use_viewport)
+
 region_list = [
     'Devon',
     'Dorset',
@@ -561,14 +462,45 @@ region_list = [
 ]
 # region_list = ['South West']
 
+# Borders of these regions, made from the LSOA in the geometry store:
+gdf_borders = select_region_outlines('stp', crs='EPSG:4326')
+# (a new dict each time, so folium can add styles to it):
+region_borders = gdf_borders[
+    gdf_borders['region'].isin(region_list)].__geo_interface__
+
 geojson_list = []
 nearest_hospital_geojson_list = []
 nearest_mt_hospital_geojson_list = []
-for region in region_list:
-    r = region.replace(' ', '~')
-    f = f'lhb_stp_geojson/LSOA_{r}.geojson'
-    geojson_ew = import_geojson(f)
-    geojson_list.append(geojson_ew)
+
+map_key = None
+# streamlit-folium builds its component key from a hash of the map
+# and this key, so st.session_state[map_key] is never set. The view
+# that the map returns is kept under this key instead:
+view_key = 'lsoa_map_view'
+if use_viewport:
+    # Use the view reported by the map on the previous run,
+    # or guess the view around the hospital on the first run.
+    map_key = 'lsoa_map'
+    bounds, centre, zoom_map = read_st_folium_view(
+        st.session_state.get(view_key))
+    if bounds is None:
+        zoom_map = 9
+        bounds = estimate_map_bounds(lat_hospital, long_hospital, zoom_map)
+    # Only send the LSOA near the view, simplified to suit the zoom.
+    # folium adds styles to the features, so don't pass it the
+    # shared cached geojson:
+    geojson_list = [copy_geojson_properties(
+        import_viewport_geojson(bounds, zoom_map))]
+else:
+    for region in region_list:
+        # Pick this region's LSOA out of the shared geometry store.
+        if use_topojson:
+            geojson_ew = copy_topojson_properties(
+                import_region_topojson('stp', (region,)))
+        else:
+            geojson_ew = copy_geojson_properties(
+                import_region_geojson('stp', (region,)))
+        geojson_list.append(geojson_ew)
 
 # # geojson_file = 'LSOA_South~West_t.geojson'
 
@@ -619,14 +551,32 @@ for region in region_list:
 
 # st.write(geojson_ew['features'][0])
 
-draw_map(
+map_output = draw_map(
         lat_hospital, long_hospital,
         geojson_list,
-        region_list,
         df_placeholder, df_hospitals,
         # nearest_hospital_geojson_list, nearest_mt_hospital_geojson_list,
-        choro_bins=6
+        choro_bins=6,
+        map_key=map_key,
+        region_borders=region_borders
+        )
+
+if use_viewport:
+    st.session_state[view_key] = map_output
+    # The map reports a pan or zoom in the same rerun that it's drawn
+    # in, after the LSOA were picked. Rerun once if the new view
+    # isn't covered by the LSOA that were drawn:
+    new_bounds, new_centre, new_zoom = read_st_folium_view(map_output)
+    if new_bounds is not None:
+        drawn_bounds = pad_bounds(bounds)
+        covered = (
+            (new_bounds[0] >= drawn_bounds[0]) and
+            (new_bounds[1] >= drawn_bounds[1]) and
+            (new_bounds[2] <= drawn_bounds[2]) and
+            (new_bounds[3] <= drawn_bounds[3])
         )
+        if (new_zoom != zoom_map) or (not covered):
+            st.rerun()
 
 
 # # ----- The end! -----
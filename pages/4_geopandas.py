@@ -2,307 +2,48 @@ import streamlit as st
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
-import os
-import geopandas
-import pyproj  # for crs conversion
 import matplotlib.pyplot as plt  # for colour maps
 
 from datetime import datetime
 
 from utilities_maps.fixed_params import page_setup
-
-
-@st.cache_data
-def import_geojson(region_type: 'str'):
-    """
-    Import a geojson file as GeoDataFrame.
-
-    The crs (coordinate reference system) is set to British National
-    Grid.
-
-    Inputs
-    ------
-    region_type - str. Lookup name for selecting a geojson file.
-                  This should be one of the column names from the
-                  various regions files.
-
-    Returns
-    -------
-    gdf_boundaries - GeoDataFrame. One row per region shape in the
-                     file. Expect columns for region name and geometry.
-    """
-    # Select geojson file based on input region type:
-    geojson_file_dict = {
-        'LSOA11NM': 'LSOA.geojson',
-        'SICBL22NM': 'SICBL.geojson',
-        'LHB20NM': 'LHB.geojson'
-    }
-
-    # Import region file:
-    file_input = geojson_file_dict[region_type]
-    # Relative import from package files:
-    # path_to_file = files('stroke_maps.data').joinpath(file_input)
-    path_to_file = os.path.join('data_maps', file_input)
-    gdf_boundaries = geopandas.read_file(path_to_file)
-
-    if region_type == 'LSOA11NM':
-        index_col = 'LSOA11CD'
-        # Only keep these columns.
-        geo_cols = ['LSOA11NM', 'BNG_E', 'BNG_N',
-                    'LONG', 'LAT', 'GlobalID', 'geometry']
-
-    else:
-        index_col = 'region_code'
-        # Only keep these columns:
-        geo_cols = ['region', 'BNG_E', 'BNG_N',
-                    'LONG', 'LAT', 'GlobalID', 'geometry']
-
-        # Find which columns to rename to 'region' and 'region_code'.
-        if (region_type.endswith('NM') | region_type.endswith('NMW')):
-            region_prefix = region_type.removesuffix('NM')
-            region_prefix = region_prefix.removesuffix('NMW')
-            region_code = region_prefix + 'CD'
-        elif (region_type.endswith('nm') | region_type.endswith('nmw')):
-            region_prefix = region_type.removesuffix('NM')
-            region_prefix = region_prefix.removesuffix('NMW')
-            region_code = region_prefix + 'cd'
-        else:
-            # This shouldn't happen.
-            # TO DO - does this need a proper exception or can
-            # we just change the above to if/else? ------------------------------
-            region_code = region_type[:-2] + 'CD'
-
-        try:
-            # Rename this column:
-            gdf_boundaries = gdf_boundaries.rename(columns={
-                region_type: 'region',
-                region_code: 'region_code'
-            })
-        except KeyError:
-            # That column doesn't exist.
-            # Try finding a column that has the same start and end
-            # as requested:
-            prefix = region_type[:3]
-            suffix = region_type[-2:]
-            success = False
-            for column in gdf_boundaries.columns:
-                # Casefold turns all UPPER into lower case.
-                match = ((column[:3].casefold() == prefix.casefold()) &
-                         (column[-2:].casefold() == suffix.casefold()))
-                if match:
-                    # Rename this column:
-                    col_code = column[:-2] + region_code[-2:]
-                    gdf_boundaries = gdf_boundaries.rename(columns={
-                        column: 'region',
-                        col_code: 'region_code'
-                        })
-                    success = True
-                else:
-                    pass
-            if success is False:
-                pass
-                # TO DO - proper error here --------------------------------
-
-    # Set the index:
-    gdf_boundaries = gdf_boundaries.set_index(index_col)
-    # Only keep geometry data:
-    gdf_boundaries = gdf_boundaries[geo_cols]
-
-    # If crs is given in the file, geopandas automatically
-    # pulls it through. Convert to National Grid coordinates:
-    if gdf_boundaries.crs != 'EPSG:27700':
-        gdf_boundaries = gdf_boundaries.to_crs('EPSG:27700')
-    return gdf_boundaries
-
-
-@st.cache_data
-def _load_geometry_lsoa(df_lsoa):
-    """
-    Create GeoDataFrames of new geometry and existing DataFrames.
-
-    Inputs
-    ------
-    df_lsoa - pd.DataFrame. LSOA info.
-
-    Returns
-    -------
-    gdf_boundaries_lsoa - GeoDataFrame. LSOA info and geometry.
-    """
-
-    # All LSOA shapes:
-    gdf_boundaries_lsoa = import_geojson('LSOA11NM')
-    crs = gdf_boundaries_lsoa.crs
-    # Index column: LSOA11CD.
-    # Always has only one unnamed column index level.
-    gdf_boundaries_lsoa = gdf_boundaries_lsoa.reset_index()
-    gdf_boundaries_lsoa = gdf_boundaries_lsoa.rename(
-        columns={'LSOA11NM': 'lsoa', 'LSOA11CD': 'lsoa_code'})
-    gdf_boundaries_lsoa = gdf_boundaries_lsoa.set_index(['lsoa', 'lsoa_code'])
-
-    # ----- Prepare separate data -----
-    # Set up column level info for the merged DataFrame.
-    # Everything needs at least two levels: scenario and property.
-    # Sometimes also a 'subtype' level.
-    # Add another column level to the coordinates.
-    col_level_names = df_lsoa.columns.names
-    cols_gdf_boundaries_lsoa = [
-        gdf_boundaries_lsoa.columns,                 # property
-        ['any'] * len(gdf_boundaries_lsoa.columns),  # scenario
-    ]
-    if 'subtype' in col_level_names:
-        cols_gdf_boundaries_lsoa.append([''] * len(gdf_boundaries_lsoa.columns))
-
-    # Make all data to be combined have the same column levels.
-    # Geometry:
-    gdf_boundaries_lsoa = pd.DataFrame(
-        gdf_boundaries_lsoa.values,
-        index=gdf_boundaries_lsoa.index,
-        columns=cols_gdf_boundaries_lsoa
-    )
-
-    # ----- Create final data -----
-    # Merge together all of the DataFrames.
-    gdf_boundaries_lsoa = pd.merge(
-        gdf_boundaries_lsoa, df_lsoa,
-        left_index=True, right_index=True, how='right'
-    )
-    # Name the column levels:
-    gdf_boundaries_lsoa.columns = (
-        gdf_boundaries_lsoa.columns.set_names(col_level_names))
-
-    # Sort the results by scenario:
-    gdf_boundaries_lsoa = gdf_boundaries_lsoa.sort_index(
-        axis='columns', level='scenario')
-
-    # Convert to GeoDataFrame:
-    col_geo = find_multiindex_column_names(
-        gdf_boundaries_lsoa, property=['geometry'])
-    gdf_boundaries_lsoa = geopandas.GeoDataFrame(
-        gdf_boundaries_lsoa,
-        geometry=col_geo,
-        crs=crs
-        )
-    return gdf_boundaries_lsoa
-
-
-def find_multiindex_column_names(gdf, **kwargs):
-    """
-    Find the full column name to match a partial column name.
-
-    Example usage:
-    find_multiindex_column_name(gdf, scenario='any', property='geometry')
-
-    Inputs
-    ------
-    gdf    - GeoDataFrame.
-    kwargs - in format level_name=column_name for column level names
-             in the gdf column MultiIndex.
-
-    Returns
-    -------
-    cols - list or str or tuple. The column name(s) matching the
-           requested names in those levels.
-    """
-    masks = [
-        gdf.columns.get_level_values(level).isin(col_list)
-        for level, col_list in kwargs.items()
-    ]
-    mask = np.all(masks, axis=0)
-    cols = gdf.columns[mask]
-    if len(cols) == 1:
-        cols = cols.values[0]
-    elif len(cols) == 0:
-        cols = ''  # Should throw up a KeyError when used to index.
-    return cols
+from utilities_maps.outcome_store import (
+    load_outcome_store, load_outcome_summary)
+from utilities_maps.band_geometry import import_band_geojson
 
 
 def plotly_big_map(
-        gdf,
-        column_colour,
-        column_geometry,
-        v_bands,
-        v_bands_str,
+        bands,
         colour_map
         ):
-    gdf = gdf.copy()
-    crs = gdf.crs
-    gdf = gdf.reset_index()
-
-    col_lsoa = find_multiindex_column_names(
-        gdf, property=['lsoa'])
-
-    # Only keep the required columns:
-    gdf = gdf[[col_lsoa, column_colour, column_geometry]]
-    # Only keep the 'property' subheading:
-    gdf = pd.DataFrame(
-        gdf.values,
-        columns=['lsoa', 'outcome', 'geometry']
-    )
-    gdf = gdf.set_index('lsoa')
-    gdf = geopandas.GeoDataFrame(gdf, geometry='geometry', crs=crs)
-
-    # Has to be this CRS to prevent Picasso drawing:
-    gdf = gdf.to_crs(pyproj.CRS.from_epsg(4326))
-
-    # Group by outcome band.
-    # Only group by non-NaN values:
-    mask = ~pd.isna(gdf['outcome'])
-    inds = np.digitize(gdf.loc[mask, 'outcome'], v_bands)
-    # Store inds for sorting the resulting gdf:
-    gdf.loc[mask, 'inds'] = inds
-    gdf.loc[~mask, 'inds'] = np.NaN
-    labels = v_bands_str[inds]
-    # Flag NaN values:
-    gdf.loc[mask, 'labels'] = labels
-    gdf.loc[~mask, 'labels'] = 'rubbish'
-    # Dissolve by shared outcome value:
-    gdf = gdf.dissolve(by='labels')
-    gdf = gdf.reset_index()
-    # Remove the NaN polygon:
-    gdf = gdf[gdf['labels'] != 'rubbish']
-
-    # Sort the dataframe for the sake of the legend order:
-    gdf = gdf.sort_values(by='inds')
-
+    """
+    bands has one dict per outcome band with 'label' and 'url' of
+    its geojson, e.g. from band_geometry.import_band_geojson(). The
+    geometry has to be in EPSG:4326 to prevent Picasso drawing.
+    """
     # Begin plotting.
     fig = go.Figure()
 
-    import plotly.express as px
-    fig = px.choropleth(
-        gdf,
-        locations=gdf.index,
-        geojson=gdf.geometry.__geo_interface__,
-        color=gdf['labels'],
-        color_discrete_map=colour_map
-        )
+    # One trace per band so that each band has a legend entry. The
+    # browser fetches each band's shape from its URL:
+    for band in bands:
+        colour = colour_map[band['label']]
+        fig.add_trace(go.Choropleth(
+            geojson=band['url'],
+            locations=[band['label']],
+            z=[1],
+            colorscale=[[0.0, colour], [1.0, colour]],
+            showscale=False,
+            showlegend=True,
+            name=band['label'],
+            legendgroup=band['label'],
+        ))
 
     fig.update_layout(
         width=1200,
         height=1200
         )
 
-    # fig.add_trace(
-    #     go.Choropleth(
-    #         geojson=gdf.geometry.__geo_interface__,
-    #         locations=gdf.index,
-    #         z=gdf['mids'].astype(str),
-    #         coloraxis='coloraxis',
-    #     )
-    # ).update_geos(fitbounds="locations", visible=False).update_layout(
-    #     coloraxis={"colorscale": colour_map})
-
-    # fig.add_trace(go.Choropleth(
-    #     # gdf,
-    #     geojson=gdf.geometry.__geo_interface__,
-    #     locations=gdf.index,
-    #     z=gdf.mids.astype(str),
-    #     colorscale=colour_map,  # gdf.inds,  # pd.cut(gdf.outcome, bins=np.arange(v_min, v_max+0.11, 0.1)).astype(str),
-    #     # featureidkey='properties.LSOA11NM',
-    #     coloraxis="coloraxis",
-    #     # colorscale='Inferno',
-    #     autocolorscale=False
-    # ))
-
     fig.update_layout(
         geo=dict(
             scope='world',
@@ -404,8 +145,10 @@ def make_colour_map_dict(v_bands_str, cmap_name='viridis'):
     # # Convert tuples to strings:
     # colour_list = np.array([
     #     '#%02x%02x%02x%02x' % tuple(c) for c in colour_list])
+    # CSS wants red, green and blue from 0 to 255:
     colour_list = np.array([
-        f'rgba{tuple(c)}' for c in colour_list])
+        f'rgba({r * 255:.0f}, {g * 255:.0f}, {b * 255:.0f}, {a})'
+        for r, g, b, a in colour_list])
     # colour_list[2] = 'red'
     # # Sample colour list:
     # lsoa_colours = colour_list[inds]
@@ -539,80 +282,53 @@ colour_map = make_colour_map_dict(v_bands_str, cmap_name)
 
 # Load outcome data
 time_o_start = datetime.now()
-# Load data files
-df_lsoa = pd.read_csv(
-    os.path.join('data_maps', 'df_lsoa.csv'),
-    index_col=[0, 1],
-    header=[0, 1, 2],
-)
+# The outcomes are read from a memory-mapped store
+# (see utilities_maps/outcome_store.py):
+outcome_store = load_outcome_store()
 time_o_end = datetime.now()
 st.write(f'Time to load outcomes: {time_o_end - time_o_start}')
 
-# # Load geography
-# time_g_start = datetime.now()
-# gdf_boundaries_lsoa = import_geojson('LSOA11NM')
-# time_g_end = datetime.now()
-# st.write(f'Time to load geography: {time_g_end - time_g_start}')
-
-# Merge outcome and geography:
-time_m_start = datetime.now()
-gdf_boundaries_lsoa = _load_geometry_lsoa(df_lsoa)
-
-# st.write(type(gdf_boundaries_lsoa))
-# st.write('')
-# st.write(gdf_boundaries_lsoa.info())
-# st.write(gdf_boundaries_lsoa.crs)
-time_m_end = datetime.now()
-st.write(f'Time to merge geography and outcomes: {time_m_end - time_m_start}')
-
-# Find geometry column for plot function:
-col_geo = find_multiindex_column_names(
-    gdf_boundaries_lsoa, property=['geometry'])
-gdf_boundaries_lsoa = gdf_boundaries_lsoa.set_geometry(col_geo)
-
 # Find shared colour scale limits for this outcome measure:
+catalogue = outcome_store.catalogue
+summary = load_outcome_summary()
 if 'diff' in scenario_type:
-    cols = find_multiindex_column_names(
-        gdf_boundaries_lsoa,
+    cols = catalogue.find(
         property=[outcome_type],
         scenario=[scenario_type],
         subtype=['mean']
         )
-    v_values = gdf_boundaries_lsoa[cols]
-    v_max = np.nanmax(v_values.values)
-    v_min = np.nanmin(v_values.values)
-    v_limit = max(abs(v_max), abs(v_min))
+    v_limit = summary.absmax(cols)
     v_max = abs(v_limit)
     v_min = -abs(v_limit)
 else:
-    cols = find_multiindex_column_names(
-        gdf_boundaries_lsoa,
+    # Every scenario except the 'diff' ones:
+    cols = catalogue.find(
         property=[outcome_type],
+        scenario=[s for s in catalogue.values('scenario') if 'diff' not in s],
         subtype=['mean']
         )
-    # Remove the 'diff' column:
-    cols = [c for c in cols if 'diff' not in c[1]]
-    v_values = gdf_boundaries_lsoa[cols]
-    v_max = np.nanmax(v_values.values)
-    v_min = np.nanmin(v_values.values)
+    v_max = summary.max(cols)
+    v_min = summary.min(cols)
 
 # Selected column to use for colour values:
-col_col = find_multiindex_column_names(
-    gdf_boundaries_lsoa,
+col_col = catalogue.find_one(
     property=[outcome_type],
     scenario=[scenario_type],
     subtype=['mean']
     )
 
+# Merge the LSOA in each outcome band. This is saved, so it's only
+# slow the first time these bands are drawn for this column:
+time_m_start = datetime.now()
+bands = import_band_geojson(col_col, v_bands, v_bands_str)
+time_m_end = datetime.now()
+st.write(f'Time to match geography and outcomes: {time_m_end - time_m_start}')
+
 # Plot map:
 time_p_start = datetime.now()
 with st.spinner(text='Drawing map'):
     plotly_big_map(
-        gdf_boundaries_lsoa,
-        column_colour=col_col,
-        column_geometry=col_geo,
-        v_bands=v_bands,
-        v_bands_str=v_bands_str,
+        bands,
         colour_map=colour_map
         )
 time_p_end = datetime.now()
@@ -1,20 +1,18 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import json
+import base64
 import plotly.graph_objs as go
 import plotly.express as px
-from geojson_rewind import rewind
 from datetime import datetime
 
 from utilities_maps.fixed_params import page_setup
-
-
-def import_geojson(geojson_file=''):
-    if len(geojson_file) < 1:
-        geojson_file = 'LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced3.geojson'
-    with open('./data_maps/' + geojson_file) as f:
-        geojson_ew = json.load(f)
-    return geojson_ew
+from utilities_maps.load_data import (
+    import_geojson, import_geojson_ids_url, import_geojson_problems)
+from utilities_maps.column_summary import load_csv_summary
+from utilities_maps.derived_columns import (
+    path_to_lsoa_base, prepare_lsoa_base, load_lsoa_base)
 
 
 def draw_map_plotly(df_placeholder, geojson_ew, lat_hospital, long_hospital):
@@ -37,6 +35,22 @@ def draw_map_plotly(df_placeholder, geojson_ew, lat_hospital, long_hospital):
     st.plotly_chart(fig)
 
 
+def float32_array(values):
+    """
+    Numbers as a plotly.js typed array of float32.
+
+    The browser reads these straight from base64 instead of parsing
+    a long list of numbers written out as text, and they're smaller.
+    plotly.py doesn't check the args of updatemenus, so these can go
+    there even though plotly.py 5 won't take them in a trace.
+    """
+    values = np.asarray(values, dtype='<f4')
+    return {
+        'dtype': 'f4',
+        'bdata': base64.b64encode(values.tobytes()).decode('ascii')
+    }
+
+
 def plotly_big_map():
     fig = go.Figure()
 
@@ -46,10 +60,9 @@ def plotly_big_map():
         )
 
     fig.add_trace(go.Choropleth(
-        geojson=geojson_ew,
+        geojson=geojson_url,
         locations=df_outcomes['lsoa'],
         z=df_outcomes['drip_ship_lvo_mt_added_utility'],
-        featureidkey='properties.LSOA11NM',
         coloraxis="coloraxis",
         # colorscale='Inferno',
         # autocolorscale=False
@@ -92,8 +105,8 @@ def plotly_big_map():
                 dict(
                     args=[
                         {
-                            'z': [df_outcomes[
-                                'drip_ship_lvo_mt_added_utility']],
+                            'z': [float32_array(df_outcomes[
+                                'drip_ship_lvo_mt_added_utility'])],
                         },
                         {
                             'coloraxis.colorscale': 'Electric',
@@ -108,8 +121,8 @@ def plotly_big_map():
                 dict(
                     args=[
                         {
-                            'z': [df_outcomes[
-                                'mothership_lvo_mt_added_utility']],
+                            'z': [float32_array(df_outcomes[
+                                'mothership_lvo_mt_added_utility'])],
                         },
                         {
                             'coloraxis.colorscale': 'Electric',
@@ -124,7 +137,8 @@ def plotly_big_map():
                 dict(
                     args=[
                         {
-                            'z': [df_outcomes['diff_lvo_mt_added_utility']],
+                            'z': [float32_array(
+                                df_outcomes['diff_lvo_mt_added_utility'])],
                         },
                         {
                             'coloraxis.colorscale': 'RdBu',
@@ -158,10 +172,9 @@ def plotly_two_subplots():
         height=1200
         )
     fig.add_trace(go.Choropleth(
-        geojson=geojson_ew,
+        geojson=geojson_url,
         locations=df_outcomes['lsoa'],
         z=df_outcomes['drip_ship_lvo_mt_added_utility'],
-        featureidkey='properties.LSOA11NM',
         coloraxis="coloraxis",
         # colorscale='Inferno',
         # autocolorscale=False
@@ -169,28 +182,21 @@ def plotly_two_subplots():
     )
 
     fig.add_trace(go.Choropleth(
-        geojson=geojson_ew,
+        geojson=geojson_url,
         locations=df_outcomes['lsoa'],
         z=df_outcomes['mothership_lvo_mt_added_utility'],
-        featureidkey='properties.LSOA11NM',
         coloraxis="coloraxis",
         # colorscale='Inferno',
         # autocolorscale=False
     ), row=1, col=2
     )
 
-    fig.update_layout(
-        geo=dict(
-            scope='world',
-            projection=go.layout.geo.Projection(type='airy'),
-            fitbounds='locations',
-            visible=False, domain_row=1, domain_column=1))
-    fig.update_layout(
-        geo=dict(
-            scope='world',
-            projection=go.layout.geo.Projection(type='airy'),
-            fitbounds='locations',
-            visible=False, domain_row=1, domain_column=2))
+    # Same settings for both subplots (geo and geo2):
+    fig.update_geos(
+        scope='world',
+        projection=go.layout.geo.Projection(type='airy'),
+        fitbounds='locations',
+        visible=False)
     # Remove LSOA borders:
     fig.update_traces(marker_line_width=0, selector=dict(type='choropleth'))
 
@@ -220,8 +226,8 @@ def plotly_two_subplots():
                 dict(
                     args=[
                         {
-                            'z': [df_outcomes[
-                                'drip_ship_lvo_mt_added_utility']],
+                            'z': [float32_array(df_outcomes[
+                                'drip_ship_lvo_mt_added_utility'])],
                             },
                         {
                             'coloraxis.colorscale': 'Electric',
@@ -236,10 +242,8 @@ def plotly_two_subplots():
                 dict(
                     args=[
                         {
-                            'z': [df_outcomes[
-                                'mothership_lvo_mt_added_utility']],
-                            'z1': [df_outcomes[
-                                'mothership_nlvo_ivt_added_utility']],
+                            'z': [float32_array(df_outcomes[
+                                'mothership_lvo_mt_added_utility'])],
                         },
                         {
                             'coloraxis.colorscale': 'Electric',
@@ -254,7 +258,8 @@ def plotly_two_subplots():
                 dict(
                     args=[
                         {
-                            'z': [df_outcomes['diff_lvo_mt_added_utility']],
+                            'z': [float32_array(
+                                df_outcomes['diff_lvo_mt_added_utility'])],
                         },
                         {
                             'coloraxis.colorscale': 'RdBu',
@@ -290,25 +295,12 @@ startTime = datetime.now()
 # Hospital info
 df_hospitals = pd.read_csv("./data_maps/stroke_hospitals_22_reduced.csv")
 
-df_outcomes = pd.read_csv("./data_maps/lsoa_base.csv")
-
-df_outcomes = df_outcomes.round(3)
-# df_outcomes['drip_ship_lvo_mt_added_utility'] = \
-# round(df_outcomes['drip_ship_lvo_mt_added_utility'], 3)
-# df_outcomes['mothership_lvo_mt_added_utility'] = \
-# round(df_outcomes['mothership_lvo_mt_added_utility'], 3)
-df_outcomes['diff_lvo_mt_added_utility'] = (
-    df_outcomes['mothership_lvo_mt_added_utility'] -
-    df_outcomes['drip_ship_lvo_mt_added_utility']
-)
-df_outcomes['diff_lvo_ivt_added_utility'] = (
-    df_outcomes['mothership_lvo_ivt_added_utility'] -
-    df_outcomes['drip_ship_lvo_ivt_added_utility']
-)
-df_outcomes['diff_nlvo_ivt_added_utility'] = (
-    df_outcomes['mothership_nlvo_ivt_added_utility'] -
-    df_outcomes['drip_ship_nlvo_ivt_added_utility']
-)
+# Outcomes with the diff_ columns worked out from the others
+# (see utilities_maps/derived_columns.py):
+df_outcomes = load_lsoa_base(path_to_lsoa_base)
+# Column limits are read from a summary saved next to the data
+# (see utilities_maps/column_summary.py):
+outcome_summary = load_csv_summary(path_to_lsoa_base, prepare_lsoa_base)
 
 # Colour bar limits:
 added_utility_cols = [
@@ -324,10 +316,9 @@ diff_added_utility_cols = [
     'diff_lvo_ivt_added_utility',
     'diff_lvo_mt_added_utility',
 ]
-vmin_added_utility = df_outcomes[added_utility_cols].min().min()
-vmax_added_utility = df_outcomes[added_utility_cols].max().max()
-vlim_diff_added_utility = df_outcomes[
-    diff_added_utility_cols].abs().max().max()
+vmin_added_utility = outcome_summary.min(added_utility_cols)
+vmax_added_utility = outcome_summary.max(added_utility_cols)
+vlim_diff_added_utility = outcome_summary.absmax(diff_added_utility_cols)
 vmin_diff_added_utility = -vlim_diff_added_utility
 vmax_diff_added_utility = +vlim_diff_added_utility
 
@@ -341,30 +332,23 @@ diff_vmax = vmax_diff_added_utility
 
 # geojson_ew = import_geojson('LSOA_outcomes.geojson')
 # geojson_ew = import_geojson('LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced4.geojson')
-geojson_ew = import_geojson('LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced4_simplified.geojson')
-
-# Sort out any problem polygons with coordinates in wrong order:
-geojson_ew = rewind(geojson_ew, rfc7946=False)
+# Winding order and feature checks are done once when the file is
+# first loaded, and the result is shared between sessions.
+geojson_file = 'LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced4_simplified.geojson'
+geojson_ew = import_geojson(geojson_file)
+# The plotly maps only need the shapes and LSOA names. They're
+# served from static/ so that the figure only holds the URL and
+# traces that use it don't each carry a copy of the shapes:
+geojson_url = import_geojson_ids_url(geojson_file)
 
 # geojson_ew = import_geojson('LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced4(3).geojson')
 # geojson_ew = import_geojson('LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_mapshaper.geojson')
 # geojson_ew = import_geojson('/lhb_scn_geojson/LSOA_South~West.geojson')
 
-
-for feature in geojson_ew['features']:
-    # if 'Wrexham' in feature['properties']['LSOA11NM']:
-    #     st.write(feature)
-
-    if feature['type'] != 'Feature':
-        st.write(feature)
-    try:
-        a = feature['geometry']
-        if a['type'] not in ['Polygon', 'MultiPolygon']:
-            st.write(feature)
-        if len(a['coordinates']) < 1:
-            st.write(feature)
-    except:
-        st.write('PROBLEM: ', feature)
+geojson_problems = import_geojson_problems(geojson_file)
+if len(geojson_problems) > 0:
+    with st.expander(f'{len(geojson_problems)} problem features in the geojson'):
+        st.write(geojson_problems)
 
 time4 = datetime.now()
 
@@ -1,28 +1,15 @@
 import streamlit as st
 from datetime import datetime
 
-from utilities_maps.fixed_params import page_setup
+from utilities_maps.fixed_params import page_setup, outcome_type_dict
+from utilities_maps.build_html import read_built_html, built_html_version
 
 
 @st.cache_data
-def load_map_added_utility(path_to_html):
-    with open(path_to_html, 'r') as f:
-        html_data = f.read()
-    return html_data
-
-
-@st.cache_data
-def load_map_mean_shift(path_to_html):
-    with open(path_to_html, 'r') as f:
-        html_data = f.read()
-    return html_data
-
-
-@st.cache_data
-def load_map_mrs_leq2(path_to_html):
-    with open(path_to_html, 'r') as f:
-        html_data = f.read()
-    return html_data
+def load_map_html(outcome_type, version):
+    # Built offline by `python -m utilities_maps.build_html`.
+    # version is only here so that a rebuilt map isn't cached.
+    return read_built_html(outcome_type)
 
 
 @st.cache_resource
@@ -55,25 +42,18 @@ outcome_type_str = st.radio(
     ['Added utility', 'Mean shift in mRS', 'mRS <= 2'],
     horizontal=True
 )
-# Match the input string to the file name string:
-outcome_type_dict = {
-    'Added utility': 'added~utility',
-    'Mean shift in mRS': 'mean~shift',
-    'mRS <= 2': 'mrs<=2'
-}
 outcome_type = outcome_type_dict[outcome_type_str]
 
 startTime = datetime.now()
-path_to_html = f'./html_dualmap_{outcome_type}.html'
-# path_to_html = './html_dual_test.html'
-# path_to_html = 'https://github.com/samuel-book/streamlit_map_lsoa_outcomes/blob/main/html_test.html'
-
-if outcome_type == 'added~utility':
-    html_data = load_map_added_utility(path_to_html)
-elif outcome_type == 'mean~shift':
-    html_data = load_map_mean_shift(path_to_html)
-elif outcome_type == 'mrs<=2':
-    html_data = load_map_mrs_leq2(path_to_html)
+try:
+    html_data = load_map_html(outcome_type, built_html_version(outcome_type))
+except FileNotFoundError as e:
+    st.error(
+        'This map has not been built yet. Run '
+        '`python -m utilities_maps.build_html` to create it.'
+        f' ({e})'
+        )
+    st.stop()
 
 cols = st.columns(2)
 with cols[0]:
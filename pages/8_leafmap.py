@@ -12,6 +12,8 @@ from folium.features import GeoJsonTooltip
 
 
 from utilities_maps.fixed_params import page_setup
+from utilities_maps.maps_folium import make_hospital_marker_layer
+from utilities_maps.travel_times import load_travel_times
 
 
 def draw_map_leafmap(
@@ -146,31 +148,11 @@ def draw_map_leafmap(
 
 
 
-    fg = folium.FeatureGroup(name='hospital_markers')
     # Add markers
-    for (index, row) in df_hospitals.iterrows():
-        # pop_up_text = f'{row.loc["Stroke Team"]}'
-
-        # if last_object_clicked_tooltip == row.loc['Stroke Team']:
-        #     icon = folium.Icon(
-        #         # color='black',
-        #         # icon_color='white',
-        #         icon='star', #'fa-solid fa-hospital',#'info-sign',
-        #         # angle=0,
-        #         prefix='glyphicon')#, prefix='fa')
-        # else:
-        #     icon = None
-
-
-        fg.add_child(
-            folium.Marker(
-            # clinic_map.add_marker(
-                location=[row.loc['lat'], row.loc['long']],
-                        # popup=pop_up_text,
-                        tooltip=row.loc['Stroke Team']
-            ))
-                    # )#.add_to(clinic_map)
-
+    # (one layer of points for all hospitals instead of
+    # one folium.Marker each)
+    fg = make_hospital_marker_layer(
+        df_hospitals, name='hospital_markers', control=True)
     fg.add_to(clinic_map)
 
     # folium.map.LayerControl().add_to(clinic_map)
@@ -253,8 +235,8 @@ hospital_postcode_list = df_hospitals_regions['Postcode']
 
 # travel times
 # df_travel_times = pd.read_csv("./data_maps/clinic_travel_times.csv")
-df_travel_matrix = pd.read_csv('./data_maps/lsoa_travel_time_matrix_calibrated.csv')
-LSOA_names = df_travel_matrix['LSOA']
+# Only the LSOA names are needed from the travel time matrix:
+LSOA_names = load_travel_times().index
 # st.write(len(LSOA_names), LSOA_names[:10])
 placeholder = np.random.rand(len(LSOA_names))
 table_placeholder = np.stack([LSOA_names, placeholder], axis=-1)
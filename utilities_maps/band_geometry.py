@@ -0,0 +1,162 @@
+"""
+Cached GeoJSON of the LSOA merged into outcome bands.
+
+A banded outcome map merges all of the LSOA in each colour band into
+one shape. The merge takes seconds and only depends on the outcome
+column and the band edges, so the merged shapes are saved under a
+hash of those and of the stores they came from. Later maps of the
+same column and bands don't merge anything.
+
+Each band is saved as its own GeoJSON file in static/bands/, which
+Streamlit serves at app/static/bands/ (see load_data.dir_static).
+A plotly trace per band is given the URL of its file rather than
+the shape, so plotly doesn't check and write out the polygons on
+every render and the browser fetches each file once. The labels and
+URLs of the bands are kept in data_maps/prepared/bands/.
+"""
+import streamlit as st
+import os
+import hashlib
+import numpy as np
+import geopandas
+
+from utilities_maps.load_data import (
+    dir_prepared, dir_static, read_json, write_json)
+from utilities_maps.geometry_store import path_to_store, load_geometry_store
+from utilities_maps.outcome_store import (
+    path_to_outcome_store, load_outcome_store, load_outcome_geometry_rows)
+from utilities_maps.topology import load_store_dissolver
+
+
+dir_bands = os.path.join(dir_prepared, 'bands')
+dir_band_files = os.path.join(dir_static, 'bands')
+
+
+def store_fingerprint():
+    """Modified time and size of the stores that the bands come from."""
+    return tuple(
+        (os.stat(path).st_mtime, os.stat(path).st_size)
+        for path in (path_to_store, path_to_outcome_store)
+    )
+
+
+def dissolve_outcome_bands(col, v_bands, v_bands_str):
+    """
+    Merge the LSOA in each outcome band.
+
+    The LSOA are merged along their shared borders with the topology
+    of the geometry store (see topology.py) rather than by overlaying
+    the polygons.
+
+    Inputs
+    ------
+    col         - tuple. Column name from the outcome store.
+    v_bands     - np.array. Band edges.
+    v_bands_str - np.array. One label per band, one longer than
+                  v_bands for the bands below and above the edges.
+
+    Returns
+    -------
+    gdf - GeoDataFrame. One row per band with any LSOA in, sorted by
+          band, with columns 'labels', 'inds' and 'geometry'.
+    """
+    store = load_geometry_store()
+    rows = load_outcome_geometry_rows()
+    values = load_outcome_store().column(col)
+
+    # Band number for each row of the geometry store.
+    # Only group by non-NaN values, and -1 for LSOA without one:
+    mask = (rows >= 0) & ~np.isnan(values)
+    groups = np.full(len(store.gdf), -1)
+    groups[rows[mask]] = np.digitize(values[mask], v_bands)
+
+    geometries = load_store_dissolver().dissolve(groups, len(v_bands_str))
+    # Sorted for the sake of the legend order:
+    inds = [i for i, g in enumerate(geometries) if g is not None]
+    return geopandas.GeoDataFrame(
+        {'labels': v_bands_str[inds], 'inds': inds},
+        geometry=[geometries[i] for i in inds],
+        crs=store.gdf.crs
+        )
+
+
+def prepare_band_geojson(col, v_bands, v_bands_str):
+    """
+    GeoJSON file of each outcome band, made if it doesn't exist yet.
+
+    Inputs
+    ------
+    col         - tuple. Column name from the outcome store.
+    v_bands     - tuple. Band edges.
+    v_bands_str - tuple. Band labels, see dissolve_outcome_bands().
+
+    Returns
+    -------
+    bands - list. One dict per band in legend order with 'label',
+            'ind' and 'url'. The url is of a FeatureCollection of one
+            feature whose id is the label, e.g. for go.Choropleth's
+            geojson.
+    """
+    key_parts = (store_fingerprint(), col, v_bands, v_bands_str)
+    key = hashlib.sha256(repr(key_parts).encode()).hexdigest()
+    path_to_bands = os.path.join(dir_bands, f'{key}.json')
+
+    if os.path.exists(path_to_bands):
+        bands = read_json(path_to_bands)
+        # static/ isn't kept with the prepared files, so check:
+        if all(os.path.exists(os.path.join(dir_band_files, b['file']))
+               for b in bands):
+            return bands
+
+    gdf = dissolve_outcome_bands(
+        col, np.array(v_bands), np.array(v_bands_str))
+    os.makedirs(dir_band_files, exist_ok=True)
+    bands = []
+    for label, ind, geometry in zip(gdf['labels'], gdf['inds'], gdf.geometry):
+        # Named by band number because the labels have '<' in:
+        file_name = f'{key}-{ind}.geojson'
+        write_json({
+            'type': 'FeatureCollection',
+            'features': [{
+                'type': 'Feature',
+                'id': label,
+                'properties': {},
+                'geometry': geometry.__geo_interface__,
+            }],
+        }, os.path.join(dir_band_files, file_name))
+        bands.append({
+            'label': label,
+            'ind': int(ind),
+            'file': file_name,
+            'url': f'app/static/bands/{file_name}',
+        })
+    os.makedirs(dir_bands, exist_ok=True)
+    write_json(bands, path_to_bands)
+    return bands
+
+
+@st.cache_resource(max_entries=16)
+def _import_band_geojson(fingerprint, col, v_bands, v_bands_str):
+    return prepare_band_geojson(col, v_bands, v_bands_str)
+
+
+def import_band_geojson(col, v_bands, v_bands_str):
+    """
+    Shared, cached GeoJSON URL of each outcome band.
+
+    See prepare_band_geojson() for the outputs. Don't change them in
+    place because every session shares them.
+
+    Inputs
+    ------
+    col         - tuple. Column name from the outcome store.
+    v_bands     - list-like. Band edges.
+    v_bands_str - list-like. Band labels.
+    """
+    # Rounded so that edges from np.arange() make the same key:
+    v_bands = tuple(round(float(v), 9) for v in v_bands)
+    v_bands_str = tuple(str(s) for s in v_bands_str)
+    # The store fingerprint is in the memory cache key too so that
+    # rebuilt stores aren't served from memory.
+    return _import_band_geojson(
+        store_fingerprint(), col, v_bands, v_bands_str)
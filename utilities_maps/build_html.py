@@ -0,0 +1,310 @@
+"""
+Offline build of the pre-rendered dual-map HTML files.
+
+The "Load map from HTML" page shows one DualMap per outcome type.
+Building those maps live means reading six COGs and a few hundred
+catchment files on every rerun, so instead render them once here.
+
+Each outcome type is rendered in its own worker process. The HTML is
+written out alongside gzip (and brotli, if installed) compressed
+copies, and a manifest records the SHA-256 hash of each file so that
+the app can check that it is serving the build it expects.
+
+Usage, from the top of the repository:
+
+    python -m utilities_maps.build_html
+    python -m utilities_maps.build_html --outcome_types added~utility
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+try:
+    import brotli
+except ImportError:
+    # Optional extra compression:
+    brotli = None
+
+from utilities_maps.fixed_params import (
+    outcome_type_dict, tiff_layer_names, tiff_cbar_dicts,
+    make_cog_file_list)
+from utilities_maps.maps_folium import make_map_tiff
+
+
+manifest_name = 'html_manifest.json'
+
+
+def make_html_name(outcome_type):
+    """File name of the pre-rendered map for this outcome type."""
+    return f'html_dualmap_{outcome_type}.html'
+
+
+def sha256_of_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalise_element_ids(html):
+    """
+    Replace folium's random element IDs with sequential ones.
+
+    folium names every element like 'map_<32 random hex characters>',
+    so two renders of the same map never match byte for byte. Swap
+    each ID for a counter in order of first appearance so that a
+    rebuild from the same data gives the same hash.
+
+    Inputs
+    ------
+    html - str. Rendered folium page.
+
+    Returns
+    -------
+    html - str. The same page with repeatable element IDs.
+    """
+    ids = {}
+
+    def _replace(match):
+        old_id = match.group(0)
+        if old_id not in ids:
+            ids[old_id] = f'{len(ids):032x}'
+        return ids[old_id]
+
+    # Only match IDs after an underscore so that the base64 image
+    # data (which never contains '_') is left alone.
+    return re.sub(r'(?<=_)[0-9a-f]{32}(?![0-9A-Za-z])', _replace, html)
+
+
+def render_dualmap_html(outcome_type, path_to_hospitals):
+    """
+    Render the DualMap for one outcome type to an HTML string.
+
+    Inputs
+    ------
+    outcome_type      - str. e.g. 'added~utility'.
+    path_to_hospitals - str. Path to the stroke hospitals csv.
+
+    Returns
+    -------
+    html - str. The full HTML page for the map.
+    """
+    cog_files = make_cog_file_list(outcome_type)
+    missing = [f for f in cog_files if not os.path.exists(f)]
+    if len(missing) > 0:
+        raise FileNotFoundError(
+            f'Missing COGs for {outcome_type}: {", ".join(missing)}')
+
+    df_hospitals = pd.read_csv(path_to_hospitals)
+    outcome_cbar_dict, diff_cbar_dict = tiff_cbar_dicts[outcome_type]
+
+    outcome_map = make_map_tiff(
+        df_hospitals,
+        cog_files,
+        tiff_layer_names,
+        outcome_cbar_dict,
+        diff_cbar_dict,
+        )
+    html = outcome_map.get_root().render()
+    return normalise_element_ids(html)
+
+
+def write_artifacts(outcome_type, html, out_dir='.', gzip_level=9,
+                    brotli_quality=11):
+    """
+    Write the HTML and its compressed copies to file.
+
+    Inputs
+    ------
+    outcome_type   - str. Used to name the files.
+    html           - str. The rendered page.
+    out_dir        - str. Where to save the files.
+    gzip_level     - int. gzip compression level, 1 to 9.
+    brotli_quality - int. brotli quality, 0 to 11.
+
+    Returns
+    -------
+    entry - dict. Manifest entry with file names, sizes and hashes.
+    """
+    html_bytes = html.encode('utf-8')
+    html_name = make_html_name(outcome_type)
+
+    artifacts = {'html': (html_name, html_bytes)}
+    # mtime=0 keeps the gzip header the same between builds:
+    artifacts['gzip'] = (
+        html_name + '.gz',
+        gzip.compress(html_bytes, compresslevel=gzip_level, mtime=0)
+    )
+    if brotli is not None:
+        artifacts['brotli'] = (
+            html_name + '.br',
+            brotli.compress(html_bytes, quality=brotli_quality)
+        )
+
+    entry = {'sha256': sha256_of_bytes(html_bytes), 'files': {}}
+    for encoding, (file_name, data) in artifacts.items():
+        with open(os.path.join(out_dir, file_name), 'wb') as f:
+            f.write(data)
+        entry['files'][encoding] = {
+            'name': file_name,
+            'size': len(data),
+            'sha256': sha256_of_bytes(data),
+        }
+    return entry
+
+
+def build_one(outcome_type, out_dir='.',
+              path_to_hospitals='./data_maps/stroke_hospitals_22_reduced.csv'):
+    """Render and save one outcome type. Run in a worker process."""
+    html = render_dualmap_html(outcome_type, path_to_hospitals)
+    return write_artifacts(outcome_type, html, out_dir=out_dir)
+
+
+def build_all(outcome_types=None, out_dir='.', max_workers=None):
+    """
+    Build the HTML maps for many outcome types in parallel.
+
+    Outcome types that fail to build (e.g. because their COGs are
+    missing) are reported, and their manifest entry is replaced by
+    one with only an 'error' message. One failure doesn't stop the
+    others. Any entries already in the manifest for other outcome
+    types are kept.
+
+    Inputs
+    ------
+    outcome_types - list or None. Outcome types to build. If None,
+                    build every type in fixed_params.outcome_type_dict.
+    out_dir       - str. Where to save the files and manifest.
+    max_workers   - int or None. Number of worker processes.
+
+    Returns
+    -------
+    manifest - dict. One entry per outcome type.
+    """
+    if outcome_types is None:
+        outcome_types = list(outcome_type_dict.values())
+
+    manifest = load_manifest(out_dir)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(build_one, outcome_type, out_dir): outcome_type
+            for outcome_type in outcome_types
+        }
+        for future in as_completed(futures):
+            outcome_type = futures[future]
+            try:
+                manifest[outcome_type] = future.result()
+            except Exception as e:
+                # Includes errors raised in the worker process and a
+                # worker that died:
+                manifest[outcome_type] = {
+                    'error': f'{type(e).__name__}: {e}'}
+                print(f'Failed {outcome_type}: {e}')
+            else:
+                print(f'Built {outcome_type}.')
+
+    # Sort keys so the manifest itself is reproducible:
+    with open(os.path.join(out_dir, manifest_name), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(out_dir='.'):
+    """Load the build manifest, or an empty dict if there isn't one."""
+    path_to_manifest = os.path.join(out_dir, manifest_name)
+    try:
+        with open(path_to_manifest, 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    return manifest
+
+
+def built_html_version(outcome_type, out_dir='.'):
+    """
+    Something that changes whenever the built map changes.
+
+    Use it in cache keys so that a rebuild isn't hidden by a cached
+    copy of the old map.
+
+    Returns
+    -------
+    version - str, float or None. The map's manifest entry as text,
+              or the modified time of the plain HTML file if it isn't
+              in the manifest, or None if neither exists.
+    """
+    entry = load_manifest(out_dir).get(outcome_type)
+    if entry is not None:
+        return json.dumps(entry, sort_keys=True)
+    path_to_html = os.path.join(out_dir, make_html_name(outcome_type))
+    if os.path.exists(path_to_html):
+        return os.path.getmtime(path_to_html)
+    return None
+
+
+def read_built_html(outcome_type, out_dir='.'):
+    """
+    Read a pre-rendered map, using the smallest file available.
+
+    The compressed copies are preferred because they are quicker to
+    read from disk. The decompressed page is checked against the
+    hash in the manifest.
+
+    Inputs
+    ------
+    outcome_type - str. e.g. 'added~utility'.
+    out_dir      - str. Where the files and manifest live.
+
+    Returns
+    -------
+    html - str. The full HTML page for the map.
+    """
+    entry = load_manifest(out_dir).get(outcome_type)
+    if (entry is not None) and ('error' in entry):
+        raise FileNotFoundError(
+            f'{outcome_type} map failed to build. {entry["error"]}')
+    if entry is None:
+        # No manifest for this map, so fall back to the plain file:
+        path_to_html = os.path.join(out_dir, make_html_name(outcome_type))
+        with open(path_to_html, 'r') as f:
+            html = f.read()
+        return html
+
+    files = entry['files']
+    if (brotli is not None) and ('brotli' in files):
+        with open(os.path.join(out_dir, files['brotli']['name']), 'rb') as f:
+            html_bytes = brotli.decompress(f.read())
+    elif 'gzip' in files:
+        with open(os.path.join(out_dir, files['gzip']['name']), 'rb') as f:
+            html_bytes = gzip.decompress(f.read())
+    else:
+        with open(os.path.join(out_dir, files['html']['name']), 'rb') as f:
+            html_bytes = f.read()
+
+    if sha256_of_bytes(html_bytes) != entry['sha256']:
+        raise ValueError(
+            f'{outcome_type} map does not match the manifest hash. '
+            'Rebuild with `python -m utilities_maps.build_html`.'
+            )
+    return html_bytes.decode('utf-8')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Pre-render the dual-map HTML files.')
+    parser.add_argument(
+        '--outcome_types', nargs='*', default=None,
+        help='Outcome types to build. Default: all of them.')
+    parser.add_argument(
+        '--out_dir', default='.',
+        help='Where to write the HTML files and manifest.')
+    parser.add_argument(
+        '--max_workers', type=int, default=None,
+        help='Number of worker processes.')
+    args = parser.parse_args()
+
+    build_all(args.outcome_types, args.out_dir, args.max_workers)
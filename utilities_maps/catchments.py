@@ -0,0 +1,187 @@
+"""
+Catchment outlines: the area around each stroke unit whose LSOA have
+that unit as their nearest IVT or MT unit.
+
+The source folder data_maps/lsoa_nearest_hospital/ has one file per
+unit and treatment, named lsoa_nearest_<IVT or MT>_<postcode>.geojson.
+Each file is one bare MultiPolygon geometry. Here the files for each
+treatment are merged into one FeatureCollection with one feature per
+unit, so the maps need one file read and one layer per treatment.
+
+Catchments for any choice of units can also be worked out from the
+travel time matrix with make_catchments().
+"""
+import streamlit as st
+import os
+import numpy as np
+import pandas as pd
+import geopandas
+
+from utilities_maps.load_data import dir_prepared, read_json, write_json
+from utilities_maps.geometry_store import load_geometry_store
+from utilities_maps.topology import load_store_dissolver
+
+
+dir_catchments = os.path.join('data_maps', 'lsoa_nearest_hospital')
+
+treatments = ['IVT', 'MT']
+
+
+def path_to_catchments(treatment):
+    return os.path.join(dir_prepared, f'catchments_{treatment}.geojson')
+
+
+def build_catchment_geojson(treatment):
+    """
+    Merge the per-unit catchment files for one treatment.
+
+    Inputs
+    ------
+    treatment - str. 'IVT' or 'MT'.
+
+    Returns
+    -------
+    geojson - dict. FeatureCollection with one feature per unit and
+              the unit's postcode in the 'unit' property.
+    """
+    prefix = f'lsoa_nearest_{treatment}_'
+    features = []
+    for file_name in sorted(os.listdir(dir_catchments)):
+        if not (file_name.startswith(prefix) and
+                file_name.endswith('.geojson')):
+            continue
+        geometry = read_json(os.path.join(dir_catchments, file_name))
+        unit = file_name.removeprefix(prefix).removesuffix('.geojson')
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': geometry['type'],
+                'coordinates': geometry['coordinates']
+            },
+            # The source files also list every LSOA name, which
+            # isn't needed for drawing the outlines.
+            'properties': {'unit': unit}
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def save_catchments():
+    """Merge the catchment files and save them to data_maps/prepared/."""
+    os.makedirs(dir_prepared, exist_ok=True)
+    for treatment in treatments:
+        write_json(
+            build_catchment_geojson(treatment),
+            path_to_catchments(treatment)
+            )
+
+
+@st.cache_resource
+def import_catchment_geojson(treatment):
+    """
+    Shared merged catchment outlines. Build them first if needed.
+
+    Inputs
+    ------
+    treatment - str. 'IVT' or 'MT'.
+
+    Returns
+    -------
+    geojson - dict. FeatureCollection with a 'unit' property. Don't
+              change this in place because every session shares it.
+    """
+    if not os.path.exists(path_to_catchments(treatment)):
+        save_catchments()
+    return read_json(path_to_catchments(treatment))
+
+
+def eligible_units(df_units, treatment):
+    """
+    Postcodes of the units that provide a treatment.
+
+    Inputs
+    ------
+    df_units  - pd.DataFrame. Has a 'Postcode' column and the flag
+                columns 'Use_IVT' and 'Use_MT', e.g. from
+                stroke_hospitals_2022.csv. Change the flags to try out
+                a different set of units.
+    treatment - str. 'IVT' or 'MT'.
+
+    Returns
+    -------
+    units - list. Postcodes of units with the flag set.
+    """
+    return df_units.loc[df_units[f'Use_{treatment}'] > 0, 'Postcode'].tolist()
+
+
+def find_nearest_units(df_travel_times, units):
+    """
+    Nearest unit to each LSOA by travel time.
+
+    Inputs
+    ------
+    df_travel_times - pd.DataFrame or TravelTimeMatrix. One row per
+                      LSOA, indexed by LSOA name, and one column of
+                      travel times per unit.
+    units           - list. Postcodes of the units to choose from.
+
+    Returns
+    -------
+    nearest - pd.Series. Postcode of the nearest unit, indexed by
+              LSOA name. Missing for an LSOA without any travel times
+              to these units.
+    """
+    times = df_travel_times[units].to_numpy(dtype=float)
+    # Missing times can't be the nearest:
+    missing = np.isnan(times)
+    nearest = np.argmin(np.where(missing, np.inf, times), axis=1)
+    # argmin gives 0 when every time is missing, so mark those:
+    nearest = np.asarray(units, dtype=object)[nearest]
+    nearest[missing.all(axis=1)] = None
+    return pd.Series(nearest, index=df_travel_times.index, name='unit')
+
+
+def make_catchments(df_travel_times, units):
+    """
+    Catchment outlines for any set of units.
+
+    Inputs
+    ------
+    df_travel_times - pd.DataFrame or TravelTimeMatrix. LSOA by unit
+                      travel times, e.g. from
+                      travel_times.load_travel_times().
+    units           - list. Postcodes of the units to choose from,
+                      e.g. from eligible_units().
+
+    Returns
+    -------
+    gdf - geopandas.GeoDataFrame. One row per unit that is nearest to
+          at least one LSOA, with columns 'unit' and 'geometry'.
+    """
+    store = load_geometry_store()
+    nearest = find_nearest_units(df_travel_times, units)
+
+    # Unit number for each row of the geometry store, -1 for LSOA
+    # that aren't in the travel time matrix or have no nearest unit
+    # (Categorical gives None the code -1):
+    groups = np.full(len(store.gdf), -1)
+    rows = store.name_rows(nearest.index)
+    mask = rows >= 0
+    groups[rows[mask]] = pd.Categorical(
+        nearest.values[mask], categories=units).codes
+
+    # Merge the LSOA by unit along their shared borders:
+    geometries = load_store_dissolver().dissolve(groups, len(units))
+    unit_names = [u for u, g in zip(units, geometries) if g is not None]
+    geometries = [g for g in geometries if g is not None]
+    return geopandas.GeoDataFrame(
+        {'unit': unit_names}, geometry=geometries, crs=store.gdf.crs)
+
+
+def make_catchment_geojson(df_travel_times, units):
+    """
+    Catchment outlines for any set of units as geojson.
+
+    This is in the same form as import_catchment_geojson() so it can
+    be drawn in the same way. See make_catchments() for the inputs.
+    """
+    return make_catchments(df_travel_times, units).__geo_interface__
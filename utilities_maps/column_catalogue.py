@@ -0,0 +1,85 @@
+"""
+Fast lookups of MultiIndex column names.
+
+The outcome data has three column levels (property, scenario and
+subtype). Instead of building a mask over every column each time a
+column is needed, a catalogue lists once which column positions have
+each value in each level. A lookup by any mix of levels is then the
+intersection of a few of those sets.
+"""
+import pandas as pd
+
+
+class ColumnCatalogue:
+    """
+    Index of the values in each level of a column MultiIndex.
+
+    Attributes
+    ----------
+    columns - pd.MultiIndex. The columns that were catalogued.
+    """
+    def __init__(self, columns):
+        self.columns = pd.MultiIndex.from_tuples(
+            list(columns), names=columns.names)
+        self._all = frozenset(range(len(self.columns)))
+        # For each level, the column positions with each value:
+        self._positions = {}
+        for level in self.columns.names:
+            positions = {}
+            for i, value in enumerate(self.columns.get_level_values(level)):
+                positions.setdefault(value, set()).add(i)
+            self._positions[level] = {
+                value: frozenset(p) for value, p in positions.items()}
+
+    def values(self, level):
+        """All of the values in one level, in order of first use."""
+        return list(self._positions[level].keys())
+
+    def positions(self, **kwargs):
+        """
+        Positions of the columns that match in every given level.
+
+        Example usage:
+        catalogue.positions(property=['utility_shift'], subtype=['mean'])
+
+        Inputs
+        ------
+        kwargs - in format level_name=list of values. A column matches
+                 a level if its value is any of the listed values.
+
+        Returns
+        -------
+        positions - list. Sorted column positions.
+        """
+        matches = self._all
+        for level, values in kwargs.items():
+            if isinstance(values, str):
+                values = [values]
+            level_positions = self._positions[level]
+            matches = matches & frozenset().union(
+                *[level_positions.get(v, frozenset()) for v in values])
+        return sorted(matches)
+
+    def find(self, **kwargs):
+        """
+        Full names of the columns that match in every given level.
+
+        See positions() for the inputs.
+
+        Returns
+        -------
+        cols - list. Column name tuples in their original order.
+        """
+        return [self.columns[i] for i in self.positions(**kwargs)]
+
+    def find_one(self, **kwargs):
+        """
+        Full name of the only column that matches.
+
+        See positions() for the inputs. Raises a KeyError unless
+        exactly one column matches.
+        """
+        cols = self.find(**kwargs)
+        if len(cols) != 1:
+            raise KeyError(f'{len(cols)} columns match {kwargs}.')
+        return cols[0]
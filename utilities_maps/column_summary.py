@@ -0,0 +1,156 @@
+"""
+Summary statistics of data columns, saved next to the data.
+
+Colour bar limits need the smallest and largest values of several
+columns. Scanning every LSOA of every column for those on each run
+is wasted work because the data doesn't change between runs. Here
+each column's min, max, largest absolute value, number of NaN and a
+few quantiles are worked out once when the data is prepared and saved
+as a small JSON file. Loading it only reads one entry per column.
+"""
+import streamlit as st
+import os
+import numpy as np
+import pandas as pd
+
+from utilities_maps.load_data import dir_prepared, read_json, write_json
+
+
+# Quantiles kept for each column:
+quantile_levels = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+def summarise_values(values):
+    """
+    Summary statistics of one column.
+
+    Inputs
+    ------
+    values - np.array. Numbers with NaN for missing data.
+
+    Returns
+    -------
+    stats - dict. min, max, absmax, nan_count and quantiles (a list in
+            the order of quantile_levels). The values are None if
+            every entry is NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    finite = values[~np.isnan(values)]
+    if len(finite) == 0:
+        return dict(min=None, max=None, absmax=None,
+                    nan_count=int(len(values)),
+                    quantiles=[None] * len(quantile_levels))
+    v_min = float(finite.min())
+    v_max = float(finite.max())
+    return dict(
+        min=v_min,
+        max=v_max,
+        absmax=max(abs(v_min), abs(v_max)),
+        nan_count=int(len(values) - len(finite)),
+        quantiles=np.quantile(finite, quantile_levels).tolist(),
+    )
+
+
+class ColumnSummary:
+    """
+    Summary statistics of some columns.
+
+    Attributes
+    ----------
+    stats - dict. Column name to the dict from summarise_values().
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def _get(self, cols, key):
+        values = [self.stats[col][key] for col in cols]
+        return [v for v in values if v is not None]
+
+    def min(self, cols):
+        """Smallest value in any of these columns."""
+        return min(self._get(cols, 'min'))
+
+    def max(self, cols):
+        """Largest value in any of these columns."""
+        return max(self._get(cols, 'max'))
+
+    def absmax(self, cols):
+        """Largest absolute value in any of these columns."""
+        return max(self._get(cols, 'absmax'))
+
+    def nan_count(self, col):
+        """Number of NaN in one column."""
+        return self.stats[col]['nan_count']
+
+    def quantile(self, col, q):
+        """One of the saved quantiles (see quantile_levels) of a column."""
+        return self.stats[col]['quantiles'][quantile_levels.index(q)]
+
+
+def summarise_frame(df):
+    """ColumnSummary of every numeric column of a DataFrame."""
+    df = df.select_dtypes('number')
+    return ColumnSummary({
+        col: summarise_values(df[col].to_numpy()) for col in df.columns})
+
+
+def save_column_summary(summary, path_to_file):
+    """
+    Save a ColumnSummary as JSON.
+
+    Column names are stored as lists so that MultiIndex tuples come
+    back as tuples.
+    """
+    data = [
+        [list(col) if isinstance(col, tuple) else col, stats]
+        for col, stats in summary.stats.items()
+    ]
+    write_json(data, path_to_file)
+
+
+def read_column_summary(path_to_file):
+    """Load a ColumnSummary saved by save_column_summary()."""
+    data = read_json(path_to_file)
+    return ColumnSummary({
+        (tuple(col) if isinstance(col, list) else col): stats
+        for col, stats in data
+    })
+
+
+def path_to_csv_summary(path_to_csv):
+    """Where the summary of a csv file is saved."""
+    name = os.path.splitext(os.path.basename(path_to_csv))[0]
+    return os.path.join(dir_prepared, f'{name}_summary.json')
+
+
+@st.cache_resource
+def load_csv_summary(path_to_csv, _prepare=None):
+    """
+    Summary of the columns of a csv file.
+
+    The summary is made the first time and whenever the csv is newer
+    than the saved summary.
+
+    Inputs
+    ------
+    path_to_csv - str. The data file.
+    _prepare    - function or None. Changes the DataFrame from the
+                  csv before it's summarised, e.g. to round it or
+                  add columns. It should be the same function that
+                  the page uses on its copy of the data.
+
+    Returns
+    -------
+    summary - ColumnSummary.
+    """
+    path_to_summary = path_to_csv_summary(path_to_csv)
+    if (os.path.exists(path_to_summary) and
+            os.path.getmtime(path_to_summary) >= os.path.getmtime(path_to_csv)):
+        return read_column_summary(path_to_summary)
+    df = pd.read_csv(path_to_csv)
+    if _prepare is not None:
+        df = _prepare(df)
+    summary = summarise_frame(df)
+    os.makedirs(dir_prepared, exist_ok=True)
+    save_column_summary(summary, path_to_summary)
+    return summary
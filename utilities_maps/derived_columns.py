@@ -0,0 +1,128 @@
+"""
+Outcome columns worked out from other columns.
+
+Several pages add the same difference columns to the LSOA outcomes
+after loading them, e.g. diff_lvo_mt_added_utility is
+mothership_lvo_mt_added_utility - drip_ship_lvo_mt_added_utility.
+Here those are written once as templates in derived_columns. '{x}'
+stands for the rest of a column name, so a template covers every
+outcome that has all of the columns it needs.
+
+The expressions are worked out with numexpr if it's installed, which
+evaluates a whole column in one pass without temporary arrays, or
+otherwise with pandas.eval(). The loaded and derived outcomes are
+cached so that this only happens once per file.
+"""
+import streamlit as st
+import os
+import re
+import pandas as pd
+
+try:
+    # Quicker and uses less memory for whole-column arithmetic.
+    import numexpr
+except ImportError:
+    numexpr = None
+
+
+path_to_lsoa_base = os.path.join('data_maps', 'lsoa_base.csv')
+
+# New column name template: expression template.
+derived_columns = {
+    'diff_{x}': 'mothership_{x} - drip_ship_{x}',
+}
+
+# Column names in an expression, including any {x}:
+_name_pattern = re.compile(r'[A-Za-z_][A-Za-z0-9_]*(?:\{x\}[A-Za-z0-9_]*)?')
+
+
+def expand_derived_columns(columns, registry=derived_columns):
+    """
+    Every derived column that can be made from these columns.
+
+    Inputs
+    ------
+    columns  - list-like. Existing column names.
+    registry - dict. Name template to expression template, as in
+               derived_columns.
+
+    Returns
+    -------
+    expressions - dict. New column name to the expression for it, in
+                  the order of the registry and then of the columns.
+    """
+    columns = list(columns)
+    existing = set(columns)
+    expressions = {}
+    for name_template, expression_template in registry.items():
+        names = _name_pattern.findall(expression_template)
+        names_x = [name for name in names if '{x}' in name]
+        if len(names_x) == 0:
+            # Nothing to fill in, so the template is the column:
+            if set(names) <= existing:
+                expressions[name_template] = expression_template
+            continue
+        # Find the values of x from the first name with x in it:
+        prefix, suffix = names_x[0].split('{x}')
+        pattern = re.compile(
+            re.escape(prefix) + '(?P<x>.+)' + re.escape(suffix) + '$')
+        for column in columns:
+            match = pattern.match(column)
+            if match is None:
+                continue
+            x = match.group('x')
+            if all(name.format(x=x) in existing for name in names):
+                expressions[name_template.format(x=x)] = (
+                    expression_template.format(x=x))
+    return expressions
+
+
+def evaluate_column(expression, df):
+    """
+    Values of an expression of the columns of a DataFrame.
+
+    Returns
+    -------
+    values - np.array. One value per row of df.
+    """
+    names = set(_name_pattern.findall(expression))
+    if numexpr is None:
+        return pd.eval(
+            expression, local_dict={n: df[n] for n in names},
+            engine='python').to_numpy()
+    return numexpr.evaluate(
+        expression, local_dict={n: df[n].to_numpy() for n in names})
+
+
+def add_derived_columns(df, registry=derived_columns):
+    """
+    Copy of a DataFrame with the derived columns added.
+
+    Columns that already exist aren't replaced.
+    """
+    expressions = expand_derived_columns(df.columns, registry)
+    new_columns = {
+        name: evaluate_column(expression, df)
+        for name, expression in expressions.items()
+        if name not in df.columns
+    }
+    return df.assign(**new_columns)
+
+
+def prepare_lsoa_base(df):
+    """Round the LSOA outcomes and add the derived columns."""
+    return add_derived_columns(df.round(3))
+
+
+@st.cache_data
+def load_lsoa_base(path_to_csv=path_to_lsoa_base):
+    """
+    LSOA outcomes from lsoa_base.csv with the derived columns.
+
+    Returns
+    -------
+    df_outcomes - pd.DataFrame. One row per LSOA, rounded to 3 decimal
+                  places, with a diff_ column for each outcome that
+                  has mothership and drip-and-ship columns.
+    """
+    return prepare_lsoa_base(pd.read_csv(path_to_csv))
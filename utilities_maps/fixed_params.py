@@ -11,3 +11,90 @@ def page_setup():
         layout='wide'
         )
     # n.b. this can be set separately for each separate page if you like.
+
+
+# Outcome type options shared by the map pages.
+# Match the display string to the file name string:
+outcome_type_dict = {
+    'Added utility': 'added~utility',
+    'Mean shift in mRS': 'mean~shift',
+    'mRS <= 2': 'mrs<=2'
+}
+
+# Scenario file name strings for the outcome COGs.
+# The first three are drawn on the nLVO map and the rest on the LVO map.
+tiff_file_templates = [
+    'drip~ship~nlvo~ivt~{outcome_type}',
+    'mothership~nlvo~ivt~{outcome_type}',
+    'mothership~minus~dripship~nlvo~ivt~{outcome_type}',
+    'drip~ship~lvo~mt~{outcome_type}',
+    'mothership~lvo~mt~{outcome_type}',
+    'mothership~minus~dripship~lvo~mt~{outcome_type}',
+]
+
+tiff_layer_names = [
+    # nLVO
+    'Drip and ship',
+    'Mothership',
+    'Advantage of Mothership',
+    # LVO
+    'Drip and ship',
+    'Mothership',
+    'Advantage of Mothership',
+]
+
+# Colour bar setup for each outcome type.
+# The first dict is for the scenario maps and the second
+# is for the difference maps.
+tiff_cbar_dicts = {
+    'added~utility': (
+        dict(
+            min=0.0261,
+            max=0.1759,
+            cmap='inferno',
+            cbar_label='Added utility'
+        ),
+        dict(
+            min=-0.09620000000000009,
+            max=0.09620000000000009,
+            cmap='bwr_r',
+            cbar_label='Advantage of Mothership (added utility)'
+        )
+    ),
+    'mean~shift': (
+        dict(
+            min=-0.89,
+            max=-0.1,
+            cmap='inferno_r',
+            cbar_label='mRS shift; negative is better'
+        ),
+        dict(
+            min=-0.51,
+            max=0.51,
+            cmap='bwr',
+            cbar_label='Advantage of Mothership (mRS shift; negative is better)'
+        )
+    ),
+    'mrs<=2': (
+        dict(
+            min=0.29,
+            max=0.7,
+            cmap='inferno',
+            cbar_label='mRS <= 2'
+        ),
+        dict(
+            min=-0.10000000000000003,
+            max=0.10000000000000003,
+            cmap='bwr_r',
+            cbar_label='Advantage of Mothership (mRS <= 2)'
+        )
+    ),
+}
+
+
+def make_cog_file_list(outcome_type):
+    """Full paths to the six outcome COGs for this outcome type."""
+    return [
+        f'data_maps/LSOA_{s.format(outcome_type=outcome_type)}_cog.tif'
+        for s in tiff_file_templates
+    ]
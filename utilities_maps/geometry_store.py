@@ -0,0 +1,369 @@
+"""
+One store of LSOA geometry with the regions that each LSOA is in.
+
+The per-region geojson files in data_maps/lhb_stp_geojson/ and
+data_maps/lhb_scn_geojson/ repeat the same LSOA polygons (all of the
+Welsh health boards are in both folders). Here they are combined into
+a single table with one row per LSOA and one integer column per
+region level. The integers index into a list of region names for that
+level, and -1 means "not in any region of this level".
+
+Because the table is only loaded once and the region lookups are
+indexes of row positions, any set of regions can be picked out
+without reading files or copying the polygons.
+
+Each polygon is kept in two coordinate systems: longitude and
+latitude (EPSG:4326) for the web maps, and British National Grid
+(EPSG:27700) for anything measured in metres. Both are worked out
+when the store is built so that drawing a map never reprojects.
+"""
+import streamlit as st
+import os
+import json
+import numpy as np
+import pandas as pd
+import geopandas
+from shapely.geometry import box
+
+from utilities_maps.load_data import dir_prepared
+
+
+# Region levels stored in the membership columns:
+region_levels = ['stp', 'scn', 'lhb', 'icb', 'sicbl', 'lad']
+
+# Columns of an LSOA lookup csv with the region names of each level:
+lookup_name_cols = {'icb': 'ICB22NM', 'sicbl': 'SICBL22NM', 'lad': 'LAD17NM'}
+
+# Source folders and which level their files describe.
+# Welsh health board files are in both and are stored as 'lhb'.
+region_dirs = {
+    'stp': os.path.join('data_maps', 'lhb_stp_geojson'),
+    'scn': os.path.join('data_maps', 'lhb_scn_geojson'),
+}
+
+# Geometry column for each coordinate system. The first is the
+# GeoDataFrame's active geometry:
+geometry_cols = {'EPSG:4326': 'geometry', 'EPSG:27700': 'geometry_bng'}
+
+path_to_store = os.path.join(dir_prepared, 'lsoa_geometry.parquet')
+path_to_region_names = os.path.join(dir_prepared, 'lsoa_geometry_regions.json')
+
+
+def region_from_file_name(file_name):
+    """'LSOA_Thames~Valley.geojson' -> 'Thames Valley'."""
+    region = file_name.removeprefix('LSOA_').removesuffix('.geojson')
+    return region.replace('~', ' ')
+
+
+def build_geometry_store(path_to_lookup=None):
+    """
+    Combine the per-region LSOA geojson into one file.
+
+    Inputs
+    ------
+    path_to_lookup - str or None. Optional csv with an LSOA11CD
+                     column and any of the columns ICB22NM,
+                     SICBL22NM, LAD17NM for regions that aren't in
+                     the geojson folders, in the same style as
+                     data_maps/hospitals_and_lsoas.csv.
+                     Without it, LAD is taken from the LSOA name
+                     (e.g. 'East Devon 001A' is in 'East Devon') and
+                     ICB and SICBL are left blank.
+
+    Returns
+    -------
+    gdf          - GeoDataFrame. One row per LSOA, sorted by LSOA11CD.
+                   Polygons in 'geometry' (EPSG:4326) and
+                   'geometry_bng' (EPSG:27700).
+    region_names - dict. For each region level, the list of region
+                   names that the integer columns index into.
+    """
+    gdfs = []
+    for level, dir_regions in region_dirs.items():
+        for file_name in sorted(os.listdir(dir_regions)):
+            if not file_name.endswith('.geojson'):
+                continue
+            gdf_region = geopandas.read_file(
+                os.path.join(dir_regions, file_name))
+            region = region_from_file_name(file_name)
+            gdf_region['level'] = (
+                'lhb' if region.endswith('Health Board') else level)
+            gdf_region['region'] = region
+            gdfs.append(gdf_region)
+    gdf_all = pd.concat(gdfs, ignore_index=True)
+
+    # Membership of each LSOA in each region level:
+    df_members = (
+        gdf_all[['LSOA11CD', 'level', 'region']]
+        .drop_duplicates(subset=['LSOA11CD', 'level'])
+        .pivot(index='LSOA11CD', columns='level', values='region')
+    )
+
+    # Keep one copy of each polygon:
+    gdf = gdf_all.drop_duplicates(subset='LSOA11CD')
+    gdf = gdf[['LSOA11CD', 'LSOA11NM', 'LSOA11NMW', 'geometry']]
+    gdf = gdf.set_index('LSOA11CD').sort_index()
+    gdf = gdf.join(df_members)
+
+    # Project once here rather than whenever a map is drawn:
+    gdf = gdf.to_crs('EPSG:4326')
+    gdf['geometry_bng'] = gdf.geometry.to_crs('EPSG:27700')
+
+    # Local authority from the LSOA name, e.g. 'East Devon 001A':
+    gdf['lad'] = gdf['LSOA11NM'].str.rsplit(' ', n=1).str[0]
+
+    if path_to_lookup is not None:
+        df_lookup = pd.read_csv(path_to_lookup, index_col='LSOA11CD')
+        for level, col in lookup_name_cols.items():
+            if col in df_lookup.columns:
+                gdf[level] = df_lookup[col].reindex(gdf.index)
+
+    # Swap region names for integers:
+    region_names = {}
+    for level in region_levels:
+        if level not in gdf.columns:
+            gdf[level] = np.nan
+        names = sorted(gdf[level].dropna().unique())
+        codes = pd.Categorical(gdf[level], categories=names).codes
+        gdf[level] = codes.astype(np.int16)
+        region_names[level] = names
+
+    gdf = gdf.reset_index()
+    return gdf, region_names
+
+
+def save_geometry_store(path_to_lookup=None):
+    """Build the geometry store and save it to data_maps/prepared/."""
+    gdf, region_names = build_geometry_store(path_to_lookup)
+    os.makedirs(dir_prepared, exist_ok=True)
+    gdf.to_parquet(path_to_store)
+    with open(path_to_region_names, 'w') as f:
+        json.dump(region_names, f, indent=2)
+    return gdf, region_names
+
+
+class GeometryStore:
+    """
+    LSOA geometry with fast lookups by region.
+
+    Attributes
+    ----------
+    gdf          - GeoDataFrame. One row per LSOA. The row position
+                   is the integer LSOA index used elsewhere.
+    region_names - dict. Region names for each level.
+    """
+    def __init__(self, gdf, region_names):
+        self.gdf = gdf
+        self.region_names = region_names
+        # For each level, row positions of the LSOA in each region:
+        self._index = {}
+        for level in region_levels:
+            codes = gdf[level].values
+            order = np.argsort(codes, kind='stable')
+            splits = np.searchsorted(
+                codes[order], np.arange(len(region_names[level]) + 1))
+            self._index[level] = [
+                order[splits[i]:splits[i + 1]]
+                for i in range(len(region_names[level]))
+            ]
+        # For finding rows from LSOA names and codes:
+        self._names = pd.Index(gdf['LSOA11NM'])
+        self._codes = pd.Index(gdf['LSOA11CD'])
+
+    def geometry(self, crs='EPSG:4326'):
+        """
+        Polygons of every LSOA in one of the stored coordinate systems.
+
+        Inputs
+        ------
+        crs - str. One of the keys of geometry_cols.
+
+        Returns
+        -------
+        geometry - GeoSeries. One row per LSOA, in store order.
+        """
+        try:
+            return self.gdf[geometry_cols[crs]]
+        except KeyError:
+            raise KeyError(
+                f'The geometry store has no {crs} polygons. '
+                f'Use one of: {", ".join(geometry_cols)}') from None
+
+    def name_rows(self, lsoa_names):
+        """
+        Row positions of LSOA from their names (LSOA11NM).
+
+        Inputs
+        ------
+        lsoa_names - list-like. LSOA names, e.g. the index of the
+                     travel time matrix.
+
+        Returns
+        -------
+        rows - np.array. Row position of each name in self.gdf, in the
+               same order, or -1 if the name isn't in the store.
+        """
+        return self._names.get_indexer(lsoa_names)
+
+    def code_rows(self, lsoa_codes):
+        """
+        Row positions of LSOA from their codes (LSOA11CD).
+
+        Returns -1 for codes that aren't in the store. See name_rows().
+        """
+        return self._codes.get_indexer(lsoa_codes)
+
+    def region_rows(self, level, regions):
+        """
+        Row positions of the LSOA in any of these regions.
+
+        Inputs
+        ------
+        level   - str. One of region_levels.
+        regions - list. Region names in that level.
+
+        Returns
+        -------
+        rows - np.array. Sorted row positions into self.gdf.
+        """
+        names = self.region_names[level]
+        try:
+            rows = [self._index[level][names.index(r)] for r in regions]
+        except ValueError:
+            missing = [r for r in regions if r not in names]
+            raise KeyError(
+                f'Not {level} regions: {", ".join(missing)}') from None
+        if len(rows) == 0:
+            return np.array([], dtype=int)
+        return np.unique(np.concatenate(rows))
+
+    def select(self, level, regions):
+        """GeoDataFrame of the LSOA in any of these regions."""
+        return self.gdf.iloc[self.region_rows(level, regions)]
+
+    def viewport_rows(self, bounds):
+        """
+        Row positions of the LSOA that overlap a box.
+
+        geopandas' spatial index is a shapely STRtree of the polygon
+        envelopes, so this only has to check the few LSOA whose
+        envelopes are near the box.
+
+        Inputs
+        ------
+        bounds - tuple. (lon_min, lat_min, lon_max, lat_max).
+
+        Returns
+        -------
+        rows - np.array. Sorted row positions into self.gdf.
+        """
+        rows = self.gdf.sindex.query(box(*bounds), predicate='intersects')
+        return np.sort(rows)
+
+
+@st.cache_resource
+def load_geometry_store():
+    """
+    Shared LSOA geometry store. Build it first if it doesn't exist.
+
+    Don't change the returned data in place because every session
+    shares it.
+    """
+    if not os.path.exists(path_to_store):
+        save_geometry_store()
+    gdf = geopandas.read_parquet(path_to_store)
+    if not (set(geometry_cols.values()) | set(region_levels)) <= set(
+            gdf.columns):
+        # Stores made before these columns were added:
+        gdf, region_names = save_geometry_store()
+    with open(path_to_region_names, 'r') as f:
+        region_names = json.load(f)
+    return GeometryStore(gdf, region_names)
+
+
+@st.cache_resource
+def import_region_geojson(level, regions):
+    """
+    Cached geojson of the LSOA in these regions for folium and plotly.
+
+    Inputs
+    ------
+    level   - str. One of region_levels.
+    regions - tuple. Region names in that level.
+
+    Returns
+    -------
+    geojson - dict. GeoJSON FeatureCollection with properties
+              LSOA11CD, LSOA11NM and LSOA11NMW.
+    """
+    store = load_geometry_store()
+    gdf = store.select(level, list(regions))
+    return gdf[['LSOA11CD', 'LSOA11NM', 'LSOA11NMW', 'geometry']].__geo_interface__
+
+
+def simplify_tolerance_for_zoom(zoom):
+    """
+    Simplification tolerance in degrees for a web map zoom level.
+
+    This is roughly the width of one pixel, so the simplified
+    polygons look the same as the full ones at this zoom.
+    """
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def pad_bounds(bounds, padding=0.25, step=0.05):
+    """
+    Grow a box and snap it outwards to a grid.
+
+    Padding means that small pans don't need new data, and snapping
+    means that nearby views share the same cached selection.
+
+    Inputs
+    ------
+    bounds  - tuple. (lon_min, lat_min, lon_max, lat_max).
+    padding - float. Fraction of the box size to add on each side.
+    step    - float. Grid spacing in degrees.
+
+    Returns
+    -------
+    bounds - tuple. (lon_min, lat_min, lon_max, lat_max).
+    """
+    lon_min, lat_min, lon_max, lat_max = bounds
+    pad_lon = (lon_max - lon_min) * padding
+    pad_lat = (lat_max - lat_min) * padding
+    return (
+        np.floor((lon_min - pad_lon) / step) * step,
+        np.floor((lat_min - pad_lat) / step) * step,
+        np.ceil((lon_max + pad_lon) / step) * step,
+        np.ceil((lat_max + pad_lat) / step) * step,
+    )
+
+
+@st.cache_resource(max_entries=64)
+def _import_viewport_geojson(padded_bounds, zoom):
+    store = load_geometry_store()
+    gdf = store.gdf.iloc[store.viewport_rows(padded_bounds)]
+    gdf = gdf[['LSOA11CD', 'LSOA11NM', 'LSOA11NMW', 'geometry']].copy()
+    gdf['geometry'] = gdf.geometry.simplify(
+        simplify_tolerance_for_zoom(zoom), preserve_topology=True)
+    return gdf.__geo_interface__
+
+
+def import_viewport_geojson(bounds, zoom, padding=0.25):
+    """
+    Geojson of only the LSOA near the current map view.
+
+    Inputs
+    ------
+    bounds  - tuple. (lon_min, lat_min, lon_max, lat_max) of the view.
+    zoom    - int. Web map zoom level. Sets how much the polygons
+              are simplified.
+    padding - float. Fraction of the view size to include around it.
+
+    Returns
+    -------
+    geojson - dict. GeoJSON FeatureCollection with properties
+              LSOA11CD, LSOA11NM and LSOA11NMW.
+    """
+    padded_bounds = tuple(float(b) for b in pad_bounds(bounds, padding))
+    return _import_viewport_geojson(padded_bounds, int(zoom))
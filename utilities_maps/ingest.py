@@ -0,0 +1,56 @@
+"""
+Offline steps that turn the raw data files into the prepared files
+that the app loads.
+
+The app builds any missing prepared file the first time it is needed,
+but that can be slow, so run these in advance after changing the data.
+
+Usage, from the top of the repository:
+
+    python -m utilities_maps.ingest            # run every step
+    python -m utilities_maps.ingest geometry   # run one step
+"""
+import argparse
+
+import utilities_maps.geometry_store as geometry_store
+import utilities_maps.topology as topology
+import utilities_maps.region_outlines as region_outlines
+import utilities_maps.catchments as catchments
+import utilities_maps.value_rasters as value_rasters
+import utilities_maps.outcome_store as outcome_store
+import utilities_maps.travel_times as travel_times
+
+
+# Each step is a function that takes no arguments:
+ingest_steps = {
+    'geometry': geometry_store.save_geometry_store,
+    'topology': topology.save_store_topology,
+    'regions': region_outlines.save_region_outlines,
+    'catchments': catchments.save_catchments,
+    'values': value_rasters.save_value_cogs,
+    'outcomes': outcome_store.save_outcome_store,
+    'travel_times': travel_times.save_travel_times,
+}
+
+
+def run_steps(step_names=None):
+    if (step_names is None) or (len(step_names) == 0):
+        step_names = list(ingest_steps.keys())
+    for step_name in step_names:
+        print(f'Running {step_name}...')
+        ingest_steps[step_name]()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Prepare data files for the app.')
+    parser.add_argument(
+        'steps', nargs='*',
+        help=f'Steps to run from: {", ".join(ingest_steps)}. '
+             'Default: all of them.')
+    args = parser.parse_args()
+    unknown_steps = [s for s in args.steps if s not in ingest_steps]
+    if len(unknown_steps) > 0:
+        parser.error(f'Unknown steps: {", ".join(unknown_steps)}')
+
+    run_steps(args.steps)
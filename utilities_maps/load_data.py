@@ -0,0 +1,273 @@
+"""
+Shared loaders for the map data files.
+
+The loaders here do any slow tidying of the data once, save the
+tidied version to file, and keep the result in memory for every
+session of the app (st.cache_resource). Treat the returned objects
+as read-only because they are shared.
+"""
+import streamlit as st
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+from geojson_rewind import rewind
+
+try:
+    # Much faster than the json module for the large LSOA files.
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Tidied copies of the data files are saved here:
+dir_prepared = os.path.join('data_maps', 'prepared')
+# Files here are served by Streamlit at app/static/ (static serving is
+# turned on in .streamlit/config.toml):
+dir_static = 'static'
+
+default_geojson_file = (
+    'LSOA_(Dec_2011)_Boundaries_Super_Generalised_Clipped_(BSC)_EW_V3_reduced3.geojson')
+
+
+def read_json(path_to_file):
+    """Read a JSON file with orjson if it's installed."""
+    if orjson is None:
+        with open(path_to_file, 'r') as f:
+            data = json.load(f)
+    else:
+        with open(path_to_file, 'rb') as f:
+            data = orjson.loads(f.read())
+    return data
+
+
+@contextmanager
+def open_atomic(path_to_file, mode='wb'):
+    """
+    Open a temporary file that replaces path_to_file when it's closed.
+
+    The temporary file is in the same folder so that os.replace() is
+    one rename. Sessions reading the file see either the old one or
+    the whole new one, never half of it, and a write that fails
+    leaves the old file alone.
+    """
+    fd, path_to_tmp = tempfile.mkstemp(
+        dir=os.path.dirname(path_to_file) or '.',
+        prefix='.' + os.path.basename(path_to_file), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(path_to_tmp, path_to_file)
+    except BaseException:
+        os.remove(path_to_tmp)
+        raise
+
+
+def write_json(data, path_to_file):
+    """
+    Write a JSON file with orjson if it's installed.
+
+    The file is replaced in one step, see open_atomic().
+    """
+    if orjson is None:
+        with open_atomic(path_to_file, 'w') as f:
+            json.dump(data, f)
+    else:
+        with open_atomic(path_to_file, 'wb') as f:
+            f.write(orjson.dumps(data))
+
+
+def find_geojson_problems(geojson):
+    """
+    Check that every feature is a usable polygon.
+
+    Inputs
+    ------
+    geojson - dict. GeoJSON FeatureCollection.
+
+    Returns
+    -------
+    problems - list. One dict per bad feature with its position in
+               the feature list, its properties and the problem.
+    """
+    problems = []
+    for i, feature in enumerate(geojson['features']):
+        problem = ''
+        if feature.get('type') != 'Feature':
+            problem = 'Not a Feature'
+        else:
+            geometry = feature.get('geometry')
+            if geometry is None:
+                problem = 'No geometry'
+            elif geometry.get('type') not in ['Polygon', 'MultiPolygon']:
+                problem = f'Geometry type {geometry.get("type")}'
+            elif len(geometry.get('coordinates', [])) < 1:
+                problem = 'No coordinates'
+        if len(problem) > 0:
+            problems.append({
+                'feature': i,
+                'properties': feature.get('properties'),
+                'problem': problem
+            })
+    return problems
+
+
+def prepare_geojson(geojson_file):
+    """
+    Load a geojson, fix its winding order and check its features.
+
+    The tidied geojson and the list of problems are saved in
+    data_maps/prepared/ so this only happens once per version of the
+    source file.
+
+    Inputs
+    ------
+    geojson_file - str. Path to the file relative to data_maps/.
+
+    Returns
+    -------
+    geojson  - dict. GeoJSON with polygons in the right winding order.
+    problems - list. Output of find_geojson_problems().
+    """
+    path_to_file = os.path.join('data_maps', geojson_file)
+    source_mtime = os.path.getmtime(path_to_file)
+    # Store all prepared files in one place regardless of subfolder:
+    prepared_name = geojson_file.replace('/', '~').lstrip('~')
+    path_to_prepared = os.path.join(dir_prepared, prepared_name)
+
+    if os.path.exists(path_to_prepared):
+        prepared = read_json(path_to_prepared)
+        if prepared.get('source_mtime') == source_mtime:
+            return prepared['geojson'], prepared['problems']
+
+    geojson = read_json(path_to_file)
+    # Sort out any problem polygons with coordinates in wrong order:
+    geojson = rewind(geojson, rfc7946=False)
+    problems = find_geojson_problems(geojson)
+
+    os.makedirs(dir_prepared, exist_ok=True)
+    write_json({
+        'source_mtime': source_mtime,
+        'problems': problems,
+        'geojson': geojson
+    }, path_to_prepared)
+    return geojson, problems
+
+
+@st.cache_resource
+def _load_prepared_geojson(geojson_file):
+    return prepare_geojson(geojson_file)
+
+
+def import_geojson(geojson_file=''):
+    """
+    Shared, cached, tidied geojson.
+
+    Inputs
+    ------
+    geojson_file - str. Path to the file relative to data_maps/.
+                   Defaults to the reduced LSOA boundaries.
+
+    Returns
+    -------
+    geojson_ew - dict. GeoJSON FeatureCollection. Don't change this
+                 in place because every session shares it.
+    """
+    if len(geojson_file) < 1:
+        geojson_file = default_geojson_file
+    geojson_ew, problems = _load_prepared_geojson(geojson_file)
+    return geojson_ew
+
+
+def import_geojson_problems(geojson_file=''):
+    """List of problem features found when the geojson was loaded."""
+    if len(geojson_file) < 1:
+        geojson_file = default_geojson_file
+    geojson_ew, problems = _load_prepared_geojson(geojson_file)
+    return problems
+
+
+def copy_geojson_properties(geojson):
+    """
+    Copy of a geojson with new properties dicts but shared geometry.
+
+    folium.GeoJson writes the style of each feature into its
+    properties, so give it this copy instead of the shared geojson.
+    This is much quicker than a deep copy because the coordinates
+    are not copied.
+    """
+    geojson = dict(geojson)
+    geojson['features'] = [
+        {**feature, 'properties': dict(feature.get('properties') or {})}
+        for feature in geojson['features']
+    ]
+    return geojson
+
+
+@st.cache_resource
+def _import_geojson_ids(geojson_file, id_property):
+    geojson_ew = import_geojson(geojson_file)
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'id': feature['properties'][id_property],
+                'geometry': feature['geometry'],
+            }
+            for feature in geojson_ew['features']
+        ]
+    }
+
+
+def import_geojson_ids(geojson_file='', id_property='LSOA11NM'):
+    """
+    Shared, cached geojson with only an id for each feature.
+
+    plotly writes the whole geojson into the page for every trace
+    that uses it, so this leaves out the properties that it doesn't
+    need. The geometry is shared with import_geojson(). Use it with
+    plotly's default featureidkey ('id').
+
+    Inputs
+    ------
+    geojson_file - str. As in import_geojson().
+    id_property  - str. Property to use as the feature id.
+    """
+    if len(geojson_file) < 1:
+        geojson_file = default_geojson_file
+    return _import_geojson_ids(geojson_file, id_property)
+
+
+@st.cache_resource
+def _export_geojson_ids(geojson_file, id_property, source_mtime):
+    # One file per source and id, named like the prepared files:
+    prepared_name = geojson_file.replace('/', '~').lstrip('~')
+    static_name = prepared_name.replace('.geojson', f'~{id_property}.geojson')
+    path_to_static = os.path.join(dir_static, static_name)
+    if not (os.path.exists(path_to_static) and
+            os.path.getmtime(path_to_static) >= source_mtime):
+        os.makedirs(dir_static, exist_ok=True)
+        write_json(
+            _import_geojson_ids(geojson_file, id_property), path_to_static)
+    return f'app/static/{static_name}'
+
+
+def import_geojson_ids_url(geojson_file='', id_property='LSOA11NM'):
+    """
+    URL of the id-only geojson from import_geojson_ids().
+
+    The geojson is written once to static/ and the browser fetches it
+    from there. A plotly trace given this URL instead of the geojson
+    doesn't carry the shapes in the figure, so traces that share
+    shapes only send them once and the browser can cache them.
+
+    Returns
+    -------
+    url - str. Relative URL of the file, e.g. for go.Choropleth's
+          geojson.
+    """
+    if len(geojson_file) < 1:
+        geojson_file = default_geojson_file
+    source_mtime = os.path.getmtime(os.path.join('data_maps', geojson_file))
+    return _export_geojson_ids(geojson_file, id_property, source_mtime)
@@ -0,0 +1,755 @@
+"""
+Functions for making folium maps.
+
+These are kept separate from the Streamlit pages so that the same
+maps can be built either live in the app or offline by the
+HTML build script (see utilities_maps/build_html.py).
+"""
+import numpy as np
+
+import folium
+import folium.plugins
+# For importing colour maps:
+import matplotlib.pyplot as plt
+# For the colour bar:
+import branca
+from branca.element import Element, MacroElement
+from jinja2 import Template
+from jinja2.utils import htmlsafe_json_dumps
+
+# For reading the cloud-optimised geotiffs:
+from utilities_maps.rasters import read_cog, open_cog
+from utilities_maps.load_data import copy_geojson_properties
+from utilities_maps.catchments import import_catchment_geojson
+from utilities_maps.raster_algebra import RasterExpression
+from utilities_maps.overlays import (
+    import_cog_overlay, import_value_overlay, import_expression_overlay,
+    default_png_compression)
+
+
+def import_cog(out_cog, bounds=None, out_width=1200, out_height=1200):
+    """
+    Pixels of a COG in the NxMx4 shape needed for plotting.
+
+    Only the part of the raster inside bounds is read, from the
+    overview that best matches the map size in pixels. See
+    utilities_maps/rasters.py.
+
+    Returns
+    -------
+    myarray_colours - np.array. Shape (rows, cols, bands).
+    bounds          - tuple. (lon_min, lat_min, lon_max, lat_max) of
+                      the pixels that were read.
+    """
+    return read_cog(out_cog, bounds, out_width, out_height)
+
+
+def draw_cog_on_map(
+        clinic_map, file_name, layer_name='Cog layer',
+        alpha=1.0, visible=True, featuregroup=None, which_map=0,
+        bounds=None, out_width=1200, out_height=1200, use_tiles=False,
+        compression_level=default_png_compression, cbar_dict=None
+        ):
+    """
+    Draw a COG on the map as an ImageOverlay or a TileLayer.
+
+    For the ImageOverlay, only the part inside bounds is drawn.
+    bounds is (lon_min, lat_min, lon_max, lat_max), or None for the
+    whole raster. out_width and out_height are the map size in
+    screen pixels and set which overview is read. compression_level
+    is the PNG zlib level from 0 (quickest) to 9 (smallest).
+
+    The layer is added to featuregroup if one is given, and otherwise
+    to the map picked by which_map (0 for a Map, 1 or 2 for either
+    side of a DualMap).
+
+    If use_tiles is True, draw a TileLayer from the local tile server
+    instead (see utilities_maps/tile_server.py). Then the browser
+    only fetches the tiles in view and nothing is drawn in Python.
+
+    Single-band COGs of values (see utilities_maps/value_rasters.py)
+    are coloured with cbar_dict. file_name can also be a
+    raster_algebra.RasterExpression, which is coloured in the same
+    way. That is always drawn as an ImageOverlay because the tile
+    server can only serve files.
+    """
+    if use_tiles and not isinstance(file_name, RasterExpression):
+        # localtileserver brings in a whole web server, so only
+        # import it when it's needed:
+        from utilities_maps.tile_server import make_cog_tile_layer
+        image = make_cog_tile_layer(
+            file_name, layer_name=layer_name, alpha=alpha, visible=visible,
+            cbar_dict=cbar_dict if open_cog(file_name).count == 1 else None)
+    else:
+        image = make_cog_image_overlay(
+            file_name, layer_name, alpha, visible,
+            bounds, out_width, out_height, compression_level, cbar_dict)
+
+    if featuregroup is not None:
+        featuregroup.add_child(image)
+    elif which_map == 0:
+        image.add_to(clinic_map)
+    elif which_map == 1:
+        image.add_to(clinic_map.m1)
+    elif which_map == 2:
+        image.add_to(clinic_map.m2)
+    return image, clinic_map
+
+
+def make_cog_image_overlay(
+        file_name, layer_name='Cog layer', alpha=1.0, visible=True,
+        bounds=None, out_width=1200, out_height=1200,
+        compression_level=default_png_compression, cbar_dict=None
+        ):
+    """
+    ImageOverlay of the part of a COG inside bounds.
+
+    The projected and encoded image is cached in memory and on disk
+    (see utilities_maps/overlays.py), so this is only slow the first
+    time each COG is drawn with these settings.
+    """
+    if isinstance(file_name, RasterExpression):
+        url, cog_bounds = import_expression_overlay(
+            file_name, cbar_dict, bounds, out_width, out_height,
+            compression_level=compression_level
+            )
+    elif open_cog(file_name).count == 1:
+        # Values, coloured here:
+        url, cog_bounds = import_value_overlay(
+            file_name, cbar_dict, bounds, out_width, out_height,
+            compression_level=compression_level
+            )
+    else:
+        url, cog_bounds = import_cog_overlay(
+            file_name, bounds, out_width, out_height,
+            compression_level=compression_level
+            )
+
+    image = folium.raster_layers.ImageOverlay(
+        name=layer_name,
+        image=url,
+        bounds=[[cog_bounds[1], cog_bounds[0]],
+                [cog_bounds[3], cog_bounds[2]]],
+        opacity=alpha,
+        # The cached image is already in Web-Mercator:
+        mercator_project=False,
+        overlay=False,
+        show=visible
+    )
+    return image
+
+
+class BindColormap(MacroElement):
+    """Binds a colormap to a given layer.
+
+    https://nbviewer.org/gist/BibMartin/f153aa957ddc5fadc64929abdee9ff2e
+
+    Parameters
+    ----------
+    colormap : branca.colormap.ColorMap
+        The colormap to bind.
+    """
+    def __init__(self, layer, colormap):
+        super(BindColormap, self).__init__()
+        self.layer = layer
+        self.colormap = colormap
+
+        # For base layers:
+        self._template = Template(u"""
+        {% macro script(this, kwargs) %}
+            {{this.colormap.get_name()}}.svg[0][0].style.display = 'block';
+            {{this._parent.get_name()}}.on('layeradd', function (eventLayer) {
+                if (eventLayer.layer == {{this.layer.get_name()}}) {
+                    {{this.colormap.get_name()}}.svg[0][0].style.display = 'block';
+                }});
+            {{this._parent.get_name()}}.on('layerremove', function (eventLayer) {
+                if (eventLayer.layer == {{this.layer.get_name()}}) {
+                    {{this.colormap.get_name()}}.svg[0][0].style.display = 'none';
+                }});
+        {% endmacro %}
+        """)  # noqa
+
+
+class SharedGeoJsonData(Element):
+    """
+    GeoJSON data that is written into the page only once.
+
+    It becomes a JavaScript variable at the top of the page's script,
+    so any number of SharedGeoJson layers, in either half of a DualMap,
+    can draw it without another copy of the data. This needs the
+    whole page to be rendered, e.g. with _repr_html_() or save(), so
+    it doesn't work with st_folium.
+    """
+    def __init__(self, data):
+        super(SharedGeoJsonData, self).__init__()
+        self._name = 'SharedGeoJsonData'
+        self.data = data
+
+    def add_to_page(self, figure):
+        """Write the variable into the page if it isn't there yet."""
+        name = self.get_name()
+        if name not in figure.script._children:
+            figure.script.add_child(
+                Element(f'var {name} = {htmlsafe_json_dumps(self.data)};'),
+                name=name,
+                # Before any layer that uses it:
+                index=0
+                )
+
+
+class SharedGeoJson(folium.GeoJson):
+    """
+    folium.GeoJson that draws data from a SharedGeoJsonData.
+
+    data can be a SharedGeoJsonData to share with other layers, or
+    anything folium.GeoJson takes. DualMap copies its layers for the
+    second map, and the copy uses the same data, so adding a
+    SharedGeoJson to a DualMap only puts the data in the page once.
+
+    The other inputs are as for folium.GeoJson, except that
+    zoom_on_click and embed=False aren't available.
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        {%- if this.style %}
+        function {{ this.get_name() }}_styler(feature) {
+            switch({{ this.feature_identifier }}) {
+                {%- for style, ids_list in this.style_map.items() if not style == 'default' %}
+                {% for id_val in ids_list %}case {{ id_val|tojson }}: {% endfor %}
+                    return {{ style }};
+                {%- endfor %}
+                default:
+                    return {{ this.style_map['default'] }};
+            }
+        }
+        {%- endif %}
+        {%- if this.highlight %}
+        function {{ this.get_name() }}_highlighter(feature) {
+            switch({{ this.feature_identifier }}) {
+                {%- for style, ids_list in this.highlight_map.items() if not style == 'default' %}
+                {% for id_val in ids_list %}case {{ id_val|tojson }}: {% endfor %}
+                    return {{ style }};
+                {%- endfor %}
+                default:
+                    return {{ this.highlight_map['default'] }};
+            }
+        }
+        {%- endif %}
+        {%- if this.marker %}
+        function {{ this.get_name() }}_pointToLayer(feature, latlng) {
+            var opts = {{ this.marker.options | tojson | safe }};
+            {%- if this.style_function %}
+            Object.assign(opts, {{ this.get_name() }}_styler(feature));
+            {%- endif %}
+            return new L.{{ this.marker._name }}(latlng, opts);
+        }
+        {%- endif %}
+
+        function {{ this.get_name() }}_onEachFeature(feature, layer) {
+            layer.on({
+                {%- if this.highlight %}
+                mouseout: function(e) {
+                    if(typeof e.target.setStyle === "function"){
+                        {{ this.get_name() }}.resetStyle(e.target);
+                    }
+                },
+                mouseover: function(e) {
+                    if(typeof e.target.setStyle === "function"){
+                        const highlightStyle = {{ this.get_name() }}_highlighter(e.target.feature)
+                        e.target.setStyle(highlightStyle);
+                    }
+                },
+                {%- endif %}
+            });
+        };
+        var {{ this.get_name() }} = L.geoJson(null, {
+            {%- if this.smooth_factor is not none  %}
+                smoothFactor: {{ this.smooth_factor|tojson }},
+            {%- endif %}
+                onEachFeature: {{ this.get_name() }}_onEachFeature,
+            {% if this.style %}
+                style: {{ this.get_name() }}_styler,
+            {%- endif %}
+            {%- if this.marker %}
+                pointToLayer: {{ this.get_name() }}_pointToLayer
+            {%- endif %}
+        });
+        {{ this.get_name() }}
+            .addData({{ this.source.get_name() }})
+            .addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)  # noqa
+
+    def __init__(self, data, **kwargs):
+        if not isinstance(data, SharedGeoJsonData):
+            data = SharedGeoJsonData(data)
+        self.source = data
+        super(SharedGeoJson, self).__init__(data.data, **kwargs)
+        self._name = 'SharedGeoJson'
+
+    def render(self, **kwargs):
+        self.source.add_to_page(self.get_root())
+        super(SharedGeoJson, self).render(**kwargs)
+
+
+def make_shared_catchment_data(treatment):
+    """
+    Catchment outlines for one treatment to draw with SharedGeoJson.
+
+    folium adds styles to the features, so this is a copy of the
+    shared cached geojson.
+    """
+    return SharedGeoJsonData(
+        copy_geojson_properties(import_catchment_geojson(treatment)))
+
+
+def draw_catchment_IVT_on_map(clinic_map, fg=None, which_map=0, geojson=None):
+    """
+    Draw the catchment outlines. geojson defaults to the saved
+    catchments, or pass in ones from catchments.make_catchment_geojson().
+    geojson can also be a SharedGeoJsonData from
+    make_shared_catchment_data() to use the same data on both halves
+    of a DualMap.
+    """
+    if fg is None:
+        fg = folium.FeatureGroup(name='Nearest IVT hospitals', show=False)
+    if geojson is None:
+        geojson = make_shared_catchment_data('IVT')
+    elif not isinstance(geojson, SharedGeoJsonData):
+        geojson = SharedGeoJsonData(copy_geojson_properties(geojson))
+    # All of the catchments are in one layer.
+    fg.add_child(
+        SharedGeoJson(
+            data=geojson,
+            style_function=lambda y: {
+                    'fillColor': 'rgba(0, 0, 0, 0)',
+                    'color': 'rgba(255, 255, 255, 255)',
+                    'weight': 1.0,
+                },
+            highlight_function=lambda y: {
+                'weight': 2.0,
+                'fillColor': 'rgba(255, 255, 255, 127)'
+                },  # highlight_function / hover_dict
+            )
+    )
+
+    if which_map == 0:
+        fg.add_to(clinic_map)
+    elif which_map == 1:
+        fg.add_to(clinic_map.m1)
+    elif which_map == 2:
+        fg.add_to(clinic_map.m2)
+    return fg, clinic_map
+
+
+def draw_catchment_MT_on_map(clinic_map, fg=None, which_map=0, geojson=None):
+    """
+    Draw the catchment outlines. geojson defaults to the saved
+    catchments, or pass in ones from catchments.make_catchment_geojson().
+    geojson can also be a SharedGeoJsonData from
+    make_shared_catchment_data() to use the same data on both halves
+    of a DualMap.
+    """
+    if fg is None:
+        fg = folium.FeatureGroup(name='Nearest MT hospitals', show=False)
+    if geojson is None:
+        geojson = make_shared_catchment_data('MT')
+    elif not isinstance(geojson, SharedGeoJsonData):
+        geojson = SharedGeoJsonData(copy_geojson_properties(geojson))
+    # All of the catchments are in one layer.
+    fg.add_child(
+        SharedGeoJson(
+            data=geojson,
+            style_function=lambda y: {
+                    'fillColor': 'rgba(0, 0, 0, 0)',
+                    'color': 'rgba(127, 0, 0, 255)',
+                    'weight': 3.0,
+                },
+            highlight_function=lambda y: {
+                'weight': 5.0,
+                'fillColor': 'rgba(127, 0, 0, 127)'
+                },  # highlight_function / hover_dict
+            )
+    )
+
+    if which_map == 0:
+        fg.add_to(clinic_map)
+    elif which_map == 1:
+        fg.add_to(clinic_map.m1)
+    elif which_map == 2:
+        fg.add_to(clinic_map.m2)
+    return fg, clinic_map
+
+
+def make_linear_colourmap(cbar_dict, alpha=0.6):
+    """
+    Make a branca colour bar to match one of the outcome COGs.
+
+    Inputs
+    ------
+    cbar_dict - dict. Contains 'min', 'max', 'cmap' and 'cbar_label'.
+    alpha     - float. Opacity of the background image.
+
+    Returns
+    -------
+    colormap - branca.colormap.LinearColormap.
+    """
+    # Use these points as fixed colours with labels:
+    choro_bins = np.linspace(cbar_dict['min'], cbar_dict['max'], 7)
+    # Get colours as (R, G, B, A) arrays:
+    colours = plt.get_cmap(cbar_dict['cmap'])(
+        np.linspace(0, 1, len(choro_bins)))
+    # Update alpha to match the opacity of the background image:
+    colours[:, 3] = alpha
+    # Convert colours to tuple so that branca understands them:
+    colours = [tuple(colour) for colour in colours]
+
+    colormap = branca.colormap.LinearColormap(
+        vmin=cbar_dict['min'],
+        vmax=cbar_dict['max'],
+        colors=colours,
+        caption=cbar_dict['cbar_label'],
+        index=choro_bins
+    )
+    return colormap
+
+
+def make_hospital_marker_layer(
+        df_hospitals, name='Hospital markers', circles=False,
+        control=False, show=True, shared=False
+        ):
+    """
+    One GeoJson layer of points for all of the stroke units.
+
+    This is much lighter than one folium.Marker per unit because the
+    map only gets one layer object and one block of point data.
+
+    Inputs
+    ------
+    df_hospitals - pd.DataFrame. Contains 'lat', 'long' and
+                   'Stroke Team' columns, and 'Use_MT' and 'Use_IVT'
+                   columns if circles is True.
+    name         - str. Layer name.
+    circles      - bool. If True, draw small circles coloured red for
+                   MT units and white for IVT-only units, and leave out
+                   units with neither. If False, draw the default
+                   marker pins for every unit.
+    control      - bool. Whether the layer appears in layer controls.
+    show         - bool. Whether the layer is shown on load.
+    shared       - bool. Make a SharedGeoJson so that both halves of
+                   a DualMap draw the same block of data. Not for
+                   st_folium, which only copies each layer's own
+                   script into the page.
+
+    Returns
+    -------
+    layer - folium.GeoJson. The marker layer.
+    """
+    lats = df_hospitals['lat'].values
+    longs = df_hospitals['long'].values
+    names = df_hospitals['Stroke Team'].values
+    if circles:
+        colours = np.select(
+            [df_hospitals['Use_MT'].values > 0,
+             df_hospitals['Use_IVT'].values > 0],
+            ['red', 'white'],
+            default=''
+            )
+        mask = colours != ''
+        lats, longs, names, colours = (
+            lats[mask], longs[mask], names[mask], colours[mask])
+    else:
+        colours = np.full(len(lats), '')
+
+    geojson = {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [x, y]},
+                'properties': {'Stroke Team': n, 'colour': c}
+            }
+            for x, y, n, c in zip(
+                longs.tolist(), lats.tolist(), names.tolist(),
+                colours.tolist())
+        ]
+    }
+
+    tooltip = folium.GeoJsonTooltip(fields=['Stroke Team'], labels=False)
+    geojson_class = SharedGeoJson if shared else folium.GeoJson
+    if circles:
+        # folium only writes each different style into the page once,
+        # so the two colours are looked up in the browser.
+        layer = geojson_class(
+            data=geojson,
+            name=name,
+            marker=folium.CircleMarker(
+                radius=2.6,  # pixels
+                color='black',
+                fill=True,
+                fillOpacity=1,
+                weight=1,
+                ),
+            style_function=lambda y: {
+                'fillColor': y['properties']['colour']},
+            tooltip=tooltip,
+            control=control,
+            show=show
+            )
+    else:
+        layer = geojson_class(
+            data=geojson,
+            name=name,
+            tooltip=tooltip,
+            control=control,
+            show=show
+            )
+    return layer
+
+
+def make_area_layer(
+        data, style_function, name=None, tooltip_fields=None,
+        highlight_function=None, smooth_factor=1.5, show=True,
+        control=True
+        ):
+    """
+    folium layer for either geojson or TopoJSON areas.
+
+    The style of each area is worked out from its properties by
+    style_function in the same way for both formats.
+
+    Inputs
+    ------
+    data               - dict. GeoJSON FeatureCollection or TopoJSON
+                         Topology with one object in it. folium adds
+                         styles to the properties, so don't pass
+                         shared cached data.
+    style_function     - function. Takes a feature, returns a style dict.
+    name               - str. Layer name.
+    tooltip_fields     - list or None. Properties to show on hover.
+    highlight_function - function or None. geojson only, because
+                         folium.TopoJson doesn't support it.
+    smooth_factor      - float. Leaflet line simplification.
+    show               - bool. Whether the layer is shown on load.
+    control            - bool. Whether the layer is in layer controls.
+
+    Returns
+    -------
+    layer - folium.GeoJson or folium.TopoJson.
+    """
+    tooltip = None
+    if tooltip_fields is not None:
+        tooltip = folium.GeoJsonTooltip(
+            fields=tooltip_fields,
+            aliases=[''] * len(tooltip_fields),
+            localize=True
+            )
+    if data['type'] == 'Topology':
+        object_name = list(data['objects'].keys())[0]
+        layer = folium.TopoJson(
+            data=data,
+            object_path=f'objects.{object_name}',
+            style_function=style_function,
+            name=name,
+            tooltip=tooltip,
+            smooth_factor=smooth_factor,
+            show=show,
+            control=control
+            )
+    else:
+        layer = folium.GeoJson(
+            data=data,
+            style_function=style_function,
+            name=name,
+            tooltip=tooltip,
+            highlight_function=highlight_function,
+            smooth_factor=smooth_factor,
+            show=show,
+            control=control
+            )
+    return layer
+
+
+def make_map_tiff(df_hospitals, cog_files, layer_names, outcome_cbar_dict,
+                  diff_cbar_dict, alpha=0.6, use_tiles=False):
+    """
+    Build the side-by-side nLVO and LVO outcome map.
+
+    Inputs
+    ------
+    df_hospitals      - pd.DataFrame. Stroke unit coordinates and
+                        which services they provide.
+    cog_files         - list. Paths to the six outcome COGs. The first
+                        three go on the left map and the rest on the
+                        right map. The difference layers can be
+                        RasterExpressions instead of files.
+    layer_names       - list. Layer control name for each COG.
+    outcome_cbar_dict - dict. Colour setup for the scenario COGs.
+    diff_cbar_dict    - dict. Colour setup for the difference COGs.
+    alpha             - float. Opacity of the COG images.
+    use_tiles         - bool. Fetch the COGs from the local tile
+                        server instead of embedding them as images.
+                        Only for the live app, not for saved html.
+
+    Returns
+    -------
+    outcome_map - folium.plugins.DualMap. The finished map.
+    """
+    # Create a map base without tiles:
+    outcome_map = folium.plugins.DualMap(
+        location=[53, -2.5],  # Somewhere in the middle of the map
+        zoom_start=6,
+        # Remove extra controls for stuff we don't need:
+        draw_control=False,
+        scale_control=False,
+        search_control=False,
+        measure_control=False,
+        tiles=None,
+        )
+
+    # Draw the coloured background images.
+    # Set one to be visible on load and the others to appear when
+    # selected.
+    tiff_layers = []
+    for t, c_file in enumerate(cog_files):
+        m = 1 if t < 3 else 2
+        # Set whether this layer will be shown on startup:
+        v = False if t > 0 else True
+        # Every third layer is the difference between the other two:
+        cbar_dict = diff_cbar_dict if t % 3 == 2 else outcome_cbar_dict
+        tiff_layer, outcome_map = draw_cog_on_map(
+            outcome_map,
+            c_file,
+            layer_name=layer_names[t],
+            alpha=alpha,
+            visible=v,
+            which_map=m,
+            use_tiles=use_tiles,
+            cbar_dict=cbar_dict
+            )
+        tiff_layers.append(tiff_layer)
+
+    colourmaps = []
+    for m in [outcome_map.m1, outcome_map.m2]:
+        # Drip and ship colour bar:
+        colourmaps.append(make_linear_colourmap(outcome_cbar_dict, alpha))
+        # Mothership colour bar:
+        colourmaps.append(make_linear_colourmap(outcome_cbar_dict, alpha))
+        # Difference colour bar:
+        colourmaps.append(make_linear_colourmap(diff_cbar_dict, alpha))
+
+    # Bind colourmaps to each tiff image so that only one bar shows
+    # up at once.
+    for i in range(len(tiff_layers)):
+        m = outcome_map.m1 if i < 3 else outcome_map.m2
+        colourmaps[i].add_to(m)
+        BindColormap(tiff_layers[i], colourmaps[i]).add_to(m)
+
+    # Both maps draw the same catchment data, which is only written
+    # into the page once.
+    # Nearest IVT hospitals:
+    ivt_data = make_shared_catchment_data('IVT')
+    ivt_outlines, outcome_map = draw_catchment_IVT_on_map(
+        outcome_map, which_map=1, geojson=ivt_data)
+    ivt_outlines_2, outcome_map = draw_catchment_IVT_on_map(
+        outcome_map, which_map=2, geojson=ivt_data)
+
+    # Nearest MT hospitals:
+    mt_data = make_shared_catchment_data('MT')
+    mt_outlines, outcome_map = draw_catchment_MT_on_map(
+        outcome_map, which_map=1, geojson=mt_data)
+    mt_outlines_2, outcome_map = draw_catchment_MT_on_map(
+        outcome_map, which_map=2, geojson=mt_data)
+
+    # Hospital markers:
+    # Place all markers into one layer so that
+    # in the layer controls they can be shown or removed
+    # with a single click, instead of toggling each marker
+    # individually.
+    fg_markers = make_hospital_marker_layer(
+        df_hospitals, name='Hospital markers', circles=True, shared=True)
+    fg_markers.add_to(outcome_map)
+
+    # Put everything not later specified in this layer control:
+    folium.LayerControl(
+        collapsed=False,
+        name='Background image'
+        ).add_to(outcome_map.m1)
+    folium.LayerControl(
+        collapsed=False,
+        name='Background image'
+        ).add_to(outcome_map.m2)
+
+    # Anything specified in further GroupedLayerControl boxes
+    # will be removed from the previous control and appear in here:
+    folium.plugins.GroupedLayerControl(
+        {'Shapes': [ivt_outlines, mt_outlines]},
+        collapsed=False,
+        exclusive_groups=False,  # True for radio, false for checkbox
+    ).add_to(outcome_map.m1)
+
+    folium.plugins.GroupedLayerControl(
+        {'Shapes': [ivt_outlines_2, mt_outlines_2]},
+        collapsed=False,
+        exclusive_groups=False,  # True for radio, false for checkbox
+    ).add_to(outcome_map.m2)
+
+    # Set z-order of the elements:
+    # (can add multiple things in here but the lag increases)
+    outcome_map.m1.keep_in_front(fg_markers)
+    outcome_map.m2.keep_in_front(fg_markers)
+    return outcome_map
+
+
+def estimate_map_bounds(lat, long, zoom, width=1200, height=600):
+    """
+    Rough bounds of a web map before it has been drawn.
+
+    Inputs
+    ------
+    lat, long     - float. Centre of the map.
+    zoom          - int. Web map zoom level.
+    width, height - int. Size of the map in pixels.
+
+    Returns
+    -------
+    bounds - tuple. (lon_min, lat_min, lon_max, lat_max).
+    """
+    # Degrees of longitude per pixel at this zoom:
+    deg_per_px = 360.0 / (256 * 2 ** zoom)
+    half_lon = 0.5 * width * deg_per_px
+    # Latitude degrees shrink away from the equator in Web Mercator:
+    half_lat = 0.5 * height * deg_per_px * np.cos(np.radians(lat))
+    return (long - half_lon, lat - half_lat, long + half_lon, lat + half_lat)
+
+
+def read_st_folium_view(map_state):
+    """
+    Pull the view out of the values returned by st_folium.
+
+    Inputs
+    ------
+    map_state - dict or None. The st_folium output, including 'bounds',
+                'center' and 'zoom' if they were requested.
+
+    Returns
+    -------
+    bounds - tuple or None. (lon_min, lat_min, lon_max, lat_max).
+    centre - tuple or None. (lat, long).
+    zoom   - int or None.
+    """
+    if not map_state:
+        return None, None, None
+    try:
+        south_west = map_state['bounds']['_southWest']
+        north_east = map_state['bounds']['_northEast']
+        bounds = (south_west['lng'], south_west['lat'],
+                  north_east['lng'], north_east['lat'])
+        centre = (map_state['center']['lat'], map_state['center']['lng'])
+        zoom = int(map_state['zoom'])
+    except (KeyError, TypeError):
+        # The map hasn't reported its view yet.
+        return None, None, None
+    if None in bounds:
+        return None, None, None
+    return bounds, centre, zoom
@@ -0,0 +1,255 @@
+"""
+Columnar store of the LSOA outcomes.
+
+data_maps/df_lsoa.csv has three header rows (property, scenario and
+subtype) and two index columns (LSOA name and code). Parsing all of
+it takes a while, and a map only shows one of its columns. Here it is
+saved once as an uncompressed Arrow file in data_maps/prepared/. The
+file is memory-mapped, so opening it reads nothing, and a column is
+only read from disk when it's used.
+
+The three column levels are kept in the file's metadata, so the
+columns come back with the same MultiIndex as the csv. Summary
+statistics of each column (see column_summary.py) are saved next to
+it so that colour bar limits don't need the columns at all.
+
+The LSOA polygons aren't stored with the outcomes. They stay in the
+shared geometry store, and each outcome row is matched to its row
+there by LSOA code once. Drawing a column is then one gather of the
+geometry array by those row numbers.
+"""
+import streamlit as st
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+import geopandas
+
+from utilities_maps.load_data import dir_prepared
+from utilities_maps.geometry_store import load_geometry_store
+from utilities_maps.column_catalogue import ColumnCatalogue
+from utilities_maps.column_summary import (
+    ColumnSummary, summarise_values, save_column_summary,
+    read_column_summary)
+
+
+path_to_outcomes_csv = os.path.join('data_maps', 'df_lsoa.csv')
+path_to_outcome_store = os.path.join(dir_prepared, 'lsoa_outcomes.arrow')
+path_to_outcome_summary = os.path.join(
+    dir_prepared, 'lsoa_outcomes_summary.json')
+
+
+def build_outcome_store(path_to_csv=path_to_outcomes_csv):
+    """
+    Convert the outcome csv to an Arrow table.
+
+    Inputs
+    ------
+    path_to_csv - str. csv with header=[0, 1, 2] and index_col=[0, 1].
+
+    Returns
+    -------
+    table - pa.Table. One column per index level and per outcome
+            column. The csv's column names are in the metadata.
+    """
+    df = pd.read_csv(path_to_csv, index_col=[0, 1], header=[0, 1, 2])
+
+    arrays = [
+        pa.array(df.index.get_level_values(i).astype(str))
+        for i in range(df.index.nlevels)
+    ]
+    # Keep NaN as a float rather than a missing value so that the
+    # columns can be read without a copy:
+    arrays += [
+        pa.array(df[col].to_numpy(dtype=np.float64), from_pandas=False)
+        for col in df.columns
+    ]
+    index_names = [
+        name if name is not None else f'level_{i}'
+        for i, name in enumerate(df.index.names)
+    ]
+    field_names = index_names + [
+        f'c{i}' for i in range(len(df.columns))]
+    metadata = {
+        'index_names': json.dumps(index_names),
+        'column_names': json.dumps(list(df.columns.names)),
+        'columns': json.dumps([list(col) for col in df.columns]),
+    }
+    return pa.table(arrays, names=field_names, metadata=metadata)
+
+
+def summarise_outcome_store(store):
+    """ColumnSummary of every outcome column, keyed by column name."""
+    return ColumnSummary({
+        col: summarise_values(store.column(i))
+        for i, col in enumerate(store.columns)
+    })
+
+
+def save_outcome_store(path_to_csv=path_to_outcomes_csv):
+    """
+    Build the outcome store and its column summary and save them to
+    data_maps/prepared/.
+    """
+    table = build_outcome_store(path_to_csv)
+    os.makedirs(dir_prepared, exist_ok=True)
+    # No compression so that the file can be memory-mapped:
+    with pa.OSFile(path_to_outcome_store, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    save_column_summary(
+        summarise_outcome_store(OutcomeStore(table)), path_to_outcome_summary)
+    return table
+
+
+class OutcomeStore:
+    """
+    Memory-mapped LSOA outcomes.
+
+    Attributes
+    ----------
+    index     - pd.MultiIndex. LSOA name and code of each row.
+    columns   - pd.MultiIndex. (property, scenario, subtype) of each
+                outcome column, as in the csv.
+    catalogue - ColumnCatalogue. For finding columns by level values.
+    """
+    def __init__(self, table):
+        self._table = table
+        metadata = {
+            k.decode(): json.loads(v) for k, v in table.schema.metadata.items()}
+        self._index_names = metadata['index_names']
+        self.index = pd.MultiIndex.from_arrays(
+            [table.column(name).to_numpy() for name in self._index_names],
+            names=self._index_names
+            )
+        self.columns = pd.MultiIndex.from_tuples(
+            [tuple(col) for col in metadata['columns']],
+            names=metadata['column_names']
+            )
+        self.catalogue = ColumnCatalogue(self.columns)
+
+    def column(self, col):
+        """
+        Values of one outcome column.
+
+        Inputs
+        ------
+        col - tuple or int. Column name from self.columns, or its
+              position.
+
+        Returns
+        -------
+        values - np.array. float64, read-only because it is a view of
+                 the file.
+        """
+        if not isinstance(col, (int, np.integer)):
+            col = self.columns.get_loc(col)
+        return self._table.column(f'c{col}').to_numpy()
+
+    def to_frame(self, columns=None):
+        """
+        DataFrame of some outcome columns in the same form as the csv.
+
+        Inputs
+        ------
+        columns - list, tuple or None. Column names from
+                  self.columns, one column name, or None for every
+                  column.
+
+        Returns
+        -------
+        df - pd.DataFrame. Only the requested columns are read.
+        """
+        if columns is None:
+            columns = self.columns
+        elif isinstance(columns, tuple):
+            columns = [columns]
+        positions = [self.columns.get_loc(col) for col in columns]
+        return pd.DataFrame(
+            {i: self.column(p) for i, p in enumerate(positions)},
+            index=self.index
+            ).set_axis(self.columns[positions], axis='columns')
+
+
+@st.cache_resource
+def load_outcome_store():
+    """
+    Shared outcome store. Build it first if it doesn't exist.
+
+    The arrays are views of the memory-mapped file, so don't change
+    them in place.
+    """
+    if not os.path.exists(path_to_outcome_store):
+        save_outcome_store()
+    source = pa.memory_map(path_to_outcome_store, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    return OutcomeStore(table)
+
+
+@st.cache_resource
+def load_outcome_summary():
+    """
+    Summary statistics of each outcome column.
+
+    Returns
+    -------
+    summary - ColumnSummary. Keyed by the column names in the outcome
+              store's columns.
+    """
+    if not os.path.exists(path_to_outcome_summary):
+        save_column_summary(
+            summarise_outcome_store(load_outcome_store()),
+            path_to_outcome_summary
+            )
+    return read_column_summary(path_to_outcome_summary)
+
+
+@st.cache_resource
+def load_outcome_geometry_rows():
+    """
+    Row in the geometry store of each row of the outcome store.
+
+    Returns
+    -------
+    rows - np.array. Integer row positions, -1 for an LSOA that isn't
+           in the geometry store.
+    """
+    outcomes = load_outcome_store()
+    store = load_geometry_store()
+    codes = outcomes.index.get_level_values(1)
+    return store.code_rows(codes)
+
+
+def select_outcome_gdf(col, crs='EPSG:4326'):
+    """
+    GeoDataFrame of one outcome column and the LSOA polygons.
+
+    The polygons are picked out of the shared geometry store by row
+    number, so nothing is merged and the polygons aren't copied.
+
+    Inputs
+    ------
+    col - tuple. Column name from the outcome store's columns.
+    crs - str. Coordinate system of the polygons. Either of the ones
+          kept in the geometry store, so nothing is reprojected.
+
+    Returns
+    -------
+    gdf - GeoDataFrame. Columns 'lsoa', 'outcome' and 'geometry', one
+          row per LSOA that has both an outcome row and a polygon.
+    """
+    outcomes = load_outcome_store()
+    store = load_geometry_store()
+    rows = load_outcome_geometry_rows()
+    mask = rows >= 0
+    geometry = store.geometry(crs)
+    return geopandas.GeoDataFrame(
+        {
+            'lsoa': outcomes.index.get_level_values(0)[mask],
+            'outcome': outcomes.column(col)[mask],
+        },
+        geometry=geometry.values[rows[mask]],
+        crs=geometry.crs
+        )
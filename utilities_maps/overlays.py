@@ -0,0 +1,330 @@
+"""
+Cached PNG images of the COGs for folium's ImageOverlay.
+
+Turning a COG into an ImageOverlay means stretching it to the
+Web-Mercator projection, packing it into a PNG and writing that as
+base64 text. The result only depends on the contents of the COG and
+the settings used, so it's saved in memory and in
+data_maps/prepared/overlays/ under a hash of those. Later renders of
+the same map reuse the saved text.
+
+COGs of values (value_rasters.py) and rasters worked out from other
+COGs (raster_algebra.RasterExpression) are coloured with their colour
+bar and saved in the same way, with the colour bar in the key. An
+expression is keyed by its text and the hashes of the COGs it uses.
+
+The opacity of the layer isn't part of the image, because Leaflet
+applies it in the browser, so it doesn't need to be in the key.
+"""
+import streamlit as st
+import os
+import base64
+import hashlib
+import struct
+import zlib
+import numpy as np
+from folium.utilities import mercator_transform
+# For colouring single-band rasters:
+import matplotlib.pyplot as plt
+
+from utilities_maps.load_data import dir_prepared, read_json, write_json
+from utilities_maps.rasters import read_cog
+from utilities_maps.raster_algebra import apply_colour_lut, cbar_key_of
+
+
+dir_overlays = os.path.join(dir_prepared, 'overlays')
+
+# zlib level from 0 (no compression, quickest) to 9 (smallest).
+default_png_compression = 6
+
+
+@st.cache_resource
+def _file_hash(file_name, mtime, size):
+    with open(file_name, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def file_hash(file_name):
+    """SHA-256 of a file's contents. Recalculated if the file changes."""
+    stat = os.stat(file_name)
+    return _file_hash(file_name, stat.st_mtime, stat.st_size)
+
+
+def write_png(arr, compression_level=default_png_compression):
+    """
+    Pack an RGBA uint8 array of shape (rows, cols, 4) into PNG bytes.
+
+    This is the same as folium.utilities.write_png except that the
+    compression level can be changed.
+    """
+    height, width, nblayers = arr.shape
+    raw_data = b''.join(
+        [b'\x00' + arr[i, :, :].tobytes() for i in range(height)])
+
+    def png_pack(png_tag, data):
+        chunk_head = png_tag + data
+        return (
+            struct.pack('!I', len(data))
+            + chunk_head
+            + struct.pack('!I', 0xFFFFFFFF & zlib.crc32(chunk_head))
+        )
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        png_pack(b'IHDR', struct.pack('!2I5B', width, height, 8, 6, 0, 0, 0)),
+        png_pack(b'IDAT', zlib.compress(raw_data, compression_level)),
+        png_pack(b'IEND', b''),
+    ])
+
+
+def to_rgba_uint8(arr, cmap=None):
+    """
+    Convert the pixels to 8-bit RGBA in the same way as folium.
+
+    Inputs
+    ------
+    arr  - np.array. Shape (rows, cols, bands) with 1, 3 or 4 bands.
+    cmap - str or None. matplotlib colour map name for single-band
+           rasters, which should then hold values from 0 to 1.
+
+    Returns
+    -------
+    arr - np.array. uint8 with shape (rows, cols, 4).
+    """
+    if arr.shape[2] == 1:
+        arr = plt.get_cmap(cmap)(arr[:, :, 0])
+    if arr.shape[2] == 3:
+        arr = np.concatenate((arr, np.ones(arr.shape[:2] + (1,))), axis=2)
+    if arr.dtype != 'uint8':
+        # Each channel is scaled so its largest value is 255:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arr = arr * 255.0 / arr.max(axis=(0, 1)).reshape((1, 1, 4))
+            arr[~np.isfinite(arr)] = 0
+        arr = arr.astype('uint8')
+    return arr
+
+
+def encode_overlay(arr, bounds, cmap=None,
+                   compression_level=default_png_compression):
+    """
+    Image URL for an ImageOverlay from the pixels of a COG.
+
+    Inputs
+    ------
+    arr               - np.array. Shape (rows, cols, bands) in
+                        lat/long pixels.
+    bounds            - tuple. (lon_min, lat_min, lon_max, lat_max).
+    cmap              - str or None. See to_rgba_uint8().
+    compression_level - int. zlib level for the PNG.
+
+    Returns
+    -------
+    url - str. base64 PNG data URL, already in Web-Mercator, so give
+          it to ImageOverlay with mercator_project=False.
+    """
+    arr = to_rgba_uint8(arr, cmap)
+    arr = mercator_transform(arr, (bounds[1], bounds[3]), origin='upper')
+    # The stretch gives floats again:
+    arr = np.clip(np.round(arr), 0, 255).astype('uint8')
+    png = write_png(arr, compression_level)
+    return 'data:image/png;base64,' + base64.b64encode(png).decode('utf-8')
+
+
+def add_reference_pixels(arr):
+    """
+    Set some pixels of an RGBA image to red, green, blue, black, white.
+
+    to_rgba_uint8() scales each channel so its largest value is 255,
+    which gives the wrong colours when a channel never reaches 1.
+    Images that are already uint8 aren't scaled so are left alone.
+    These pixels are on the top row of the image. For the whole raster
+    they live in the Inner Hebrides and currently our data does not
+    cover Scotland, so nobody should notice these random pixels.
+    """
+    if arr.shape[2] == 4 and arr.dtype != 'uint8':
+        arr[0][1] = [1.0, 0.0, 0.0, 1]
+        arr[0][2] = [0.0, 1.0, 0.0, 1]
+        arr[0][3] = [0.0, 0.0, 1.0, 1]
+        arr[0][4] = [0.0, 0.0, 0.0, 1]
+        arr[0][5] = [1.0, 1.0, 1.0, 1]
+    return arr
+
+
+def _prepare_overlay(key_parts, read_image, cmap, compression_level):
+    """
+    Encoded overlay from file if it has been made before.
+
+    key_parts is anything that changes the image, and read_image()
+    gives the image and its bounds if it has to be made.
+    """
+    key = hashlib.sha256(repr(key_parts).encode()).hexdigest()
+    path_to_overlay = os.path.join(dir_overlays, f'{key}.json')
+
+    if os.path.exists(path_to_overlay):
+        overlay = read_json(path_to_overlay)
+        return overlay['url'], tuple(overlay['bounds'])
+
+    arr, image_bounds = read_image()
+    arr = add_reference_pixels(arr)
+    url = encode_overlay(arr, image_bounds, cmap, compression_level)
+
+    os.makedirs(dir_overlays, exist_ok=True)
+    # Replaced in one step, so a session that finds the file can
+    # always read all of it:
+    write_json({'url': url, 'bounds': list(image_bounds)}, path_to_overlay)
+    return url, image_bounds
+
+
+def prepare_cog_overlay(file_name, bounds=None, out_width=1200,
+                        out_height=1200, cmap=None,
+                        compression_level=default_png_compression):
+    """
+    Encoded overlay of a COG, from file if it has been made before.
+
+    Inputs
+    ------
+    file_name             - str. Path to the COG.
+    bounds                - tuple or None. Area to read, as in
+                            utilities_maps.rasters.read_cog().
+    out_width, out_height - int. Map size in screen pixels.
+    cmap                  - str or None. For single-band COGs.
+    compression_level     - int. zlib level for the PNG.
+
+    Returns
+    -------
+    url    - str. base64 PNG data URL in Web-Mercator.
+    bounds - tuple. (lon_min, lat_min, lon_max, lat_max) of the image
+             from the raster's georeferencing.
+    """
+    return _prepare_overlay(
+        (file_hash(file_name), bounds, out_width, out_height, cmap,
+         compression_level),
+        lambda: read_cog(file_name, bounds, out_width, out_height),
+        cmap, compression_level
+        )
+
+
+@st.cache_resource(max_entries=32)
+def _import_cog_overlay(file_hash, file_name, bounds, out_width, out_height,
+                        cmap, compression_level):
+    return prepare_cog_overlay(
+        file_name, bounds, out_width, out_height, cmap, compression_level)
+
+
+def import_cog_overlay(file_name, bounds=None, out_width=1200,
+                       out_height=1200, cmap=None,
+                       compression_level=default_png_compression):
+    """
+    Shared, cached encoded overlay of a COG.
+
+    See prepare_cog_overlay() for the inputs and outputs.
+    """
+    # The file hash is in the memory cache key too so that a
+    # changed COG isn't served from memory.
+    return _import_cog_overlay(
+        file_hash(file_name), file_name, bounds, out_width, out_height,
+        cmap, compression_level)
+
+
+def prepare_value_overlay(file_name, cbar_dict, bounds=None, out_width=1200,
+                          out_height=1200,
+                          compression_level=default_png_compression):
+    """
+    Encoded overlay of a single-band COG of values, from file if it
+    has been made before.
+
+    Inputs
+    ------
+    file_name - str. Path to the COG of values.
+    cbar_dict - dict. Colour bar with 'min', 'max' and 'cmap'.
+    See prepare_cog_overlay() for the other inputs and the outputs.
+    """
+    def read_image():
+        values, image_bounds = read_cog(
+            file_name, bounds, out_width, out_height)
+        return apply_colour_lut(values, cbar_dict), image_bounds
+
+    return _prepare_overlay(
+        (file_hash(file_name), cbar_key_of(cbar_dict), bounds, out_width,
+         out_height, compression_level),
+        read_image, None, compression_level
+        )
+
+
+@st.cache_resource(max_entries=32)
+def _import_value_overlay(file_hash, file_name, cbar_key, bounds, out_width,
+                          out_height, compression_level):
+    vmin, vmax, cmap = cbar_key
+    return prepare_value_overlay(
+        file_name, dict(min=vmin, max=vmax, cmap=cmap), bounds, out_width,
+        out_height, compression_level)
+
+
+def import_value_overlay(file_name, cbar_dict, bounds=None, out_width=1200,
+                         out_height=1200,
+                         compression_level=default_png_compression):
+    """
+    Shared, cached encoded overlay of a COG of values.
+
+    See prepare_value_overlay() for the inputs and outputs.
+    """
+    return _import_value_overlay(
+        file_hash(file_name), file_name, cbar_key_of(cbar_dict), bounds,
+        out_width, out_height, compression_level)
+
+
+def expression_key(raster):
+    """Everything about a RasterExpression that changes its values."""
+    return (raster.expression, tuple(
+        (name, file_hash(file_name), cbar_key_of(cbar))
+        for name, (file_name, cbar) in raster.sources.items()
+    ))
+
+
+def prepare_expression_overlay(raster, cbar_dict, bounds=None,
+                               out_width=1200, out_height=1200,
+                               compression_level=default_png_compression):
+    """
+    Encoded overlay of a raster expression, from file if it has been
+    made before.
+
+    Inputs
+    ------
+    raster    - utilities_maps.raster_algebra.RasterExpression.
+    cbar_dict - dict. Colour bar for the result, with 'min', 'max'
+                and 'cmap'.
+    See prepare_cog_overlay() for the other inputs and the outputs.
+    """
+    def read_image():
+        values, image_bounds = raster.read(bounds, out_width, out_height)
+        return apply_colour_lut(values, cbar_dict), image_bounds
+
+    return _prepare_overlay(
+        (expression_key(raster), cbar_key_of(cbar_dict), bounds, out_width,
+         out_height, compression_level),
+        read_image, None, compression_level
+        )
+
+
+@st.cache_resource(max_entries=32)
+def _import_expression_overlay(key, _raster, cbar_key, bounds, out_width,
+                               out_height, compression_level):
+    vmin, vmax, cmap = cbar_key
+    return prepare_expression_overlay(
+        _raster, dict(min=vmin, max=vmax, cmap=cmap), bounds, out_width,
+        out_height, compression_level)
+
+
+def import_expression_overlay(raster, cbar_dict, bounds=None,
+                              out_width=1200, out_height=1200,
+                              compression_level=default_png_compression):
+    """
+    Shared, cached encoded overlay of a raster expression.
+
+    See prepare_expression_overlay() for the inputs and outputs.
+    """
+    # The raster itself can't be hashed, so it's found in the memory
+    # cache by its expression and the hashes of its COGs:
+    return _import_expression_overlay(
+        expression_key(raster), raster, cbar_key_of(cbar_dict), bounds,
+        out_width, out_height, compression_level)
@@ -0,0 +1,260 @@
+"""
+Rasters worked out from other rasters, e.g. the advantage of one
+scenario over another.
+
+An expression such as 'mothership - dripship' names some COGs that
+cover the same grid. It is only worked out for the blocks that cover
+the requested view, at the same overview level that would be read
+from a single COG, and the resulting blocks are cached. So a new
+difference map doesn't need its own file.
+
+The rasters can be single-band COGs of values (see value_rasters.py)
+or the coloured outcome COGs. Each colour in those is one of the 256
+colours of the matplotlib colour map that made it, so the value is
+found again by looking the colour up in that colour map and scaling
+it to the colour bar range. That is accurate to 1/255 of the range.
+
+Values are coloured for drawing with apply_colour_lut().
+"""
+import streamlit as st
+import ast
+import numpy as np
+import matplotlib.pyplot as plt
+
+from utilities_maps.rasters import open_cog, read_cog_block
+
+
+# Operations allowed in an expression:
+_allowed_nodes = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Name, ast.Load,
+    ast.Constant, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd,
+)
+
+
+@st.cache_resource
+def compile_expression(expression):
+    """
+    Check and compile a raster expression.
+
+    Inputs
+    ------
+    expression - str. Arithmetic (+, -, *, /) of raster names and
+                 numbers, e.g. 'mothership - dripship'.
+
+    Returns
+    -------
+    code  - code object for eval().
+    names - list. Raster names used in the expression.
+    """
+    tree = ast.parse(expression, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _allowed_nodes):
+            raise ValueError(
+                f'{type(node).__name__} is not allowed in {expression!r}.')
+        if isinstance(node, ast.Constant) and not isinstance(
+                node.value, (int, float)):
+            raise ValueError(f'{node.value!r} is not allowed in {expression!r}.')
+    names = sorted({
+        node.id for node in ast.walk(tree) if isinstance(node, ast.Name)})
+    return compile(tree, '<raster expression>', 'eval'), names
+
+
+@st.cache_resource
+def colour_lookup(cmap):
+    """
+    Sorted colour keys of a colour map and their positions in it.
+
+    Each RGB colour is packed into one integer from its 8-bit
+    channels so that whole images can be looked up at once.
+    """
+    colours = plt.get_cmap(cmap)(np.linspace(0, 1, 256))[:, :3]
+    keys = _colour_keys(colours)
+    order = np.argsort(keys, kind='stable')
+    return keys[order], order
+
+
+def _colour_keys(rgb):
+    rgb = np.round(np.asarray(rgb) * 255).astype(np.int64)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+def colours_to_values(block, cbar_dict):
+    """
+    Values of a block of a coloured COG.
+
+    Inputs
+    ------
+    block     - np.array. RGBA floats from 0 to 1 with shape
+                (4, rows, cols), as read from the COG.
+    cbar_dict - dict. The colour bar that coloured the COG, with
+                'min', 'max' and 'cmap'.
+
+    Returns
+    -------
+    values - np.array. float32 with shape (rows, cols). NaN where the
+             pixel is see-through or isn't a colour of the colour map.
+    """
+    keys, order = colour_lookup(cbar_dict['cmap'])
+    pixel_keys = _colour_keys(np.moveaxis(block[:3], 0, -1))
+    i = np.clip(np.searchsorted(keys, pixel_keys), 0, len(keys) - 1)
+    found = (keys[i] == pixel_keys) & (block[3] > 0)
+    step = (cbar_dict['max'] - cbar_dict['min']) / 255
+    values = cbar_dict['min'] + order[i] * step
+    return np.where(found, values, np.nan).astype(np.float32)
+
+
+@st.cache_resource
+def colour_lut(cmap):
+    """256 RGBA uint8 colours of a matplotlib colour map."""
+    # Rounded rather than cut off, to match the colours in the COGs:
+    colours = plt.get_cmap(cmap)(np.linspace(0, 1, 256))
+    return np.round(colours * 255).astype(np.uint8)
+
+
+def apply_colour_lut(values, cbar_dict):
+    """
+    Colour some values for drawing.
+
+    Inputs
+    ------
+    values    - np.array. Shape (rows, cols) or (rows, cols, 1).
+                NaN for no data.
+    cbar_dict - dict. Colour bar with 'min', 'max' and 'cmap'. Values
+                outside the range get the end colours.
+
+    Returns
+    -------
+    array - np.array. RGBA uint8 with shape (rows, cols, 4).
+            See-through where there's no data.
+    """
+    if values.ndim == 3:
+        values = values[:, :, 0]
+    scale = 255 / (cbar_dict['max'] - cbar_dict['min'])
+    with np.errstate(invalid='ignore'):
+        index = np.clip(
+            np.rint((values - cbar_dict['min']) * scale), 0, 255)
+    # NaN becomes an extra see-through colour at the end:
+    index = np.where(np.isnan(values), 256, index).astype(np.intp)
+    lut = np.concatenate(
+        (colour_lut(cbar_dict['cmap']), np.zeros((1, 4), dtype=np.uint8)))
+    return lut[index]
+
+
+def cbar_key_of(cbar_dict):
+    """(min, max, cmap) of a colour bar, the parts that change colours."""
+    if cbar_dict is None:
+        return None
+    return (cbar_dict['min'], cbar_dict['max'], cbar_dict['cmap'])
+
+
+@st.cache_resource(max_entries=64)
+def read_value_block(file_name, level, block_row, block_col, cbar_key=None):
+    """
+    Cached values of one block of a COG.
+
+    cbar_key is (min, max, cmap) of the colour bar of a coloured COG,
+    or None for a single-band COG of values.
+    Don't change the returned array in place.
+    """
+    block = read_cog_block(file_name, level, block_row, block_col)
+    if cbar_key is None:
+        return block[0]
+    vmin, vmax, cmap = cbar_key
+    return colours_to_values(block, dict(min=vmin, max=vmax, cmap=cmap))
+
+
+@st.cache_resource(max_entries=64)
+def evaluate_block(expression, sources, level, block_row, block_col):
+    """
+    Cached result of an expression for one block.
+
+    Inputs
+    ------
+    expression - str. See compile_expression().
+    sources    - tuple. (name, file_name, cbar_key) for each raster.
+    level, block_row, block_col - int. Which block to work out.
+
+    Returns
+    -------
+    block - np.array. float32 with shape (1, rows, cols). Don't change
+            it in place.
+    """
+    code, names = compile_expression(expression)
+    variables = {
+        name: read_value_block(file_name, level, block_row, block_col,
+                               cbar_key)
+        for name, file_name, cbar_key in sources
+        if name in names
+    }
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = eval(code, {'__builtins__': {}}, variables)
+    return np.asarray(result, dtype=np.float32)[np.newaxis]
+
+
+class RasterExpression:
+    """
+    A raster worked out from other COGs that cover the same grid.
+
+    Attributes
+    ----------
+    expression - str. e.g. 'mothership - dripship'.
+    sources    - dict. Raster name to (file_name, cbar_dict), where
+                 cbar_dict is the colour bar a coloured COG was
+                 coloured with, or None for a COG of values. Pass
+                 just the file name for a COG of values.
+    """
+    def __init__(self, expression, sources):
+        code, names = compile_expression(expression)
+        missing = [name for name in names if name not in sources]
+        if len(missing) > 0:
+            raise ValueError(f'No raster for {missing} in {expression!r}.')
+        self.expression = expression
+        self.sources = {
+            name: ((sources[name], None) if isinstance(sources[name], str)
+                   else tuple(sources[name]))
+            for name in names
+        }
+        self._readers = [open_cog(f) for f, cbar in self.sources.values()]
+        # Blocks can only be combined if they are the same pixels:
+        reader = self._readers[0]
+        for other in self._readers[1:]:
+            if ((other.bounds, other.width, other.height, other.factors)
+                    != (reader.bounds, reader.width, reader.height,
+                        reader.factors)):
+                raise ValueError(
+                    f'{other.file_name} is not on the same grid as '
+                    f'{reader.file_name}.')
+
+    @property
+    def file_names(self):
+        return [file_name for file_name, cbar in self.sources.values()]
+
+    def _source_key(self):
+        return tuple(
+            (name, file_name, cbar_key_of(cbar))
+            for name, (file_name, cbar) in self.sources.items()
+        )
+
+    def read(self, bounds=None, out_width=1200, out_height=1200):
+        """
+        Values of the expression covering a box at about the display
+        resolution.
+
+        See utilities_maps.rasters.CogReader.read() for the inputs.
+
+        Returns
+        -------
+        array  - np.array. float32 with shape (rows, cols, 1). NaN for
+                 no data.
+        bounds - tuple. (lon_min, lat_min, lon_max, lat_max) of the
+                 pixels that were worked out.
+        """
+        reader = self._readers[0]
+        level, window = reader.plan_read(bounds, out_width, out_height)
+        source_key = self._source_key()
+        array = reader.mosaic(
+            level, window,
+            lambda *block: evaluate_block(self.expression, source_key, *block),
+            1, np.float32
+            )
+        return array, reader.window_bounds(level, window)
@@ -0,0 +1,227 @@
+"""
+Reading parts of the cloud-optimised geotiffs (COGs).
+
+The COGs are stored in 512x512 pixel blocks with smaller copies
+("overviews") at 1/2 and 1/4 of the full resolution. Instead of
+reading the whole file, pick the smallest copy that still has enough
+pixels for the map and only read the blocks that cover the view.
+
+Each file is opened once and shared. Decoded blocks are kept in a
+cache of limited size so panning around or switching between layers
+doesn't decode the same blocks again.
+"""
+import streamlit as st
+import threading
+import numpy as np
+import rasterio
+import rasterio.windows
+
+
+class CogReader:
+    """
+    One open COG and its overviews.
+
+    Attributes
+    ----------
+    file_name - str. Path to the COG.
+    bounds    - tuple. (lon_min, lat_min, lon_max, lat_max) of the
+                whole raster.
+    width     - int. Full resolution width in pixels.
+    height    - int. Full resolution height in pixels.
+    count     - int. Number of bands.
+    factors   - list. Reduction factor of each level. Level 0 is the
+                full resolution and the rest are the overviews.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        ds = rasterio.open(file_name)
+        self.bounds = tuple(ds.bounds)
+        self.width = ds.width
+        self.height = ds.height
+        self.count = ds.count
+        self.factors = [1] + ds.overviews(1)
+        # Level 0 is the full file, level i is overview i - 1:
+        self._datasets = [ds] + [
+            rasterio.open(file_name, overview_level=i)
+            for i in range(len(self.factors) - 1)
+        ]
+        # GDAL datasets can't be read from two threads at once,
+        # and each browser session runs in its own thread.
+        self._lock = threading.Lock()
+
+    def level_for_size(self, window_width, window_height,
+                       out_width, out_height):
+        """
+        Smallest level that still has a pixel for each screen pixel.
+
+        Inputs
+        ------
+        window_width, window_height - float. Size of the area to show
+                                      in full resolution pixels.
+        out_width, out_height       - int. Size it is shown at in
+                                      screen pixels.
+
+        Returns
+        -------
+        level - int. Index into self.factors.
+        """
+        max_factor = min(window_width / out_width,
+                         window_height / out_height)
+        level = 0
+        for i, factor in enumerate(self.factors):
+            if factor <= max_factor:
+                level = i
+        return level
+
+    def block_shape(self, level):
+        return self._datasets[level].block_shapes[0]
+
+    def read_block(self, level, block_row, block_col):
+        """Decode one block as an array of shape (bands, rows, cols)."""
+        ds = self._datasets[level]
+        rows, cols = ds.block_shapes[0]
+        window = rasterio.windows.Window(
+            block_col * cols, block_row * rows, cols, rows
+            ).intersection(rasterio.windows.Window(0, 0, ds.width, ds.height))
+        with self._lock:
+            return ds.read(window=window)
+
+    def plan_read(self, bounds=None, out_width=1200, out_height=1200):
+        """
+        Level and window to read for a box at about the display
+        resolution.
+
+        Inputs
+        ------
+        bounds     - tuple or None. (lon_min, lat_min, lon_max,
+                     lat_max) to read. None for the whole raster.
+        out_width  - int. Width of the map in screen pixels.
+        out_height - int. Height of the map in screen pixels.
+
+        Returns
+        -------
+        level  - int. Index into self.factors.
+        window - rasterio.windows.Window. Whole pixels of that level
+                 that cover the box.
+        """
+        if bounds is None:
+            bounds = self.bounds
+        # Don't read outside the raster:
+        bounds = (
+            max(bounds[0], self.bounds[0]), max(bounds[1], self.bounds[1]),
+            min(bounds[2], self.bounds[2]), min(bounds[3], self.bounds[3])
+        )
+        if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+            raise ValueError(f'{bounds} is outside {self.file_name}.')
+
+        full_window = rasterio.windows.from_bounds(
+            *bounds, transform=self._datasets[0].transform)
+        level = self.level_for_size(
+            full_window.width, full_window.height, out_width, out_height)
+
+        ds = self._datasets[level]
+        window = rasterio.windows.from_bounds(*bounds, transform=ds.transform)
+        window = window.round_offsets(op='floor').round_lengths(op='ceil')
+        window = window.intersection(
+            rasterio.windows.Window(0, 0, ds.width, ds.height))
+        return level, window
+
+    def window_bounds(self, level, window):
+        """(lon_min, lat_min, lon_max, lat_max) of a window."""
+        return tuple(rasterio.windows.bounds(
+            window, self._datasets[level].transform))
+
+    def mosaic(self, level, window, read_block, bands, dtype):
+        """
+        Copy the parts of each block that are in a window.
+
+        Inputs
+        ------
+        level      - int. Index into self.factors.
+        window     - rasterio.windows.Window. From plan_read().
+        read_block - function. Takes (level, block_row, block_col) and
+                     returns an array of shape (bands, rows, cols).
+        bands      - int. Number of bands that read_block() gives.
+        dtype      - str or np.dtype. Type of the output array.
+
+        Returns
+        -------
+        array - np.array. Shape (rows, cols, bands).
+        """
+        row_start, col_start = window.row_off, window.col_off
+        row_stop = row_start + window.height
+        col_stop = col_start + window.width
+
+        block_rows, block_cols = self.block_shape(level)
+        array = np.empty((window.height, window.width, bands), dtype=dtype)
+        for block_row in range(row_start // block_rows,
+                               (row_stop - 1) // block_rows + 1):
+            for block_col in range(col_start // block_cols,
+                                   (col_stop - 1) // block_cols + 1):
+                block = read_block(level, block_row, block_col)
+                r0 = block_row * block_rows
+                c0 = block_col * block_cols
+                r_from, r_to = max(row_start, r0), min(row_stop, r0 + block.shape[1])
+                c_from, c_to = max(col_start, c0), min(col_stop, c0 + block.shape[2])
+                # Blocks are (bands, rows, cols) and the image is
+                # (rows, cols, bands):
+                array[r_from - row_start:r_to - row_start,
+                      c_from - col_start:c_to - col_start] = np.transpose(
+                    block[:, r_from - r0:r_to - r0, c_from - c0:c_to - c0],
+                    axes=(1, 2, 0))
+        return array
+
+    def read(self, bounds=None, out_width=1200, out_height=1200):
+        """
+        Pixels covering a box at about the display resolution.
+
+        Inputs
+        ------
+        bounds     - tuple or None. (lon_min, lat_min, lon_max,
+                     lat_max) to read. None for the whole raster.
+        out_width  - int. Width of the map in screen pixels.
+        out_height - int. Height of the map in screen pixels.
+
+        Returns
+        -------
+        array  - np.array. Shape (rows, cols, bands), ready for
+                 folium's ImageOverlay. A new array, so it can be
+                 changed.
+        bounds - tuple. (lon_min, lat_min, lon_max, lat_max) of the
+                 pixels that were read. This is a bit bigger than the
+                 requested box because whole pixels are read.
+        """
+        level, window = self.plan_read(bounds, out_width, out_height)
+        array = self.mosaic(
+            level, window,
+            lambda *block: read_cog_block(self.file_name, *block),
+            self.count, self._datasets[level].dtypes[0]
+            )
+        return array, self.window_bounds(level, window)
+
+
+@st.cache_resource
+def open_cog(file_name):
+    """Shared reader for one COG. Opened once for every session."""
+    return CogReader(file_name)
+
+
+@st.cache_resource(max_entries=64)
+def read_cog_block(file_name, level, block_row, block_col):
+    """
+    Cached decoded block of a COG.
+
+    The least recently used blocks are dropped when the cache is
+    full. At full resolution a 512x512 block of four float32 bands
+    is 4MB. Don't change the returned array in place.
+    """
+    return open_cog(file_name).read_block(level, block_row, block_col)
+
+
+def read_cog(file_name, bounds=None, out_width=1200, out_height=1200):
+    """
+    Pixels of a COG covering a box at about the display resolution.
+
+    See CogReader.read() for the inputs and outputs.
+    """
+    return open_cog(file_name).read(bounds, out_width, out_height)
@@ -0,0 +1,205 @@
+"""
+Outlines of the regions that the LSOA are grouped into.
+
+Region boundary files such as SICBL.geojson and LHB.geojson each
+name their columns differently (SICBL22NM, LHB20NM, ...), so loading
+one meant guessing which columns hold the region names and codes.
+They also don't come from the same LSOA polygons, so their borders
+don't line up with the LSOA on the maps.
+
+Here the outlines are made from the LSOA in the geometry store
+instead. Each region level in outline_levels (health boards, STPs
+and stroke networks) is merged along the shared LSOA borders
+(topology.py) and saved in one file with the same columns for every
+level: 'level', 'region', 'region_code' and the polygons in both of
+the store's coordinate systems. The file is named after a hash of
+the geometry store's modified time and size, so a rebuilt store gets
+new outlines.
+
+ICBs and SICBLs are only in the geometry store when it was built
+with an LSOA lookup (see geometry_store.build_geometry_store()), so
+they aren't outlined by default. Asking for a level without any
+regions raises a KeyError.
+
+Region codes come from csv files with matching name and code columns
+in the style of data_maps/hospitals_and_lsoas.csv, e.g. LHB20NM and
+LHB20CD. A region without a known code uses its name as its code.
+"""
+import streamlit as st
+import os
+import hashlib
+import pandas as pd
+import geopandas
+
+from utilities_maps.load_data import dir_prepared
+from utilities_maps.geometry_store import (
+    path_to_store, load_geometry_store, region_levels, geometry_cols)
+from utilities_maps.topology import load_store_dissolver
+
+
+dir_region_outlines = os.path.join(dir_prepared, 'region_outlines')
+
+# Levels to make outlines for. These have regions in the geometry
+# store without a lookup file:
+outline_levels = ['lhb', 'stp', 'scn']
+
+# Files with region names and codes, and the columns in them for
+# each level as (name column, code column):
+region_code_files = [os.path.join('data_maps', 'hospitals_and_lsoas.csv')]
+region_code_cols = {
+    'stp': ('STP19NM', 'STP19CD'),
+    'scn': ('SCN17NM', 'SCN17CD'),
+    'lhb': ('LHB20NM', 'LHB20CD'),
+    'icb': ('ICB22NM', 'ICB22CD'),
+    'sicbl': ('SICBL22NM', 'SICBL22CD'),
+    'lad': ('LAD17NM', 'LAD17CD'),
+}
+
+
+def store_fingerprint():
+    """Modified time and size of the geometry store."""
+    return (os.stat(path_to_store).st_mtime, os.stat(path_to_store).st_size)
+
+
+def path_to_region_outlines(fingerprint, levels=outline_levels):
+    """Where the outlines of these levels of this store are saved."""
+    key_parts = (fingerprint, tuple(levels))
+    key = hashlib.sha256(repr(key_parts).encode()).hexdigest()
+    return os.path.join(dir_region_outlines, f'{key}.parquet')
+
+
+def find_region_codes(level, path_to_lookup=None):
+    """
+    Region codes for the region names of one level.
+
+    Inputs
+    ------
+    level          - str. One of the keys of region_code_cols.
+    path_to_lookup - str or None. Another csv to look in as well as
+                     region_code_files.
+
+    Returns
+    -------
+    codes - dict. Region name to region code.
+    """
+    col_name, col_code = region_code_cols[level]
+    paths = region_code_files + (
+        [] if path_to_lookup is None else [path_to_lookup])
+    codes = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        cols = pd.read_csv(path, nrows=0).columns
+        if (col_name not in cols) or (col_code not in cols):
+            continue
+        df = pd.read_csv(path, usecols=[col_name, col_code]).dropna()
+        codes.update(zip(df[col_name], df[col_code]))
+    return codes
+
+
+def build_region_outlines(levels=outline_levels, path_to_lookup=None):
+    """
+    Merge the LSOA in the geometry store into their regions.
+
+    Inputs
+    ------
+    levels         - list. Region levels from the geometry store.
+    path_to_lookup - str or None. Extra csv for region codes, see
+                     find_region_codes().
+
+    Returns
+    -------
+    gdf - GeoDataFrame. One row per region with columns 'level',
+          'region', 'region_code', 'geometry' (EPSG:4326) and
+          'geometry_bng' (EPSG:27700).
+    """
+    store = load_geometry_store()
+    dissolver = load_store_dissolver()
+    dfs = []
+    for level in levels:
+        if level not in region_levels:
+            raise KeyError(f'{level} is not a level in the geometry store.')
+        names = store.region_names[level]
+        if len(names) == 0:
+            raise KeyError(
+                f'No {level} regions in the geometry store. Rebuild it '
+                'with an LSOA lookup that names them, see '
+                'geometry_store.save_geometry_store().'
+                )
+        codes = find_region_codes(level, path_to_lookup)
+        # Region number of each LSOA is already the group number:
+        geometries = dissolver.dissolve(store.gdf[level].values, len(names))
+        dfs.append(pd.DataFrame({
+            'level': level,
+            'region': names,
+            'region_code': [codes.get(name, name) for name in names],
+            'geometry': geometries,
+        }).dropna(subset='geometry'))
+    gdf = geopandas.GeoDataFrame(
+        pd.concat(dfs, ignore_index=True), crs=store.gdf.crs)
+    gdf['geometry_bng'] = gdf.geometry.to_crs('EPSG:27700')
+    return gdf
+
+
+def save_region_outlines(path_to_lookup=None):
+    """
+    Build the region outlines and save them to
+    data_maps/prepared/region_outlines/.
+    """
+    gdf = build_region_outlines(path_to_lookup=path_to_lookup)
+    # The store exists now, so this is the store they came from:
+    os.makedirs(dir_region_outlines, exist_ok=True)
+    gdf.to_parquet(path_to_region_outlines(store_fingerprint()))
+    return gdf
+
+
+@st.cache_resource(max_entries=2)
+def _load_region_outlines(fingerprint):
+    path = path_to_region_outlines(fingerprint)
+    if not os.path.exists(path):
+        return save_region_outlines()
+    return geopandas.read_parquet(path)
+
+
+def load_region_outlines():
+    """
+    Shared outlines of every level in outline_levels. Build them
+    first if they don't exist for the current geometry store.
+
+    Don't change the returned data in place because every session
+    shares it.
+    """
+    # Make sure the store exists before taking its fingerprint:
+    load_geometry_store()
+    return _load_region_outlines(store_fingerprint())
+
+
+def select_region_outlines(level, crs='EPSG:27700'):
+    """
+    Outlines of the regions in one level.
+
+    Inputs
+    ------
+    level - str. One of outline_levels, e.g. 'lhb' or 'stp'.
+    crs   - str. Coordinate system of the polygons, either of the
+            ones kept in the geometry store.
+
+    Returns
+    -------
+    gdf - GeoDataFrame. One row per region indexed by 'region_code',
+          with columns 'region' and 'geometry'.
+    """
+    if level not in outline_levels:
+        raise KeyError(
+            f'No region outlines for {level}. '
+            f'Outlines are made for {", ".join(outline_levels)}.'
+            )
+    gdf = load_region_outlines()
+    gdf = gdf[gdf['level'] == level]
+    geometry = gdf[geometry_cols[crs]]
+    return geopandas.GeoDataFrame(
+        {'region': gdf['region'].values},
+        index=pd.Index(gdf['region_code'].values, name='region_code'),
+        geometry=geometry.values,
+        crs=geometry.crs
+        )
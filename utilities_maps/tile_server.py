@@ -0,0 +1,83 @@
+"""
+Serve the COG rasters to the maps as web map tiles.
+
+Instead of putting each whole raster into the page as one big image,
+a local tile server (localtileserver, running in a background thread)
+cuts 256x256 pixel Web-Mercator tiles out of the COGs when the
+browser asks for them. The COGs' own georeferencing is used, so the
+map only fetches the tiles in view at the current zoom.
+
+The browser has to be able to reach the tile server. That works when
+the app runs on the same computer as the browser. Behind a proxy, set
+the LOCALTILESERVER_CLIENT_PREFIX environment variable as described
+in the localtileserver documentation.
+"""
+import streamlit as st
+from localtileserver import TileClient, get_folium_tile_layer
+
+
+# The COGs store red, green, blue and alpha as floats from 0 to 1.
+# This large-image style turns each band back into its colour channel.
+rgba_style = {
+    'bands': [
+        {'band': 1, 'palette': ['#000000', '#ff0000'], 'min': 0, 'max': 1},
+        {'band': 2, 'palette': ['#000000', '#00ff00'], 'min': 0, 'max': 1},
+        {'band': 3, 'palette': ['#000000', '#0000ff'], 'min': 0, 'max': 1},
+        {'band': 4, 'palette': ['#ffffff00', '#ffffffff'],
+         'min': 0, 'max': 1, 'composite': 'multiply'},
+    ]
+}
+
+
+def value_style(cbar_dict):
+    """large-image style that colours a single-band COG of values."""
+    return {
+        'bands': [
+            {'band': 1, 'palette': cbar_dict['cmap'],
+             'min': cbar_dict['min'], 'max': cbar_dict['max']},
+        ]
+    }
+
+
+@st.cache_resource
+def get_tile_client(file_name):
+    """
+    Shared tile server for one COG.
+
+    The server keeps running for as long as the app does, so every
+    session uses the same one.
+    """
+    return TileClient(file_name)
+
+
+def make_cog_tile_layer(
+        file_name, layer_name='Cog layer', alpha=1.0, visible=True,
+        overlay=False, cbar_dict=None
+        ):
+    """
+    folium.TileLayer that fetches tiles of a COG from the tile server.
+
+    Inputs
+    ------
+    file_name  - str. Path to the COG.
+    layer_name - str. Name in the layer controls.
+    alpha      - float. Opacity of the layer.
+    visible    - bool. Whether the layer is shown on load.
+    overlay    - bool. False to make it a base layer so only one of
+                 the rasters shows at once, like the ImageOverlays.
+    cbar_dict  - dict or None. Colour bar for a single-band COG of
+                 values. None for the RGBA COGs.
+
+    Returns
+    -------
+    tile_layer - folium.TileLayer.
+    """
+    return get_folium_tile_layer(
+        get_tile_client(file_name),
+        style=rgba_style if cbar_dict is None else value_style(cbar_dict),
+        name=layer_name,
+        opacity=alpha,
+        overlay=overlay,
+        show=visible,
+        attr='Stroke outcome modelling',
+        )
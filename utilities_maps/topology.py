@@ -0,0 +1,484 @@
+"""
+Convert LSOA geojson to TopoJSON.
+
+In geojson every polygon lists all of its own border points, so a
+border between two neighbouring LSOA is written out twice. TopoJSON
+stores each piece of border ("arc") once and each polygon lists which
+arcs it is made of. The points are also rounded to a grid
+("quantised") and written as small integer steps from the previous
+point, which shrinks the file further.
+
+The conversion here assumes that neighbouring polygons share exactly
+the same border points, as they do in the LSOA boundary files. Any
+set of LSOA or of dissolved colour bands can be converted.
+"""
+import streamlit as st
+import os
+import numpy as np
+import shapely
+
+from utilities_maps.load_data import dir_prepared, read_json, write_json
+from utilities_maps.geometry_store import (
+    load_geometry_store, import_region_geojson)
+
+
+path_to_store_topology = os.path.join(dir_prepared, 'lsoa_topology.json')
+
+
+def _quantise_ring(ring, x0, y0, kx, ky):
+    """
+    Snap one ring to the integer grid.
+
+    Returns a list of (x, y) int tuples without the repeated closing
+    point, or None if fewer than three points are left.
+    """
+    xy = np.asarray(ring, dtype=float)[:, :2]
+    q = np.empty(xy.shape, dtype=np.int64)
+    q[:, 0] = np.round((xy[:, 0] - x0) / kx)
+    q[:, 1] = np.round((xy[:, 1] - y0) / ky)
+    # Points that have snapped onto the one before are dropped:
+    keep = np.ones(len(q), dtype=bool)
+    keep[1:] = np.any(q[1:] != q[:-1], axis=1)
+    q = q[keep]
+    if len(q) > 1 and np.all(q[0] == q[-1]):
+        q = q[:-1]
+    if len(q) < 3:
+        return None
+    return [tuple(p) for p in q.tolist()]
+
+
+def _polygons_of(geometry):
+    """List of polygons (lists of rings) in a geojson geometry."""
+    if geometry is None:
+        return []
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    else:
+        raise ValueError(
+            f'Only polygons can be converted, not {geometry["type"]}.')
+
+
+def _find_junctions(rings):
+    """
+    Points where borders meet or split.
+
+    A point that isn't a junction has the same two neighbours in
+    every ring that it's in. Anywhere that the neighbours differ,
+    the rings stop sharing a border.
+    """
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring)
+        for i, p in enumerate(ring):
+            a = ring[i - 1]
+            b = ring[(i + 1) % n]
+            pair = (a, b) if a < b else (b, a)
+            if neighbours.setdefault(p, pair) != pair:
+                junctions.add(p)
+    return junctions
+
+
+class _ArcStore:
+    """Arcs found so far and where to find each one."""
+    def __init__(self):
+        self.arcs = []
+        self._index = {}
+
+    def add(self, points):
+        """
+        Index of this arc, adding it if it's new.
+
+        An arc that's the reverse of a stored arc is referred to as
+        ~index (i.e. -index - 1) as in the TopoJSON specification.
+        """
+        key = tuple(points)
+        i = self._index.get(key)
+        if i is not None:
+            return i
+        i = self._index.get(key[::-1])
+        if i is not None:
+            return ~i
+        i = len(self.arcs)
+        self._index[key] = i
+        self.arcs.append(points)
+        return i
+
+
+def _cut_ring(ring, junctions, arc_store):
+    """Split a ring into arcs at the junctions. Returns arc indices."""
+    starts = [i for i, p in enumerate(ring) if p in junctions]
+    if len(starts) == 0:
+        # A ring that touches nothing (or exactly matches a hole or
+        # island) is one closed arc. Start it at its smallest point
+        # so that the same ring in another polygon matches it.
+        i = ring.index(min(ring))
+        rotated = ring[i:] + ring[:i]
+        return [arc_store.add(rotated + [rotated[0]])]
+    # Start at the first junction and go round the ring once:
+    rotated = ring[starts[0]:] + ring[:starts[0]]
+    rotated.append(rotated[0])
+    cuts = [i - starts[0] for i in starts] + [len(ring)]
+    return [
+        arc_store.add(rotated[cuts[j]:cuts[j + 1] + 1])
+        for j in range(len(cuts) - 1)
+    ]
+
+
+def geojson_to_topojson(
+        geojson, object_name='lsoa', quantization=1e5, property_names=None):
+    """
+    Convert a geojson of polygons to quantised TopoJSON.
+
+    Inputs
+    ------
+    geojson        - dict. GeoJSON FeatureCollection of Polygons and
+                     MultiPolygons, e.g. a selection from the geometry
+                     store or a GeoDataFrame of dissolved colour bands
+                     (gdf.__geo_interface__).
+    object_name    - str. Name of the one object in the topology.
+    quantization   - number. Grid size across the whole area. 1e5 is
+                     about 10m for England and Wales.
+    property_names - list or None. Properties to keep. None keeps
+                     all of them.
+
+    Returns
+    -------
+    topology - dict. TopoJSON Topology with one GeometryCollection in
+               topology['objects'][object_name].
+    """
+    features = geojson['features']
+
+    # Bounding box of all points:
+    all_points = np.concatenate([
+        np.asarray(ring, dtype=float)[:, :2]
+        for feature in features
+        for polygon in _polygons_of(feature.get('geometry'))
+        for ring in polygon
+    ])
+    x0, y0 = all_points.min(axis=0)
+    x1, y1 = all_points.max(axis=0)
+    kx = (x1 - x0) / (quantization - 1) if x1 > x0 else 1.0
+    ky = (y1 - y0) / (quantization - 1) if y1 > y0 else 1.0
+
+    # Quantise every ring, keeping the polygon structure:
+    feature_polygons = []
+    for feature in features:
+        polygons = []
+        for polygon in _polygons_of(feature.get('geometry')):
+            rings = [_quantise_ring(ring, x0, y0, kx, ky) for ring in polygon]
+            # Skip polygons that have shrunk to nothing:
+            if rings[0] is None:
+                continue
+            polygons.append([r for r in rings if r is not None])
+        feature_polygons.append(polygons)
+
+    junctions = _find_junctions(
+        ring for polygons in feature_polygons
+        for polygon in polygons for ring in polygon)
+
+    arc_store = _ArcStore()
+    geometries = []
+    for feature, polygons in zip(features, feature_polygons):
+        arcs = [
+            [_cut_ring(ring, junctions, arc_store) for ring in polygon]
+            for polygon in polygons
+        ]
+        if len(arcs) == 0:
+            geometry = {'type': None}
+        elif len(arcs) == 1:
+            geometry = {'type': 'Polygon', 'arcs': arcs[0]}
+        else:
+            geometry = {'type': 'MultiPolygon', 'arcs': arcs}
+
+        properties = feature.get('properties') or {}
+        if property_names is not None:
+            properties = {k: properties.get(k) for k in property_names}
+        geometry['properties'] = properties
+        if 'id' in feature:
+            geometry['id'] = feature['id']
+        geometries.append(geometry)
+
+    # Each arc is its first point then steps from the point before:
+    arcs = []
+    for points in arc_store.arcs:
+        points = np.array(points, dtype=np.int64)
+        points[1:] = np.diff(points, axis=0)
+        arcs.append(points.tolist())
+
+    topology = {
+        'type': 'Topology',
+        'bbox': [float(x0), float(y0), float(x1), float(y1)],
+        'transform': {
+            'scale': [float(kx), float(ky)],
+            'translate': [float(x0), float(y0)]
+        },
+        'objects': {
+            object_name: {
+                'type': 'GeometryCollection',
+                'geometries': geometries
+            }
+        },
+        'arcs': arcs
+    }
+    return topology
+
+
+@st.cache_resource
+def import_region_topojson(level, regions, object_name='lsoa'):
+    """
+    Cached TopoJSON of the LSOA in these regions.
+
+    Inputs
+    ------
+    level       - str. A region level of the geometry store.
+    regions     - tuple. Region names in that level.
+    object_name - str. Name of the object in the topology.
+
+    Returns
+    -------
+    topology - dict. Don't change this in place because every session
+               shares it. Use copy_topojson_properties() first.
+    """
+    return geojson_to_topojson(
+        import_region_geojson(level, regions),
+        object_name=object_name
+        )
+
+
+def copy_topojson_properties(topology):
+    """
+    Copy of a topology with new properties dicts but shared arcs.
+
+    folium.TopoJson writes the style of each feature into its
+    properties, so give it this copy instead of the shared topology.
+    """
+    topology = dict(topology)
+    topology['objects'] = {
+        name: {
+            **obj,
+            'geometries': [
+                {**g, 'properties': dict(g.get('properties') or {})}
+                for g in obj['geometries']
+            ]
+        }
+        for name, obj in topology['objects'].items()
+    }
+    return topology
+
+
+def _split_pinched_ring(ring):
+    """
+    Split a closed ring that passes through the same point twice.
+
+    This happens where a group's areas only meet at a corner. A ring
+    that touches itself isn't valid, so each loop becomes its own ring.
+    Rings with fewer than four points are dropped.
+    """
+    if len(np.unique(ring[:-1], axis=0)) == len(ring) - 1:
+        return [ring] if len(ring) >= 4 else []
+    rings = []
+    stack = []
+    seen = {}
+    for point in map(tuple, ring):
+        if point in seen:
+            # Cut off the loop back to the last visit:
+            i = seen[point]
+            loop = stack[i:] + [point]
+            for p in stack[i + 1:]:
+                del seen[p]
+            del stack[i + 1:]
+            if len(loop) >= 4:
+                rings.append(np.array(loop))
+        else:
+            seen[point] = len(stack)
+            stack.append(point)
+    return rings
+
+
+class TopologyDissolver:
+    """
+    Quickly merge the areas of a topology into groups.
+
+    Two areas in the same group share an arc, so a group's outline is
+    made of the arcs that have a different group (or nothing) on the
+    other side. Those arcs are joined end to end into rings. Nothing
+    has to be intersected, so this is much quicker than a polygon
+    union and gives exactly the same borders as the areas.
+
+    Attributes
+    ----------
+    n_areas - int. Number of areas (geometries) in the topology.
+    """
+    def __init__(self, topology, object_name='lsoa'):
+        geometries = topology['objects'][object_name]['geometries']
+        self.n_areas = len(geometries)
+        self._scale = np.array(topology['transform']['scale'])
+        self._translate = np.array(topology['transform']['translate'])
+        # Undo the steps to get the grid points of each arc:
+        self._arcs = [
+            np.cumsum(np.array(arc, dtype=np.int64), axis=0)
+            for arc in topology['arcs']
+        ]
+        # The (up to) two areas on either side of each arc:
+        users = np.full((len(self._arcs), 2), -1, dtype=np.int64)
+        n_users = np.zeros(len(self._arcs), dtype=np.int64)
+        for row, geometry in enumerate(geometries):
+            if geometry['type'] == 'Polygon':
+                polygons = [geometry['arcs']]
+            elif geometry['type'] == 'MultiPolygon':
+                polygons = geometry['arcs']
+            else:
+                polygons = []
+            for polygon in polygons:
+                for ring in polygon:
+                    for a in ring:
+                        a = a if a >= 0 else ~a
+                        if n_users[a] < 2:
+                            users[a, n_users[a]] = row
+                        n_users[a] += 1
+        self._users = users
+
+    def _stitch_rings(self, arc_ids):
+        """Join arcs end to end into closed rings of grid points."""
+        ends = {}
+        for a in arc_ids:
+            ends.setdefault(tuple(self._arcs[a][0]), []).append(a)
+            ends.setdefault(tuple(self._arcs[a][-1]), []).append(a)
+        used = set()
+        rings = []
+        for a in arc_ids:
+            if a in used:
+                continue
+            used.add(a)
+            points = [self._arcs[a]]
+            start = tuple(self._arcs[a][0])
+            end = tuple(self._arcs[a][-1])
+            while end != start:
+                b = next((b for b in ends[end] if b not in used), None)
+                if b is None:
+                    # Not a closed ring. Shouldn't happen for areas
+                    # that fit together.
+                    break
+                used.add(b)
+                arc = self._arcs[b]
+                if tuple(arc[0]) != end:
+                    arc = arc[::-1]
+                points.append(arc[1:])
+                end = tuple(arc[-1])
+            rings += _split_pinched_ring(np.concatenate(points))
+        return [ring * self._scale + self._translate for ring in rings]
+
+    @staticmethod
+    def _rings_to_geometry(rings):
+        """
+        Polygons from rings, with rings inside other rings as holes.
+
+        A ring inside an odd number of other rings is a hole, and a
+        ring inside an even number (e.g. an island in a lake) is
+        another outside edge.
+        """
+        ring_polygons = np.array([shapely.Polygon(r) for r in rings])
+        points = shapely.point_on_surface(ring_polygons)
+        areas = shapely.area(ring_polygons)
+        # For each ring, the other rings that it is inside:
+        inside = [
+            np.flatnonzero(
+                (areas > areas[i])
+                & shapely.contains(ring_polygons, points[i])
+                ).tolist()
+            for i in range(len(rings))
+        ]
+        polygons = []
+        for i, containers in enumerate(inside):
+            if len(containers) % 2 == 1:
+                continue
+            holes = [
+                rings[j] for j in range(len(rings))
+                if i in inside[j] and len(inside[j]) == len(containers) + 1
+            ]
+            polygons.append(shapely.Polygon(rings[i], holes))
+        if len(polygons) == 1:
+            return polygons[0]
+        return shapely.MultiPolygon(polygons)
+
+    def dissolve(self, groups, n_groups=None):
+        """
+        Outline of each group of areas.
+
+        Inputs
+        ------
+        groups   - np.array. Group number of each area, in the same
+                   order as the geometries in the topology. Areas
+                   with a negative number are left out.
+        n_groups - int or None. Number of groups. Defaults to the
+                   largest group number plus one.
+
+        Returns
+        -------
+        geometries - list. shapely Polygon or MultiPolygon for each
+                     group, or None for a group with no areas.
+        """
+        groups = np.asarray(groups)
+        if n_groups is None:
+            n_groups = groups.max() + 1
+        # Group on each side of each arc, -1 for nothing:
+        arc_groups = np.append(groups, -1)[self._users]
+        # Arcs with the same group on both sides are inside the group:
+        boundary = np.flatnonzero(arc_groups[:, 0] != arc_groups[:, 1])
+        # Match up the boundary arcs with the groups they outline:
+        arc_ids = np.concatenate([boundary, boundary])
+        arc_owners = np.concatenate(
+            [arc_groups[boundary, 0], arc_groups[boundary, 1]])
+        mask = arc_owners >= 0
+        arc_ids = arc_ids[mask]
+        arc_owners = arc_owners[mask]
+        order = np.argsort(arc_owners, kind='stable')
+        splits = np.searchsorted(arc_owners[order], np.arange(n_groups + 1))
+
+        geometries = []
+        for g in range(n_groups):
+            group_arcs = arc_ids[order[splits[g]:splits[g + 1]]].tolist()
+            rings = self._stitch_rings(group_arcs)
+            if len(rings) == 0:
+                geometries.append(None)
+            else:
+                geometry = self._rings_to_geometry(rings)
+                # A few of the LSOA overlap a little:
+                if not geometry.is_valid:
+                    geometry = shapely.make_valid(geometry)
+                geometries.append(geometry)
+        return geometries
+
+
+def save_store_topology():
+    """
+    Convert the whole geometry store to TopoJSON and save it to
+    data_maps/prepared/. The areas are in the same order as the rows
+    of the store.
+    """
+    store = load_geometry_store()
+    topology = geojson_to_topojson(
+        store.gdf[['LSOA11CD', 'geometry']].__geo_interface__,
+        # Finer grid so the outlines match the LSOA to about 1m:
+        quantization=1e6,
+        property_names=['LSOA11CD']
+        )
+    os.makedirs(dir_prepared, exist_ok=True)
+    write_json(topology, path_to_store_topology)
+    return topology
+
+
+@st.cache_resource
+def load_store_dissolver():
+    """
+    Shared TopologyDissolver for every LSOA in the geometry store.
+    Make the TopoJSON first if it doesn't exist.
+    """
+    if os.path.exists(path_to_store_topology):
+        topology = read_json(path_to_store_topology)
+    else:
+        topology = save_store_topology()
+    return TopologyDissolver(topology)
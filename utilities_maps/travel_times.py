@@ -0,0 +1,126 @@
+"""
+Memory-mapped LSOA to stroke unit travel time matrix.
+
+data_maps/lsoa_travel_time_matrix_calibrated.csv has one row per LSOA
+and one column per stroke unit. Parsing the whole csv takes a while
+and most pages only use a few of its columns. Here it is saved once
+in data_maps/prepared/travel_times/ as:
+
++ times.npy  - float32 travel times in minutes with one row per
+               unit, so each unit's times are together in the file.
++ index.json - the LSOA names (rows of the csv) and unit postcodes
+               (columns of the csv) in the same order as times.npy.
+
+times.npy is opened with np.memmap, so loading it reads nothing and
+only the units that are used are read from disk.
+"""
+import streamlit as st
+import os
+import numpy as np
+import pandas as pd
+
+from utilities_maps.load_data import dir_prepared, read_json, write_json
+
+
+path_to_travel_time_csv = os.path.join(
+    'data_maps', 'lsoa_travel_time_matrix_calibrated.csv')
+dir_travel_times = os.path.join(dir_prepared, 'travel_times')
+path_to_travel_time_array = os.path.join(dir_travel_times, 'times.npy')
+path_to_travel_time_index = os.path.join(dir_travel_times, 'index.json')
+
+
+def save_travel_times(path_to_csv=path_to_travel_time_csv):
+    """
+    Convert the travel time csv to a float32 array and index files in
+    data_maps/prepared/travel_times/.
+
+    float32 keeps the calibrated times to well under a second, so
+    they aren't rounded to whole minutes as uint16 would need.
+    """
+    df = pd.read_csv(path_to_csv, index_col='LSOA')
+    os.makedirs(dir_travel_times, exist_ok=True)
+    # One row per unit so that a unit's column is one block of the file:
+    times = np.lib.format.open_memmap(
+        path_to_travel_time_array, mode='w+', dtype=np.float32,
+        shape=(df.shape[1], df.shape[0]))
+    times[:] = df.to_numpy(dtype=np.float32).T
+    times.flush()
+    del times
+    write_json({
+        'lsoa': df.index.astype(str).tolist(),
+        'units': df.columns.astype(str).tolist(),
+    }, path_to_travel_time_index)
+
+
+class TravelTimeMatrix:
+    """
+    Travel times in minutes from each LSOA to each unit.
+
+    Selecting columns works as it does for the DataFrame read from the
+    csv with index_col='LSOA', e.g. matrix[[unit1, unit2]], but only
+    the selected units are read.
+
+    Attributes
+    ----------
+    index   - pd.Index. LSOA names, named 'lsoa'.
+    columns - pd.Index. Unit postcodes.
+    """
+    def __init__(self, times, lsoa, units):
+        self._times = times
+        self.index = pd.Index(lsoa, name='lsoa')
+        self.columns = pd.Index(units)
+
+    @property
+    def shape(self):
+        return (len(self.index), len(self.columns))
+
+    def column(self, unit):
+        """
+        Travel times to one unit.
+
+        Returns
+        -------
+        times - np.array. float32, read-only because it is a view of
+                the file. One value per LSOA in self.index.
+        """
+        return self._times[self.columns.get_loc(unit)]
+
+    def to_frame(self, units=None):
+        """
+        DataFrame of some units in the same form as the csv.
+
+        Inputs
+        ------
+        units - list or None. Unit postcodes, or None for every unit.
+
+        Returns
+        -------
+        df - pd.DataFrame. One row per LSOA and one column per unit.
+             A copy, so it can be changed.
+        """
+        if units is None:
+            units = self.columns
+        return pd.DataFrame(
+            {unit: np.array(self.column(unit)) for unit in units},
+            index=self.index
+            )
+
+    def __getitem__(self, units):
+        if isinstance(units, str):
+            return pd.Series(
+                np.array(self.column(units)), index=self.index, name=units)
+        return self.to_frame(list(units))
+
+
+@st.cache_resource
+def load_travel_times():
+    """
+    Shared travel time matrix. Make the prepared files first if they
+    don't exist.
+    """
+    if not (os.path.exists(path_to_travel_time_array) and
+            os.path.exists(path_to_travel_time_index)):
+        save_travel_times()
+    times = np.load(path_to_travel_time_array, mmap_mode='r')
+    index = read_json(path_to_travel_time_index)
+    return TravelTimeMatrix(times, index['lsoa'], index['units'])
@@ -0,0 +1,114 @@
+"""
+Single-band COGs of the outcome values, coloured when they're drawn.
+
+The outcome COGs in data_maps/ have their colours baked in, so a new
+colour map or colour bar range would mean making the rasters again.
+Here each of them is turned back into a float32 COG of the outcome
+values (see raster_algebra.colours_to_values()) and saved in
+data_maps/prepared/values/. NaN is no data.
+
+The values are coloured with a 256-entry lookup table just before
+they're drawn (raster_algebra.apply_colour_lut()). That's one array
+index, so changing the colour map or range in tiff_cbar_dicts is
+cheap and doesn't touch the rasters.
+"""
+import os
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.io import MemoryFile
+
+from utilities_maps.load_data import dir_prepared
+from utilities_maps.fixed_params import (
+    outcome_type_dict, tiff_cbar_dicts, make_cog_file_list)
+from utilities_maps.raster_algebra import colours_to_values
+
+
+dir_values = os.path.join(dir_prepared, 'values')
+
+
+def path_to_value_cog(file_name):
+    """Where the value COG made from a coloured COG is saved."""
+    name = os.path.basename(file_name).replace('_cog.tif', '_values.tif')
+    return os.path.join(dir_values, name)
+
+
+def build_value_cog(file_name, cbar_dict, path_to_values):
+    """
+    Save a single-band COG of the values of a coloured COG.
+
+    Inputs
+    ------
+    file_name      - str. Path to the coloured COG.
+    cbar_dict      - dict. The colour bar that coloured it.
+    path_to_values - str. Where to save the value COG.
+    """
+    with rasterio.open(file_name) as src:
+        profile = src.profile
+        values = colours_to_values(src.read(), cbar_dict)
+
+    profile.update(count=1, dtype='float32', nodata=np.nan)
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(values, 1)
+        # The COG driver adds the overviews and puts the blocks in
+        # the right order. Use nearest so that no-data edges don't
+        # bleed in, as in the coloured COGs:
+        rasterio.shutil.copy(
+            memfile.name, path_to_values, driver='COG',
+            BLOCKSIZE=512, COMPRESS='DEFLATE', PREDICTOR=3,
+            OVERVIEW_RESAMPLING='NEAREST'
+            )
+
+
+def _value_cog_sources(outcome_type):
+    """Each coloured COG of this outcome type and its colour bar."""
+    outcome_cbar_dict, diff_cbar_dict = tiff_cbar_dicts[outcome_type]
+    # Every third COG is a difference map:
+    return [
+        (file_name, diff_cbar_dict if t % 3 == 2 else outcome_cbar_dict)
+        for t, file_name in enumerate(make_cog_file_list(outcome_type))
+    ]
+
+
+def save_value_cogs():
+    """Make the value COGs of every outcome COG in data_maps/."""
+    os.makedirs(dir_values, exist_ok=True)
+    for outcome_type in outcome_type_dict.values():
+        for file_name, cbar_dict in _value_cog_sources(outcome_type):
+            if not os.path.exists(file_name):
+                continue
+            build_value_cog(file_name, cbar_dict, path_to_value_cog(file_name))
+
+
+def make_value_file_list(outcome_type):
+    """
+    Full paths to the six value COGs for this outcome type.
+
+    Any that don't exist yet are made from this outcome type's
+    coloured COGs. The difference maps can be worked out from the
+    scenario maps (see raster_algebra.RasterExpression), so a missing
+    coloured difference COG is skipped and its path won't exist.
+
+    Raises
+    ------
+    FileNotFoundError - if a coloured scenario COG doesn't exist, so
+                        its values can't be made.
+    """
+    sources = _value_cog_sources(outcome_type)
+    missing = [
+        file_name for t, (file_name, cbar_dict) in enumerate(sources)
+        if (t % 3 != 2) and not os.path.exists(file_name)
+    ]
+    if len(missing) > 0:
+        raise FileNotFoundError(
+            f'Missing COGs for {outcome_type}: {", ".join(missing)}')
+
+    file_names = []
+    for file_name, cbar_dict in sources:
+        path_to_values = path_to_value_cog(file_name)
+        if not os.path.exists(path_to_values) and os.path.exists(file_name):
+            os.makedirs(dir_values, exist_ok=True)
+            build_value_cog(file_name, cbar_dict, path_to_values)
+        file_names.append(path_to_values)
+    return file_names